@@ -1,57 +1,203 @@
 import asyncio
 import re
 import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-try:
-    from google.api_core.exceptions import ResourceExhausted, GoogleAPICallError
-except ImportError:
-    class ResourceExhausted(Exception): pass
-    class GoogleAPICallError(Exception): pass
+
+@lru_cache(maxsize=1)
+def _google_api_error_types() -> Tuple[type, type]:
+    """Imports the google.api_core exception types on first use (the import is slow)."""
+    try:
+        from google.api_core.exceptions import ResourceExhausted, GoogleAPICallError
+    except ImportError:
+        class ResourceExhausted(Exception): pass
+        class GoogleAPICallError(Exception): pass
+    return ResourceExhausted, GoogleAPICallError
 
 # --- API Key Manager ---
+DEFAULT_COOLDOWN_SECONDS = 60  # per-minute quotas reset within a minute
+MAX_COOLDOWN_SECONDS = 15 * 60  # cap of the backoff when a key keeps failing without a retry hint
+QUOTA_RESET_TIMEZONE = "America/Los_Angeles"  # Gemini daily quotas reset at midnight Pacific time
+
+RETRY_HINT_PATTERNS = [
+    re.compile(r"retry_?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE),  # RetryInfo detail
+    re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE),  # "Please retry in 37.5s."
+    re.compile(r"retry-after['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)", re.IGNORECASE),  # HTTP header
+]
+DAILY_QUOTA_PATTERN = re.compile(r"per_?day|daily", re.IGNORECASE)
+
+
+@dataclass
+class QuotaHint:
+    retry_after: Optional[float]  # seconds, when the error said how long to wait
+    daily: bool  # the daily quota (not the per-minute one) ran out
+
+
+def parse_quota_error(e: Exception) -> QuotaHint:
+    """Reads the retry delay and the quota window (per minute or per day) from a 429 error."""
+    error_str = str(e.__cause__ or e)
+    retry_after = None
+    for pattern in RETRY_HINT_PATTERNS:
+        match = pattern.search(error_str)
+        if match:
+            retry_after = float(match.group(1))
+            break
+    return QuotaHint(retry_after=retry_after, daily=bool(DAILY_QUOTA_PATTERN.search(error_str)))
+
+
+def seconds_until_daily_reset(now: Optional[datetime] = None) -> float:
+    """Seconds until the next midnight in Pacific time, when the daily quotas reset."""
+    try:
+        tz = ZoneInfo(QUOTA_RESET_TIMEZONE)
+    except ZoneInfoNotFoundError:
+        tz = timezone(timedelta(hours=-8))
+    now = now or datetime.now(tz)
+    next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (next_midnight - now).total_seconds()
+
+
+@dataclass
+class KeyHealth:
+    cooldown_until: float = 0.0  # monotonic time the key may be used again
+    daily_exhausted: bool = False
+    consecutive_quota_errors: int = 0
+    quota_errors: int = 0
+    requests: int = 0
+
+
 class ApiKeyManager:
-    def __init__(self, api_keys: List[str]):
+    """
+    Hands out API keys and tracks their health.
+
+    A key that hits a quota error is put in a timed cooldown (the retry delay of the error if it
+    has one, until the daily reset for daily quotas, otherwise a growing backoff starting at one
+    minute) and is brought back automatically once it expires. Keys are used in turn, so their
+    per-minute windows are shared out. When every key is cooling down, `wait_for_key` pauses
+    until the first one comes back instead of giving up.
+    """
+
+    def __init__(self, api_keys: List[str], pause_callback: Optional[Callable[[float], None]] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 daily_reset: Callable[[], float] = seconds_until_daily_reset):
         self.api_keys = [key for key in api_keys if key]
         if not self.api_keys:
             raise ValueError("No API keys provided to ApiKeyManager.")
-        self.current_key_index = 0
-        self.lock = asyncio.Lock()  # Protects access to the key index
+        self.health = [KeyHealth() for _ in self.api_keys]
+        self.next_key_index = 0
+        self.pause_callback = pause_callback
+        self.clock = clock
+        self.daily_reset = daily_reset  # seconds until the daily quotas reset
+        self.lock = asyncio.Lock()  # Protects the key health
+
+    def _available_key_index(self) -> int:
+        """Returns the next key (in turn) that is not cooling down, or -1 if there is none."""
+        now = self.clock()
+        for offset in range(len(self.api_keys)):
+            key_idx = (self.next_key_index + offset) % len(self.api_keys)
+            health = self.health[key_idx]
+            if health.cooldown_until <= now:
+                if health.daily_exhausted or health.cooldown_until:
+                    print(f"Key ...{self.api_keys[key_idx][-4:]} is back from its cooldown.")
+                    health.daily_exhausted = False
+                    health.cooldown_until = 0.0
+                self.next_key_index = (key_idx + 1) % len(self.api_keys)
+                return key_idx
+        return -1
 
     async def get_key_for_processing(self) -> Tuple[Union[str, None], int]:
-        """Returns the current API key and its original index, or (None, -1) if all keys are exhausted."""
+        """Returns an available API key and its original index, or (None, -1) if every key is cooling down."""
         async with self.lock:
-            if self.current_key_index >= len(self.api_keys):
+            key_idx = self._available_key_index()
+            if key_idx < 0:
                 return None, -1
-            return self.api_keys[self.current_key_index], self.current_key_index
+            self.health[key_idx].requests += 1
+            return self.api_keys[key_idx], key_idx
+
+    async def get_spare_key(self, exclude_key: str) -> Tuple[Union[str, None], int]:
+        """
+        Returns a key other than `exclude_key` that is not cooling down, without waiting, for a
+        hedged request. Returns (None, -1) if there is none.
+        """
+        async with self.lock:
+            now = self.clock()
+            for offset in range(len(self.api_keys)):
+                key_idx = (self.next_key_index + offset) % len(self.api_keys)
+                if self.api_keys[key_idx] != exclude_key and self.health[key_idx].cooldown_until <= now:
+                    self.next_key_index = (key_idx + 1) % len(self.api_keys)
+                    self.health[key_idx].requests += 1
+                    return self.api_keys[key_idx], key_idx
+            return None, -1
 
-    async def report_quota_error(self, failed_key_index: int):
+    def seconds_until_next_key(self) -> float:
+        return max(min(health.cooldown_until for health in self.health) - self.clock(), 0.0)
+
+    async def wait_for_key(self) -> Tuple[str, int]:
+        """Returns an available API key and its index, pausing while every key is cooling down."""
+        paused = False
+        while True:
+            api_key, key_idx = await self.get_key_for_processing()
+            if api_key is not None:
+                if paused and self.pause_callback:
+                    self.pause_callback(0)
+                return api_key, key_idx
+            wait_seconds = self.seconds_until_next_key()
+            if not paused:
+                paused = True
+                print(f"All API keys are cooling down. Pausing for {wait_seconds:.0f}s.")
+                if self.pause_callback:
+                    self.pause_callback(wait_seconds)
+            await asyncio.sleep(max(wait_seconds, 0.01))
+
+    async def report_success(self, key_idx: int):
+        async with self.lock:
+            self.health[key_idx].consecutive_quota_errors = 0
+
+    async def report_quota_error(self, failed_key_index: int, error: Optional[Exception] = None):
         """
-        Reports a quota error for a specific key index. Switches to the next key
-        if the failed key is still the currently active one.
+        Puts a key in cooldown after a quota error.
+
+        Args:
+            failed_key_index: The index of the key that hit the quota.
+            error: The quota error, used for its retry delay and quota window when present.
         """
+        hint = parse_quota_error(error) if error is not None else QuotaHint(retry_after=None, daily=False)
         async with self.lock:
-            # Only advance the key if the error is for the *current* key.
-            # This prevents a race condition where multiple tasks failing on the same
-            # old key would cause us to skip multiple fresh keys.
-            if self.current_key_index == failed_key_index:
-                old_key_str_for_log = self.api_keys[self.current_key_index][-4:]
-                self.current_key_index += 1
-                if self.current_key_index < len(self.api_keys):
-                    new_key_str_for_log = self.api_keys[self.current_key_index][-4:]
-                    print(
-                        f"Key ...{old_key_str_for_log} exhausted. Switching to API Key #{self.current_key_index + 1}"
-                        f" (ending ...{new_key_str_for_log}).")
-                else:
-                    print(f"Key ...{old_key_str_for_log} exhausted. All API keys have now been tried.")
-
-#    def are_all_keys_exhausted(self) -> bool:
-#        """Checks if all available API keys have been marked as exhausted."""
-#        # This can be called without a lock as it's a simple read.
-#        return self.current_key_index >= len(self.api_keys)
+            health = self.health[failed_key_index]
+            health.quota_errors += 1
+            health.consecutive_quota_errors += 1
+            if hint.daily:
+                cooldown = self.daily_reset()
+                health.daily_exhausted = True
+            elif hint.retry_after is not None:
+                cooldown = hint.retry_after
+            else:
+                cooldown = min(DEFAULT_COOLDOWN_SECONDS * 2 ** (health.consecutive_quota_errors - 1),
+                               MAX_COOLDOWN_SECONDS)
+            # Several requests in flight on the same key may fail together: keep the longest cooldown.
+            health.cooldown_until = max(health.cooldown_until, self.clock() + cooldown)
+            reason = "daily quota exhausted" if hint.daily else "rate limited"
+            print(f"Key ...{self.api_keys[failed_key_index][-4:]} {reason}; cooling down for {cooldown:.0f}s.")
+
+    def key_health(self) -> List[dict]:
+        """A snapshot of every key's state, for status reports."""
+        now = self.clock()
+        return [{
+            "key": f"...{api_key[-4:]}",
+            "state": ("daily_exhausted" if health.daily_exhausted and health.cooldown_until > now
+                      else "cooling_down" if health.cooldown_until > now else "available"),
+            "cooldown_seconds": round(max(health.cooldown_until - now, 0), 1),
+            "requests": health.requests,
+            "quota_errors": health.quota_errors,
+        } for api_key, health in zip(self.api_keys, self.health)]
 
 def is_quota_error(e: Exception) -> bool:
+    ResourceExhausted, GoogleAPICallError = _google_api_error_types()
     actual_error = e.__cause__ if e.__cause__ else e
     error_str = str(actual_error).upper()
     if isinstance(actual_error, ResourceExhausted):
@@ -0,0 +1,191 @@
+import json
+import re
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from app.checkpoint import atomic_write_bytes
+from app.ingestors import read_chapter_map
+from app.wav_handler import ConcatenatedAudio
+
+MANIFEST_FILE_NAME = "manifest.json"
+PLAYLIST_FILE_NAME = "playlist.m3u"
+SEGMENTS_DIR_NAME = "segments"
+
+SEGMENT_MODE_SINGLE = "single"  # only final_audio.wav
+SEGMENT_MODE_FIXED = "fixed"  # segments of about AUDIO_SEGMENT_SECONDS, cut between blocks
+SEGMENT_MODE_CHAPTERS = "chapters"  # one segment per chapter
+SEGMENT_MODES = (SEGMENT_MODE_SINGLE, SEGMENT_MODE_FIXED, SEGMENT_MODE_CHAPTERS)
+
+# "Chapter 12", "CHAPTER XII" or "Capítulo 3" at the start of the text, of a paragraph or of a sentence
+CHAPTER_START_PATTERN = re.compile(
+    r"(?:^|(?<=\n\n)|(?<=[.!?…]\s))((?:Chapter|CHAPTER|Cap[ií]tulo|CAP[IÍ]TULO)\s+(?:\d+|[IVXLCDM]+)\b)")
+MAX_CHAPTER_TITLE_LENGTH = 60
+SNAP_WINDOW_SECONDS = 1.5  # a chapter start is moved to the quietest point this close to its estimate
+SNAP_FRAME_SECONDS = 0.02
+COPY_CHUNK_FRAMES = 1 << 18
+
+
+@dataclass
+class ChapterMarker:
+    title: str
+    start_frame: int
+
+
+def _chapter_title(text: str, start: int) -> str:
+    """The heading plus the words after it on the same line, cut at a word boundary."""
+    line = text[start:].split("\n", 1)[0]
+    if len(line) <= MAX_CHAPTER_TITLE_LENGTH:
+        return line.strip()
+    return line[:MAX_CHAPTER_TITLE_LENGTH].rsplit(" ", 1)[0].strip() + "…"
+
+
+def _snap_to_silence(wav_file: wave.Wave_read, estimate: int) -> int:
+    """Moves a frame position to the quietest 20 ms around it, so cuts fall between words."""
+    sample_rate, channels = wav_file.getframerate(), wav_file.getnchannels()
+    window = int(SNAP_WINDOW_SECONDS * sample_rate)
+    start = max(estimate - window, 0)
+    wav_file.setpos(start)
+    samples = np.frombuffer(wav_file.readframes(2 * window), dtype="<i2").reshape(-1, channels)
+    step = int(SNAP_FRAME_SECONDS * sample_rate)
+    if len(samples) < step:
+        return estimate
+    energy = np.abs(samples[:len(samples) // step * step].astype(np.int32)).reshape(-1, step * channels).sum(axis=1)
+    return start + int(np.argmin(energy)) * step
+
+
+def find_chapter_markers(audio: ConcatenatedAudio, text_dir: Path) -> List[ChapterMarker]:
+    """
+    Places chapter markers in the audiobook from the text of its blocks.
+
+    Sources with chapter metadata (EPUB, HTML) start every chapter at a block, recorded in the
+    job's chapter map, so those chapters are placed at the start of their block. Otherwise a
+    heading found in a block's text is placed at the matching share of that block's audio
+    (its character position over the block's length), then moved to the nearest pause.
+
+    Args:
+        audio: The concatenated audiobook and the span of each block in it.
+        text_dir: The folder holding the blocks' text files (same names as the audio blocks).
+    """
+    chapter_map = read_chapter_map(text_dir)
+    if chapter_map:
+        return [ChapterMarker(chapter_map[block_name], first_frame)
+                for block_name, first_frame, _ in audio.block_spans if block_name in chapter_map]
+
+    markers = []
+    with wave.open(str(audio.path), "rb") as wav_file:
+        for block_name, first_frame, frames in audio.block_spans:
+            text_path = text_dir / f"{block_name}.txt"
+            if not text_path.exists():
+                continue
+            text = text_path.read_text(encoding="utf-8")
+            for match in CHAPTER_START_PATTERN.finditer(text):
+                offset = int(frames * match.start(1) / max(len(text), 1))
+                start_frame = first_frame if offset == 0 else _snap_to_silence(wav_file, first_frame + offset)
+                markers.append(ChapterMarker(_chapter_title(text, match.start(1)), start_frame))
+    return markers
+
+
+def _segment_boundaries(audio: ConcatenatedAudio, chapters: List[ChapterMarker], mode: str,
+                        segment_seconds: int) -> List[tuple]:
+    """Returns (start frame, end frame, title) for every segment."""
+    if mode == SEGMENT_MODE_CHAPTERS and chapters:
+        starts = [(chapter.start_frame, chapter.title) for chapter in chapters]
+        if starts[0][0] > audio.sample_rate:  # more than a second of audio before the first chapter
+            starts.insert(0, (0, "Introduction"))
+        else:
+            starts[0] = (0, starts[0][1])
+    else:
+        # Fixed length, cut at the first block boundary after each full segment.
+        segment_frames = segment_seconds * audio.sample_rate
+        starts = [(0, "Part 1")]
+        for _, first_frame, _ in audio.block_spans[1:]:
+            if first_frame - starts[-1][0] >= segment_frames:
+                starts.append((first_frame, f"Part {len(starts) + 1}"))
+
+    ends = [start for start, _ in starts[1:]] + [audio.total_frames]
+    return [(start, end, title) for (start, title), end in zip(starts, ends) if end > start]
+
+
+def write_segments(audio: ConcatenatedAudio, boundaries: List[tuple], segments_dir: Path) -> List[dict]:
+    """Copies each frame range of the final audio into its own WAV file, a chunk at a time."""
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    for old_segment in segments_dir.glob("segment*.wav"):
+        old_segment.unlink()
+
+    segments = []
+    with wave.open(str(audio.path), "rb") as source:
+        for index, (start, end, title) in enumerate(boundaries, start=1):
+            segment_path = segments_dir / f"segment{index:03d}.wav"
+            with wave.open(str(segment_path), "wb") as segment:
+                segment.setparams(source.getparams())
+                source.setpos(start)
+                for chunk_start in range(start, end, COPY_CHUNK_FRAMES):
+                    segment.writeframes(source.readframes(min(COPY_CHUNK_FRAMES, end - chunk_start)))
+            segments.append({
+                "file": f"{SEGMENTS_DIR_NAME}/{segment_path.name}",
+                "title": title,
+                "start_seconds": round(start / audio.sample_rate, 3),
+                "duration_seconds": round((end - start) / audio.sample_rate, 3),
+            })
+    return segments
+
+
+def _data_offset(path: Path) -> int:
+    """Byte offset of the first audio sample in a WAV file (the start of the 'data' chunk payload)."""
+    with open(path, "rb") as f:
+        header = f.read(4096)
+    return header.index(b"data") + 8
+
+
+def write_audiobook_index(audio: ConcatenatedAudio, text_dir: Path, mode: str = SEGMENT_MODE_SINGLE,
+                          segment_seconds: int = 600) -> dict:
+    """
+    Writes the audiobook's manifest and, for the segmented modes, its segments and playlist.
+
+    The manifest lists every block and chapter with its start time and its byte offset in
+    'final_audio.wav', so a player can jump to a chapter with a single HTTP Range request.
+
+    Args:
+        audio: The concatenated audiobook.
+        text_dir: The folder holding the blocks' text files, used for the chapter markers.
+        mode: "single", "fixed" (segments of about `segment_seconds`) or "chapters".
+        segment_seconds: Target segment length for the "fixed" mode.
+
+    Returns:
+        The manifest.
+    """
+    output_dir = audio.path.parent
+    frame_bytes = audio.channels * 2
+    data_offset = _data_offset(audio.path)
+    chapters = find_chapter_markers(audio, text_dir)
+
+    def position(frame: int) -> dict:
+        return {"start_seconds": round(frame / audio.sample_rate, 3), "byte_offset": data_offset + frame * frame_bytes}
+
+    manifest = {
+        "file": audio.path.name,
+        "duration_seconds": round(audio.total_frames / audio.sample_rate, 3),
+        "sample_rate": audio.sample_rate,
+        "channels": audio.channels,
+        "chapters": [{"title": chapter.title, **position(chapter.start_frame)} for chapter in chapters],
+        "blocks": [{"block": name, **position(first_frame)} for name, first_frame, _ in audio.block_spans],
+        "segments": [],
+    }
+
+    if mode != SEGMENT_MODE_SINGLE and audio.total_frames:
+        boundaries = _segment_boundaries(audio, chapters, mode, segment_seconds)
+        manifest["segments"] = write_segments(audio, boundaries, output_dir / SEGMENTS_DIR_NAME)
+        playlist = ["#EXTM3U"] + [
+            line for segment in manifest["segments"]
+            for line in (f"#EXTINF:{segment['duration_seconds']:.0f},{segment['title']}", segment["file"])
+        ]
+        atomic_write_bytes(output_dir / PLAYLIST_FILE_NAME, ("\n".join(playlist) + "\n").encode("utf-8"))
+        print(f"Wrote {len(manifest['segments'])} audio segment(s) and '{PLAYLIST_FILE_NAME}'.")
+
+    atomic_write_bytes(output_dir / MANIFEST_FILE_NAME, json.dumps(manifest, indent=2, ensure_ascii=False).encode("utf-8"))
+    print(f"Audiobook index saved with {len(chapters)} chapter marker(s).")
+    return manifest
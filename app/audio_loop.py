@@ -0,0 +1,178 @@
+import re
+import subprocess
+import wave
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from app.video_loop import LoopError, find_ffmpeg, CROSSFADE_TIME, LOOP_DURATION_SECONDS
+
+SAMPLE_FORMAT_BYTES = 2  # 16-bit PCM throughout
+STREAM_CHUNK_SECONDS = 10
+WAV_SIZE_LIMIT = 0xFFFFFFFF - 36  # RIFF sizes are 32-bit
+
+AUDIO_STREAM_PATTERN = re.compile(r"Audio:.*?(\d+) Hz, (mono|stereo|(\d+) channels)")
+ENCODER_ARGS = {
+    ".mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    ".m4a": ["-c:a", "aac", "-b:a", "192k"],
+    ".aac": ["-c:a", "aac", "-b:a", "192k"],
+    ".flac": ["-c:a", "flac"],
+    ".ogg": ["-c:a", "libvorbis", "-q:a", "6"],
+}
+
+
+def decode_audio(audio_path: Path) -> Tuple[np.ndarray, int]:
+    """
+    Decodes an audio file (or the audio track of a video) once into memory.
+
+    WAV files, such as the audiobooks written by `concatenate_audio_blocks`, are read directly;
+    anything else is decoded by ffmpeg to 16-bit PCM at its own sample rate and channel count.
+
+    Returns:
+        A tuple with an int16 array shaped (frames, channels) and the sample rate.
+    """
+    if audio_path.suffix.lower() == ".wav":
+        with wave.open(str(audio_path), "rb") as wav_file:
+            if wav_file.getsampwidth() != SAMPLE_FORMAT_BYTES:
+                raise LoopError(f"'{audio_path.name}' must be 16-bit PCM.")
+            channels, sample_rate = wav_file.getnchannels(), wav_file.getframerate()
+            samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2")
+        return samples.reshape(-1, channels), sample_rate
+
+    ffmpeg = find_ffmpeg()
+    summary = subprocess.run([ffmpeg, "-hide_banner", "-i", str(audio_path)], capture_output=True, text=True).stderr
+    match = AUDIO_STREAM_PATTERN.search(summary)
+    if not match:
+        raise LoopError(f"'{audio_path.name}' has no audio stream.")
+    sample_rate = int(match.group(1))
+    channels = {"mono": 1, "stereo": 2}.get(match.group(2)) or int(match.group(3))
+
+    result = subprocess.run([ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-i", str(audio_path),
+                             "-map", "0:a:0", "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+                             "-ac", str(channels), "pipe:1"], capture_output=True)
+    if result.returncode != 0:
+        raise LoopError(f"ffmpeg could not decode '{audio_path.name}': {result.stderr.decode(errors='replace')[-500:]}")
+    return np.frombuffer(result.stdout, dtype="<i2").reshape(-1, channels), sample_rate
+
+
+def build_loop_cycle(samples: np.ndarray, sample_rate: int, crossfade: float) -> np.ndarray:
+    """
+    Builds one loop cycle with a true equal-power crossfade, computed once.
+
+    The cycle is the audio from `crossfade` to the end, where the last `crossfade` seconds fade
+    out (cosine) while the first `crossfade` seconds fade in (sine). The cycle ends exactly where
+    the next one starts, the same layout as the video cycles of `loop_video`.
+    """
+    fade_frames = int(round(crossfade * sample_rate))
+    if fade_frames <= 0 or len(samples) <= 2 * fade_frames:
+        if fade_frames > 0:
+            print(f"Audio is too short for a {crossfade}s crossfade; looping it without one.")
+        return samples
+
+    position = (np.arange(fade_frames, dtype=np.float32) + 0.5) / fade_frames
+    fade_in = np.sin(position * np.pi / 2)[:, np.newaxis]
+    fade_out = np.cos(position * np.pi / 2)[:, np.newaxis]
+
+    tail = samples[-fade_frames:].astype(np.float32)
+    head = samples[:fade_frames].astype(np.float32)
+    transition = np.clip(np.rint(tail * fade_out + head * fade_in), -32768, 32767).astype("<i2")
+
+    return np.concatenate([samples[fade_frames:-fade_frames], transition])
+
+
+class _WavSink:
+    """Writes PCM chunks straight into a WAV file."""
+
+    def __init__(self, output_path: Path, sample_rate: int, channels: int):
+        self.wav_file = wave.open(str(output_path), "wb")
+        self.wav_file.setnchannels(channels)
+        self.wav_file.setsampwidth(SAMPLE_FORMAT_BYTES)
+        self.wav_file.setframerate(sample_rate)
+
+    def write(self, pcm: memoryview):
+        self.wav_file.writeframesraw(pcm)
+
+    def close(self):
+        self.wav_file.close()
+
+
+class _EncoderSink:
+    """Pipes PCM chunks into an ffmpeg encoder."""
+
+    def __init__(self, output_path: Path, sample_rate: int, channels: int):
+        encoder_args = ENCODER_ARGS.get(output_path.suffix.lower())
+        if encoder_args is None:
+            raise LoopError(f"Unsupported audio output format '{output_path.suffix}'.")
+        self.process = subprocess.Popen(
+            [find_ffmpeg(), "-hide_banner", "-loglevel", "error", "-y", "-f", "s16le", "-ar", str(sample_rate),
+             "-ac", str(channels), "-i", "pipe:0", *encoder_args, str(output_path)],
+            stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, pcm: memoryview):
+        self.process.stdin.write(pcm)
+
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise LoopError(f"ffmpeg failed to encode the looped audio: {stderr.decode(errors='replace')[-500:]}")
+
+
+def loop_audio(audio_path: Path, output_path: Path, target_seconds: float = LOOP_DURATION_SECONDS,
+               crossfade: float = CROSSFADE_TIME,
+               progress_callback: Optional[Callable[[float, float], None]] = None) -> Path:
+    """
+    Loops an audio file to `target_seconds` with an equal-power crossfade between repetitions.
+
+    The source is decoded once and the crossfade is computed once. The output is then streamed
+    chunk by chunk from that single cycle, so memory does not grow with the target duration.
+    WAV outputs are written directly; other formats (.mp3, .m4a, .flac, .ogg) are piped through
+    an ffmpeg encoder, whose speed then bounds the run time.
+
+    Args:
+        audio_path: The source audio (any format ffmpeg reads, or a WAV such as a finished audiobook).
+        output_path: Where the looped audio is written. Its extension selects the format.
+        target_seconds: Duration of the output.
+        crossfade: Crossfade between repetitions, in seconds.
+        progress_callback: Called with (seconds_done, target_seconds) as chunks are written.
+
+    Returns:
+        The output path.
+    """
+    samples, sample_rate = decode_audio(audio_path)
+    if len(samples) == 0:
+        raise LoopError(f"'{audio_path.name}' contains no audio.")
+
+    cycle = build_loop_cycle(samples, sample_rate, crossfade)
+    channels = cycle.shape[1]
+    cycle_bytes = memoryview(np.ascontiguousarray(cycle).tobytes())
+    frame_bytes = channels * SAMPLE_FORMAT_BYTES
+    total_bytes = int(round(target_seconds * sample_rate)) * frame_bytes
+    chunk_bytes = STREAM_CHUNK_SECONDS * sample_rate * frame_bytes
+
+    print(f"Looping audio: {total_bytes / len(cycle_bytes):.1f} cycle(s) of {len(cycle) / sample_rate:.2f}s"
+          f" with a {crossfade}-second equal-power crossfade.")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    if output_path.suffix.lower() == ".wav":
+        if total_bytes > WAV_SIZE_LIMIT:
+            raise LoopError("The looped audio exceeds the 4 GB WAV limit; choose a compressed output format.")
+        sink = _WavSink(output_path, sample_rate, channels)
+    else:
+        sink = _EncoderSink(output_path, sample_rate, channels)
+
+    written = 0
+    try:
+        while written < total_bytes:
+            offset = written % len(cycle_bytes)
+            size = min(chunk_bytes, len(cycle_bytes) - offset, total_bytes - written)
+            sink.write(cycle_bytes[offset:offset + size])
+            written += size
+            if progress_callback:
+                progress_callback(written / frame_bytes / sample_rate, target_seconds)
+    finally:
+        sink.close()
+
+    print(f"Final audio exported to: {output_path}")
+    return output_path
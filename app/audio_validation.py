@@ -0,0 +1,196 @@
+import struct
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# --- Narration pace ---
+DEFAULT_CHARACTERS_PER_SECOND = 15.0  # until enough accepted audio has been measured
+MIN_MEASURED_SECONDS = 300  # the measured pace is only trusted after this much accepted audio
+CHARACTERS_PER_SECOND_RANGE = (8.0, 25.0)  # a measurement outside this range is clamped to it
+
+# --- Checks ---
+MIN_DURATION_RATIO = 0.55  # shorter than this share of the expected duration: the narration was cut off
+MAX_DURATION_RATIO = 1.8  # longer: more than the text was read (e.g. the style instruction) or it was repeated
+MIN_CHECKED_SECONDS = 4.0  # the pace of a few words varies too much to judge their duration
+RMS_WINDOW_SECONDS = 0.05
+SPEECH_THRESHOLD_DBFS = -45.0  # a window louder than this holds speech
+MIN_SPEECH_SHARE = 0.35  # less of the block than this holds speech: near-silent
+MAX_RESYNTHESES = 2  # rejected takes of a block before its last take is kept anyway
+
+
+@dataclass
+class WavHeader:
+    channels: int
+    sample_rate: int
+    sample_width: int
+    data_offset: int  # byte offset of the first sample
+    data_bytes: int  # as announced by the header
+
+
+def read_wav_header(path: Path) -> WavHeader:
+    """
+    Reads a WAV file's format and the position of its samples, without reading the samples.
+
+    Raises:
+        ValueError: If the file is not a PCM WAV file.
+    """
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+            raise ValueError(f"'{path.name}' is not a WAV file.")
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"'{path.name}' has no audio data.")
+            chunk_id, size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", f.read(16))
+                f.seek(size - 16 + size % 2, 1)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"'{path.name}' has no format chunk.")
+                return WavHeader(channels=fmt[1], sample_rate=fmt[2], sample_width=fmt[5] // 8,
+                                 data_offset=f.tell(), data_bytes=size)
+            else:
+                f.seek(size + size % 2, 1)
+
+
+class NarrationPace:
+    """
+    The characters narrated per second, measured on the blocks that passed validation, from
+    which a block's expected duration is estimated.
+    """
+
+    _characters = 0
+    _seconds = 0.0
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, characters: int, seconds: float):
+        with cls._lock:
+            cls._characters += characters
+            cls._seconds += seconds
+
+    @classmethod
+    def characters_per_second(cls) -> float:
+        with cls._lock:
+            if cls._seconds < MIN_MEASURED_SECONDS:
+                return DEFAULT_CHARACTERS_PER_SECOND
+            pace = cls._characters / cls._seconds
+        return min(max(pace, CHARACTERS_PER_SECOND_RANGE[0]), CHARACTERS_PER_SECOND_RANGE[1])
+
+    @classmethod
+    def expected_seconds(cls, characters: int) -> float:
+        return characters / cls.characters_per_second()
+
+
+@dataclass
+class BlockAudioCheck:
+    problem: Optional[str]  # None when the audio passed
+    duration_seconds: float
+    expected_seconds: float
+    speech_share: float  # share of the 50 ms windows that hold speech
+
+
+def check_block_audio(audio_path: Path, characters: int) -> BlockAudioCheck:
+    """
+    Checks a block's audio against its text: a file cut short of what its header announces,
+    near-silence, and a duration far from what the text takes to narrate.
+
+    The duration comes from the header alone; the samples are read once, for a vectorized RMS
+    over 50 ms windows. numpy is imported here, on the first check, so importing this module
+    (and the server with it) stays light.
+
+    Args:
+        audio_path: The block's WAV file.
+        characters: The length of the block's text.
+    """
+    expected_seconds = NarrationPace.expected_seconds(characters)
+    try:
+        header = read_wav_header(audio_path)
+    except (OSError, ValueError, struct.error) as e:
+        return BlockAudioCheck(f"unreadable audio ({e})", 0.0, expected_seconds, 0.0)
+
+    frame_bytes = header.channels * header.sample_width
+    available_bytes = audio_path.stat().st_size - header.data_offset
+    frames = min(header.data_bytes, available_bytes) // frame_bytes
+    duration_seconds = frames / header.sample_rate
+    if available_bytes < header.data_bytes:
+        return BlockAudioCheck(f"truncated file ({available_bytes} of {header.data_bytes} audio bytes)",
+                               duration_seconds, expected_seconds, 0.0)
+
+    speech_share = 1.0
+    if header.sample_width == 2:
+        import numpy as np
+        from app.wav_handler import FULL_SCALE
+
+        samples = np.fromfile(audio_path, dtype="<i2", count=frames * header.channels, offset=header.data_offset)
+        window = max(int(RMS_WINDOW_SECONDS * header.sample_rate), 1) * header.channels
+        windows = len(samples) // window
+        if windows:
+            power = np.square(samples[:windows * window].astype(np.float32)).reshape(windows, window).mean(axis=1)
+            threshold = (FULL_SCALE * 10 ** (SPEECH_THRESHOLD_DBFS / 20)) ** 2
+            speech_share = float(np.count_nonzero(power > threshold)) / windows
+        else:
+            speech_share = 0.0
+
+    problem = None
+    if speech_share < MIN_SPEECH_SHARE:
+        problem = f"near-silent ({speech_share:.0%} speech)"
+    elif expected_seconds >= MIN_CHECKED_SECONDS and duration_seconds < MIN_DURATION_RATIO * expected_seconds:
+        problem = f"too short ({duration_seconds:.1f}s for about {expected_seconds:.1f}s of text)"
+    elif expected_seconds >= MIN_CHECKED_SECONDS and duration_seconds > MAX_DURATION_RATIO * expected_seconds:
+        problem = f"too long ({duration_seconds:.1f}s for about {expected_seconds:.1f}s of text)"
+    return BlockAudioCheck(problem, duration_seconds, expected_seconds, speech_share)
+
+
+class BlockAudioValidator:
+    """
+    Validates every block of a job as its audio lands and decides which ones are synthesized again.
+
+    A rejected block goes back to the TTS queue up to MAX_RESYNTHESES times; after that its
+    last take is kept and the block is reported as unresolved, so it can be checked by ear.
+    """
+
+    def __init__(self, report_callback: Optional[Callable[[dict], None]] = None,
+                 max_resyntheses: int = MAX_RESYNTHESES):
+        self.report_callback = report_callback
+        self.max_resyntheses = max_resyntheses
+        self.rejections: Dict[str, List[str]] = {}  # block name -> problem of every take that failed
+        self.unresolved: List[str] = []
+        self._lock = threading.Lock()
+
+    def check(self, audio_path: Path, text_content: str) -> Optional[str]:
+        """
+        Validates a block's audio (blocking; run it in a worker thread).
+
+        Returns:
+            The problem found if the block should be synthesized again, otherwise None.
+        """
+        result = check_block_audio(audio_path, len(text_content))
+        if result.problem is None:
+            NarrationPace.record(len(text_content), result.duration_seconds)
+            return None
+
+        block_name = audio_path.stem
+        with self._lock:
+            problems = self.rejections.setdefault(block_name, [])
+            problems.append(result.problem)
+            resynthesize = len(problems) <= self.max_resyntheses
+            if not resynthesize:
+                self.unresolved.append(block_name)
+            report = self.report()
+        if self.report_callback is not None:
+            self.report_callback(report)
+        if not resynthesize:
+            print(f"Warning: '{audio_path.name}' is still {result.problem} after {self.max_resyntheses} "
+                  f"re-synthesis attempt(s). Keeping it.")
+            return None
+        return result.problem
+
+    def report(self) -> dict:
+        """The blocks that were synthesized again and why, for the job report."""
+        return {"resynthesized_blocks": {name: list(problems) for name, problems in self.rejections.items()},
+                "unresolved_blocks": list(self.unresolved)}
@@ -0,0 +1,72 @@
+import threading
+from typing import Dict, List
+
+from app.config import get_settings
+
+# --- TTS model limits ---
+# The defaults match the Gemini TTS models: 8k input tokens and 16k output tokens, where the
+# output is audio at about 25 tokens per second. The output side is what limits a block.
+TTS_MAX_INPUT_TOKENS = 8192
+TTS_MAX_OUTPUT_TOKENS = 16384
+CHARACTERS_PER_TEXT_TOKEN = 4
+AUDIO_TOKENS_PER_SECOND = 25
+SPOKEN_CHARACTERS_PER_SECOND = 15  # narration speed, measured on Portuguese and English audiobooks
+SAFETY_MARGIN = 0.6  # only plan blocks up to this share of the model limit
+
+MIN_BLOCK_CHARACTERS = 1000  # the fixed block size used before the planner; never plan below it
+SIZE_BUCKET_CHARACTERS = 500  # results are grouped by block length in buckets of this size
+MIN_ATTEMPTS_PER_BUCKET = 5  # a bucket's failure rate is only trusted after this many attempts
+MAX_FAILURE_RATE = 0.1  # block lengths that fail more often than this are avoided
+
+
+class BlockSizePlanner:
+    """
+    Picks the TTS block size: as large as the model allows, so a book needs as few requests
+    (the scarce resource under API_REQUEST_LIMIT) as possible, but below any block length
+    that has been failing.
+
+    Every TTS attempt reports its block length and outcome. Once the blocks of some length
+    fail more often than MAX_FAILURE_RATE, new books are split below that length.
+    """
+
+    _attempts: Dict[int, int] = {}
+    _failures: Dict[int, int] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def model_block_limit() -> int:
+        """The largest block, in characters, that fits the model's input and output limits."""
+        by_input = TTS_MAX_INPUT_TOKENS * CHARACTERS_PER_TEXT_TOKEN
+        by_output = TTS_MAX_OUTPUT_TOKENS / AUDIO_TOKENS_PER_SECOND * SPOKEN_CHARACTERS_PER_SECOND
+        return max(int(min(by_input, by_output) * SAFETY_MARGIN), MIN_BLOCK_CHARACTERS)
+
+    @classmethod
+    def record_result(cls, block_characters: int, succeeded: bool):
+        """Records the outcome of one TTS request (quota errors are not the block's fault and are not recorded)."""
+        bucket = block_characters // SIZE_BUCKET_CHARACTERS
+        with cls._lock:
+            cls._attempts[bucket] = cls._attempts.get(bucket, 0) + 1
+            if not succeeded:
+                cls._failures[bucket] = cls._failures.get(bucket, 0) + 1
+
+    @classmethod
+    def plan_block_size(cls) -> int:
+        """
+        Returns the block size, in characters, to split the next text with.
+
+        TTS_BLOCK_CHARACTERS pins a fixed size; otherwise the size is the model limit, lowered
+        to just below the shortest block length whose observed failure rate is too high.
+        """
+        fixed_size = get_settings().tts_block_characters
+        if fixed_size:
+            return fixed_size
+
+        block_size = cls.model_block_limit()
+        with cls._lock:
+            failing_buckets: List[int] = [
+                bucket for bucket, attempts in cls._attempts.items()
+                if attempts >= MIN_ATTEMPTS_PER_BUCKET and cls._failures.get(bucket, 0) / attempts > MAX_FAILURE_RATE
+            ]
+        if failing_buckets:
+            block_size = min(block_size, min(failing_buckets) * SIZE_BUCKET_CHARACTERS)
+        return max(block_size, MIN_BLOCK_CHARACTERS)
@@ -0,0 +1,241 @@
+"""
+Converts a whole directory (or a manifest) of PDF/TXT documents into audiobooks from the command line.
+
+All documents share one API key pool, concurrency limit and rate limiter, so a back-catalog
+run stays within MAX_CONCURRENT_REQUESTS and API_REQUEST_LIMIT however many documents are in
+flight. Each document becomes a regular conversion job under the data folder (so the server's
+/download endpoints can serve it too), and a state file records which documents are finished.
+Running the same command again skips finished documents and resumes interrupted ones from
+their checkpoints.
+
+Usage:
+    python -m app.bulk_convert <folder|manifest.json|manifest.txt> [--state bulk-state.json]
+        [--documents 2] [--report-seconds 30] [--data-dir data/job-data]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.api_manager import natural_sort_key
+from app.checkpoint import JobCheckpoint, atomic_write_bytes, BLOCK_DONE, STAGE_COMPLETE
+from app.config import validate_settings
+from app.gemini_audiobook_creator import TtsScheduler
+from app.job_manager import JobManager
+from app.pdf_handler import source_suffixes
+from app.processor import create_job_folders, run_conversion_pipeline
+from app.simulator import format_duration
+
+DEFAULT_DATA_DIR = Path(__file__).resolve().parent.parent / "data/job-data"
+STATE_VERSION = 1
+
+DOCUMENT_PENDING = "pending"
+DOCUMENT_RUNNING = "running"
+DOCUMENT_COMPLETE = "complete"
+DOCUMENT_ERROR = "error"
+
+
+def find_inputs(source: Path) -> List[Path]:
+    """
+    Lists the documents to convert.
+
+    Args:
+        source: A folder (every .pdf/.txt/.epub/.html in it, recursively), a .json manifest holding a list of
+            paths, or a text manifest with one path per line ('#' starts a comment). Relative
+            paths in a manifest are relative to the manifest's folder.
+    """
+    if source.is_dir():
+        paths = [path for path in source.rglob("*") if path.is_file() and path.suffix.lower() in source_suffixes()]
+        return sorted(paths, key=lambda path: natural_sort_key(str(path)))
+
+    if source.suffix.lower() == ".json":
+        entries = json.loads(source.read_text(encoding="utf-8"))
+    else:
+        entries = [line.split("#", 1)[0].strip() for line in source.read_text(encoding="utf-8").splitlines()]
+    paths = [(source.parent / entry).resolve() for entry in entries if entry]
+    missing = [str(path) for path in paths if not path.is_file()]
+    if missing:
+        raise FileNotFoundError(f"Manifest entries not found: {', '.join(missing)}")
+    return paths
+
+
+def job_id_for(document: Path) -> str:
+    """A stable job id per document, so a second run finds the checkpoints of the first."""
+    slug = re.sub(r"[^a-z0-9]+", "-", document.stem.lower()).strip("-")[:40] or "document"
+    return f"bulk-{slug}-{hashlib.sha1(str(document.resolve()).encode('utf-8')).hexdigest()[:8]}"
+
+
+class BulkState:
+    """The state file of a bulk run: one entry per document, rewritten atomically on every change."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.data = {"version": STATE_VERSION, "documents": {}}
+        if path.exists():
+            data = json.loads(path.read_text(encoding="utf-8"))
+            if data.get("version") == STATE_VERSION:
+                self.data = data
+
+    @property
+    def documents(self) -> Dict[str, dict]:
+        return self.data["documents"]
+
+    def entry(self, document: Path) -> dict:
+        return self.documents.setdefault(str(document.resolve()), {
+            "job_id": job_id_for(document),
+            "status": DOCUMENT_PENDING,
+        })
+
+    def update(self, document: Path, **fields):
+        self.entry(document).update(fields)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(self.path, json.dumps(self.data, indent=2).encode("utf-8"))
+
+
+def count_blocks(job_dir: Path) -> Optional[tuple]:
+    """Returns (blocks done, total blocks) from a job's checkpoint, or None before it is split."""
+    checkpoint = JobCheckpoint.load(job_dir)
+    if checkpoint is None or not checkpoint.blocks:
+        return None
+    done = sum(1 for block in checkpoint.blocks.values() if block["state"] == BLOCK_DONE)
+    return done, len(checkpoint.blocks)
+
+
+class ThroughputMonitor:
+    """Prints blocks per minute, quota use and an ETA for the whole run every few seconds."""
+
+    def __init__(self, documents: List[Path], state: BulkState, scheduler: TtsScheduler, data_dir: Path):
+        self.documents = documents
+        self.state = state
+        self.scheduler = scheduler
+        self.data_dir = data_dir
+        self.started = time.monotonic()
+        self.initial_blocks_done = self.blocks()[0]
+
+    def blocks(self) -> tuple:
+        """Returns (blocks done, known blocks, documents not split yet) over all documents."""
+        done = known = unsplit = 0
+        for document in self.documents:
+            counts = count_blocks(self.data_dir / self.state.entry(document)["job_id"])
+            if counts is None:
+                unsplit += 1
+            else:
+                done, known = done + counts[0], known + counts[1]
+        return done, known, unsplit
+
+    def summary(self) -> str:
+        done, known, unsplit = self.blocks()
+        elapsed_minutes = (time.monotonic() - self.started) / 60
+        rate = (done - self.initial_blocks_done) / elapsed_minutes if elapsed_minutes > 0 else 0.0
+        split_documents = len(self.documents) - unsplit
+        # Documents that are not split yet are assumed to be as long as the average split one.
+        remaining = known - done + (unsplit * known / split_documents if split_documents else 0)
+        eta = format_duration(remaining / rate * 60) if rate > 0 and (split_documents or not unsplit) else "unknown"
+
+        finished = sum(1 for document in self.documents
+                       if self.state.entry(document)["status"] == DOCUMENT_COMPLETE)
+        limiter = self.scheduler.rate_limiter
+        cooling = sum(1 for health in self.scheduler.key_manager.key_health() if health["state"] != "available")
+        return (f"[bulk] {finished}/{len(self.documents)} documents | {done}/{known} blocks "
+                f"({unsplit} document(s) not split yet) | {rate:.1f} blocks/min | "
+                f"quota {self.scheduler.requests_in_window()}/{limiter.limit} per {limiter.window}s, "
+                f"{cooling} key(s) cooling down | ETA {eta}")
+
+    async def run(self, interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            print(await asyncio.to_thread(self.summary))
+
+
+async def convert_document(document: Path, state: BulkState, scheduler: TtsScheduler, data_dir: Path,
+                           document_slots: asyncio.Semaphore):
+    """Runs one document through the regular conversion pipeline, with the shared scheduler."""
+    job_id = state.entry(document)["job_id"]
+    async with document_slots:
+        (text_input_dir, audio_input_dir, audio_converted_dir, audio_output_blocks_dir,
+         final_audio_dir) = create_job_folders(base_data_dir=data_dir, job_id=job_id)
+        if not any(path.suffix.lower() in source_suffixes() for path in text_input_dir.iterdir()):
+            await asyncio.to_thread(shutil.copy2, document, text_input_dir / document.name)
+
+        state.update(document, status=DOCUMENT_RUNNING, started_at=time.time())
+        JobManager.update_job_status(job_id, "accepted", "Job accepted and queued.")
+        await run_conversion_pipeline(job_id, text_input_dir, audio_input_dir, audio_converted_dir,
+                                      audio_output_blocks_dir, final_audio_dir, scheduler=scheduler)
+
+        checkpoint = JobCheckpoint.load(data_dir / job_id)
+        status = JobManager.retrieve_job_status(job_id)
+        if checkpoint is not None and checkpoint.stage == STAGE_COMPLETE:
+            state.update(document, status=DOCUMENT_COMPLETE, finished_at=time.time(),
+                         output=str(final_audio_dir / "final_audio.wav"), message=None)
+            print(f"[bulk] Finished '{document.name}' ({job_id}).")
+        else:
+            state.update(document, status=DOCUMENT_ERROR, finished_at=time.time(),
+                         message=status.get("message"), missing_blocks=status.get("report", {}).get("missing_blocks"))
+            print(f"[bulk] '{document.name}' did not complete: {status.get('message')}")
+
+
+async def run_bulk_conversion(documents: List[Path], state: BulkState, data_dir: Path,
+                              parallel_documents: int = 2, report_seconds: float = 30):
+    """
+    Converts the documents that are not finished yet, `parallel_documents` at a time.
+
+    Args:
+        documents: The documents of the run.
+        state: The run's state file. Documents it marks complete are skipped.
+        data_dir: The folder holding one folder per job.
+        parallel_documents: Documents split and narrated at the same time. The number of TTS
+            requests in flight is bounded by MAX_CONCURRENT_REQUESTS regardless.
+        report_seconds: How often the throughput summary is printed.
+    """
+    def pause_notifier(wait_seconds: float):
+        if wait_seconds > 0:
+            print(f"[bulk] All API keys are rate limited. Continuing in about {format_duration(wait_seconds)}.")
+        else:
+            print("[bulk] API keys available again, continuing.")
+
+    scheduler = TtsScheduler.create(pause_callback=pause_notifier)
+    pending = [document for document in documents if state.entry(document)["status"] != DOCUMENT_COMPLETE
+               or not Path(state.entry(document).get("output", "")).is_file()]
+    print(f"[bulk] {len(documents)} document(s), {len(documents) - len(pending)} already complete, "
+          f"{len(scheduler.key_manager.api_keys)} API key(s).")
+
+    monitor = ThroughputMonitor(documents, state, scheduler, data_dir)
+    monitor_task = asyncio.create_task(monitor.run(report_seconds))
+    document_slots = asyncio.Semaphore(parallel_documents)
+    try:
+        await asyncio.gather(*(convert_document(document, state, scheduler, data_dir, document_slots)
+                               for document in pending))
+    finally:
+        monitor_task.cancel()
+    print(monitor.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a folder or manifest of PDF/TXT documents into audiobooks.")
+    parser.add_argument("source", type=Path, help="A folder of documents, or a .json / one-path-per-line manifest.")
+    parser.add_argument("--state", type=Path, default=Path("bulk-state.json"),
+                        help="State file used to skip finished documents on the next run (default: bulk-state.json).")
+    parser.add_argument("--documents", type=int, default=2, help="Documents processed at the same time (default: 2).")
+    parser.add_argument("--report-seconds", type=float, default=30,
+                        help="Seconds between throughput summaries (default: 30).")
+    parser.add_argument("--data-dir", type=Path, default=DEFAULT_DATA_DIR,
+                        help="Where the job folders are created (default: the server's data folder).")
+    args = parser.parse_args()
+
+    validate_settings()
+    documents = find_inputs(args.source)
+    if not documents:
+        print(f"No {', '.join(source_suffixes())} documents found in '{args.source}'.")
+        return
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    asyncio.run(run_bulk_conversion(documents, BulkState(args.state), args.data_dir,
+                                    parallel_documents=max(args.documents, 1), report_seconds=args.report_seconds))
+
+
+if __name__ == "__main__":
+    main()
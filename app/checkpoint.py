@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import wave
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.api_manager import natural_sort_key
+
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+# Job stages, in order. A job whose manifest is not "complete" can be resumed.
+STAGE_SPLITTING = "splitting"
+STAGE_WRITING = "writing"  # story jobs: the story text is being written
+STAGE_GENERATING = "generating"
+STAGE_CONCATENATING = "concatenating"
+STAGE_COMPLETE = "complete"
+STAGE_ERROR = "error"
+
+BLOCK_PENDING = "pending"
+BLOCK_DONE = "done"
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    """Writes a file through a temporary file in the same folder and a rename, so readers never see half of it."""
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False) as tmp:
+        tmp.write(data)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.replace(tmp.name, path)
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_complete_wav(path: Path) -> bool:
+    """Checks that a WAV file parses and holds as much audio as its header announces."""
+    try:
+        with wave.open(str(path), "rb") as wav_file:
+            expected_bytes = wav_file.getnframes() * wav_file.getnchannels() * wav_file.getsampwidth()
+            return expected_bytes > 0 and len(wav_file.readframes(wav_file.getnframes())) == expected_bytes
+    except (OSError, EOFError, wave.Error):
+        return False
+
+
+class JobCheckpoint:
+    """
+    The per-job manifest ('checkpoint.json') that lets a job survive a restart.
+
+    It records the job's stage and, for every text block, whether its audio is done and the
+    checksum of that audio. Story jobs also keep their prompts, outline and every chapter
+    batch written so far, so a resume continues the conversation instead of paying for the
+    chapters again. The manifest is rewritten atomically after every change.
+    """
+
+    def __init__(self, job_dir: Path, data: dict):
+        self.job_dir = job_dir
+        self.path = job_dir / CHECKPOINT_FILE_NAME
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, job_dir: Path) -> Optional["JobCheckpoint"]:
+        """Returns the job's checkpoint, or None if the job has none (or it is unreadable)."""
+        try:
+            data = json.loads((job_dir / CHECKPOINT_FILE_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != CHECKPOINT_VERSION:
+            return None
+        return cls(job_dir, data)
+
+    @classmethod
+    def create(cls, job_dir: Path, job_type: str) -> "JobCheckpoint":
+        checkpoint = cls(job_dir, {
+            "version": CHECKPOINT_VERSION,
+            "job_type": job_type,
+            "stage": STAGE_SPLITTING,
+            "created_at": time.time(),
+            "blocks": {},
+        })
+        checkpoint.save()
+        return checkpoint
+
+    @property
+    def stage(self) -> str:
+        return self.data["stage"]
+
+    @property
+    def job_type(self) -> str:
+        return self.data["job_type"]
+
+    @property
+    def blocks(self) -> Dict[str, dict]:
+        return self.data["blocks"]
+
+    @property
+    def story(self) -> Optional[dict]:
+        """The story section: params, initial_prompt, chapter_prompts, outline, chapters (raw texts) and chapters_split."""
+        return self.data.get("story")
+
+    def save(self):
+        with self._lock:
+            self.data["updated_at"] = time.time()
+            atomic_write_bytes(self.path, json.dumps(self.data, indent=2).encode("utf-8"))
+
+    def set_stage(self, stage: str):
+        self.data["stage"] = stage
+        self.save()
+
+    def record_blocks(self, block_paths: List[Path], stage: str = STAGE_GENERATING,
+                      story_chapter: Optional[int] = None):
+        """
+        Registers text blocks of the job (all pending) once the source, or a story chapter, has been split.
+
+        Args:
+            block_paths: The new text blocks.
+            stage: The stage the job is in once they are recorded.
+            story_chapter: For story jobs, the chapter batch (starting at 1) the blocks were split
+                from, recorded in the same write so a resume knows which batches still need splitting.
+        """
+        text_checksums = {block_path.stem: file_sha256(block_path) for block_path in block_paths}
+        with self._lock:
+            for name, text_sha256 in text_checksums.items():
+                self.blocks[name] = {"state": BLOCK_PENDING, "text_sha256": text_sha256}
+            if story_chapter is not None:
+                self.story["chapters_split"] = story_chapter
+            self.data["stage"] = stage
+        self.save()
+
+    def start_story(self, story_params: dict, initial_prompt: str, chapter_prompts: List[str]):
+        """Records a story request and its prompts, so a resume asks for the same chapter batches."""
+        self.data["story"] = {"params": story_params, "initial_prompt": initial_prompt,
+                              "chapter_prompts": chapter_prompts, "outline": None, "chapters": [],
+                              "chapters_split": 0}
+        self.data["stage"] = STAGE_WRITING
+        self.save()
+
+    def record_story_text(self, text: str, outline: bool = False):
+        """Records the story outline, or the next chapter batch, as soon as the model has written it."""
+        with self._lock:
+            if outline:
+                self.story["outline"] = text
+            else:
+                self.story["chapters"].append(text)
+        self.save()
+
+    def mark_block_done(self, txt_file_path: Path, audio_path: Path):
+        """Records a finished block with the checksum of its audio."""
+        with self._lock:
+            self.blocks[txt_file_path.stem] = {
+                **self.blocks.get(txt_file_path.stem, {}),
+                "state": BLOCK_DONE,
+                "audio_sha256": file_sha256(audio_path),
+                "audio_bytes": audio_path.stat().st_size,
+            }
+        self.save()
+
+    def pending_blocks(self) -> List[str]:
+        return sorted((name for name, block in self.blocks.items() if block["state"] != BLOCK_DONE),
+                      key=natural_sort_key)
+
+    def verify_blocks(self, audio_input_dir: Path, audio_converted_dir: Path, audio_output_blocks_dir: Path) -> int:
+        """
+        Checks the audio of every block against the manifest before a resume.
+
+        A block stays done only if its WAV is complete and matches the recorded checksum. A WAV
+        that was finished but not yet recorded (the server stopped in between) is accepted if it
+        is complete. Every other block goes back to pending, with its text back in the backlog
+        and any partial audio removed.
+
+        Returns:
+            The number of blocks that still need audio.
+        """
+        # Partial WAVs, and the files of TTS requests that never finished or lost to a hedge.
+        for leftover_file in (*audio_output_blocks_dir.glob("*.part"), *audio_output_blocks_dir.glob("*.tts")):
+            leftover_file.unlink(missing_ok=True)
+
+        for name, block in self.blocks.items():
+            audio_path = audio_output_blocks_dir / f"{name}.wav"
+            audio_ok = audio_path.exists() and is_complete_wav(audio_path)
+            if audio_ok and block["state"] == BLOCK_DONE:
+                audio_ok = file_sha256(audio_path) == block.get("audio_sha256")
+            elif audio_ok:
+                block.update(state=BLOCK_DONE, audio_sha256=file_sha256(audio_path),
+                             audio_bytes=audio_path.stat().st_size)
+
+            converted_text, backlog_text = audio_converted_dir / f"{name}.txt", audio_input_dir / f"{name}.txt"
+            if audio_ok:
+                if backlog_text.exists():  # stopped before the text was moved out of the backlog
+                    backlog_text.replace(converted_text)
+                continue
+            if block["state"] == BLOCK_DONE or audio_path.exists():
+                print(f"Block '{name}' has invalid audio; it will be generated again.")
+            block.update(state=BLOCK_PENDING)
+            block.pop("audio_sha256", None)
+            audio_path.unlink(missing_ok=True)
+            if converted_text.exists() and not backlog_text.exists():
+                converted_text.rename(backlog_text)
+
+        self.save()
+        return len(self.pending_blocks())
+
+
+def find_resumable_jobs(base_data_dir: Path, include_failed: bool = False) -> List[str]:
+    """
+    Returns the ids of the jobs whose checkpoint is not complete.
+
+    Args:
+        base_data_dir: The folder holding one folder per job.
+        include_failed: Also return jobs that stopped with an error, not only interrupted ones.
+    """
+    job_ids = []
+    for checkpoint_path in base_data_dir.glob(f"*/{CHECKPOINT_FILE_NAME}"):
+        checkpoint = JobCheckpoint.load(checkpoint_path.parent)
+        if checkpoint is None or checkpoint.stage == STAGE_COMPLETE:
+            continue
+        if checkpoint.stage == STAGE_ERROR and not include_failed:
+            continue
+        job_ids.append(checkpoint_path.parent.name)
+    return job_ids
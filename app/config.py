@@ -0,0 +1,158 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from app.api_manager import get_api_keys
+
+
+class ConfigError(ValueError):
+    """Raised when the environment configuration is missing or invalid."""
+
+
+@dataclass(frozen=True)
+class Settings:
+    gemini_text_model: Optional[str]
+    gemini_tts_model: str
+    max_concurrent_requests: int
+    api_request_limit: int
+    api_request_window_seconds: int
+    prewarm_on_startup: bool
+    resume_jobs_on_startup: bool
+    loop_max_concurrent_encodes: int
+    audio_post_processing: bool
+    pdf_header_footer_cleanup: bool
+    tts_block_characters: int  # 0 lets the block planner choose
+    audio_segment_mode: str
+    audio_segment_seconds: int
+    cpu_workers: int
+    io_workers: int
+    loop_lag_warning_ms: int
+    tts_request_timeout_seconds: int
+    tts_hedging: bool
+    tts_hedge_percentile: int
+    tts_hedge_max_percent: int
+    story_max_output_tokens: int
+    audio_validation: bool
+    storage_backend: str
+    s3_bucket: Optional[str]
+    s3_prefix: str
+    s3_endpoint_url: Optional[str]
+    storage_cache_dir: str
+    storage_cache_mb: int
+
+
+def _read_bool(name: str, default: bool) -> bool:
+    raw_value = os.environ.get(name, "").strip().lower()
+    if not raw_value:
+        return default
+    return raw_value not in ("0", "false", "no")
+
+
+def _read_positive_int(name: str, problems: List[str], default: Optional[int] = None) -> int:
+    raw_value = os.environ.get(name, "").strip()
+    if not raw_value:
+        if default is not None:
+            return default
+        problems.append(f"{name} is not set (expected a positive integer).")
+        return 0
+    try:
+        value = int(raw_value)
+    except ValueError:
+        problems.append(f"{name} must be a positive integer, got {raw_value!r}.")
+        return 0
+    if value <= 0:
+        problems.append(f"{name} must be a positive integer, got {value}.")
+    return value
+
+
+def _read_choice(name: str, choices: tuple, problems: List[str], default: str) -> str:
+    value = os.environ.get(name, "").strip().lower() or default
+    if value not in choices:
+        problems.append(f"{name} must be one of {', '.join(choices)}, got {value!r}.")
+    return value
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Loads the settings from the environment (and `.env`) on first use.
+
+    Raises:
+        ConfigError: If a required variable is missing or invalid. All problems are reported at once.
+    """
+    load_dotenv()
+    problems: List[str] = []
+
+    settings = Settings(
+        gemini_text_model=os.environ.get("GEMINI_TEXT_MODEL") or None,
+        gemini_tts_model=os.environ.get("GEMINI_TTS_MODEL", "").strip(),
+        max_concurrent_requests=_read_positive_int("MAX_CONCURRENT_REQUESTS", problems),
+        api_request_limit=_read_positive_int("API_REQUEST_LIMIT", problems),
+        api_request_window_seconds=_read_positive_int("API_REQUEST_WINDOW_SECONDS", problems),
+        prewarm_on_startup=_read_bool("PREWARM_ON_STARTUP", default=True),
+        resume_jobs_on_startup=_read_bool("RESUME_JOBS_ON_STARTUP", default=True),
+        # Each encode is itself multi-threaded, so by default only half of the cores run loop jobs.
+        loop_max_concurrent_encodes=_read_positive_int("LOOP_MAX_CONCURRENT_ENCODES", problems,
+                                                       default=max(1, (os.cpu_count() or 1) // 2)),
+        audio_post_processing=_read_bool("AUDIO_POST_PROCESSING", default=True),
+        pdf_header_footer_cleanup=_read_bool("PDF_HEADER_FOOTER_CLEANUP", default=True),
+        tts_block_characters=_read_positive_int("TTS_BLOCK_CHARACTERS", problems, default=0),
+        audio_segment_mode=_read_choice("AUDIO_SEGMENT_MODE", ("single", "fixed", "chapters"), problems,
+                                        default="single"),
+        audio_segment_seconds=_read_positive_int("AUDIO_SEGMENT_SECONDS", problems, default=600),
+        cpu_workers=_read_positive_int("CPU_WORKERS", problems, default=os.cpu_count() or 1),
+        io_workers=_read_positive_int("IO_WORKERS", problems, default=32),
+        loop_lag_warning_ms=_read_positive_int("LOOP_LAG_WARNING_MS", problems, default=250),
+        tts_request_timeout_seconds=_read_positive_int("TTS_REQUEST_TIMEOUT_SECONDS", problems, default=300),
+        tts_hedging=_read_bool("TTS_HEDGING", default=False),
+        tts_hedge_percentile=_read_positive_int("TTS_HEDGE_PERCENTILE", problems, default=95),
+        tts_hedge_max_percent=_read_positive_int("TTS_HEDGE_MAX_PERCENT", problems, default=5),
+        story_max_output_tokens=_read_positive_int("STORY_MAX_OUTPUT_TOKENS", problems, default=10000),
+        audio_validation=_read_bool("AUDIO_VALIDATION", default=True),
+        storage_backend=_read_choice("STORAGE_BACKEND", ("local", "s3"), problems, default="local"),
+        s3_bucket=os.environ.get("S3_BUCKET") or None,
+        s3_prefix=os.environ.get("S3_PREFIX", "").strip(),
+        s3_endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+        storage_cache_dir=os.environ.get("STORAGE_CACHE_DIR") or "data/storage-cache",
+        storage_cache_mb=_read_positive_int("STORAGE_CACHE_MB", problems, default=2048),
+    )
+    if not settings.gemini_tts_model:
+        problems.append("GEMINI_TTS_MODEL is not set (e.g. gemini-2.5-flash-preview-tts).")
+    if settings.storage_backend == "s3" and not settings.s3_bucket:
+        problems.append("S3_BUCKET is not set (required when STORAGE_BACKEND is s3).")
+    for name, value in (("TTS_HEDGE_PERCENTILE", settings.tts_hedge_percentile),
+                        ("TTS_HEDGE_MAX_PERCENT", settings.tts_hedge_max_percent)):
+        if value >= 100:
+            problems.append(f"{name} must be below 100, got {value}.")
+
+    if problems:
+        raise ConfigError("Invalid configuration:\n  - " + "\n  - ".join(problems))
+    return settings
+
+
+def get_text_model() -> str:
+    """Returns GEMINI_TEXT_MODEL, which is only required by the story generation jobs."""
+    text_model = get_settings().gemini_text_model
+    if not text_model:
+        raise ConfigError("GEMINI_TEXT_MODEL environment variable not set.")
+    return text_model
+
+
+def validate_settings():
+    """
+    Validates the configuration once at startup so mistakes surface before the first job runs.
+
+    Raises:
+        ConfigError: If the TTS pipeline settings are missing or invalid.
+    """
+    settings = get_settings()
+    if not [key for key in get_api_keys() if key]:
+        print("Warning: no GEMINI_API_KEY* variables are set. Jobs will fail until a key is configured.")
+    if not settings.gemini_text_model:
+        print("Warning: GEMINI_TEXT_MODEL is not set. Story generation jobs will fail.")
+    print(f"Configuration loaded (TTS model: {settings.gemini_tts_model}, "
+          f"{settings.max_concurrent_requests} concurrent request(s), "
+          f"{settings.api_request_limit} request(s) per {settings.api_request_window_seconds}s).")
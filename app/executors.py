@@ -0,0 +1,139 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional, TypeVar
+
+from app.config import get_settings
+
+T = TypeVar("T")
+
+# The stack printed for a blocked loop only shows this project's frames.
+_PROJECT_DIR = str(Path(__file__).resolve().parent.parent)
+
+_cpu_executor: Optional[ProcessPoolExecutor] = None
+_io_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_cpu_executor() -> ProcessPoolExecutor:
+    """Creates the process pool for CPU-heavy stages on first use, with CPU_WORKERS processes."""
+    global _cpu_executor
+    with _executor_lock:
+        if _cpu_executor is None:
+            _cpu_executor = ProcessPoolExecutor(max_workers=get_settings().cpu_workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _cpu_executor
+
+
+def _get_io_executor() -> ThreadPoolExecutor:
+    """Creates the thread pool for blocking I/O on first use, with IO_WORKERS threads."""
+    global _io_executor
+    with _executor_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=get_settings().io_workers,
+                                              thread_name_prefix="pipeline-io")
+        return _io_executor
+
+
+async def run_cpu(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a CPU-heavy pipeline stage (PDF parsing, audio processing) in the process pool, so
+    it neither blocks the event loop nor holds the GIL the server threads need.
+
+    The function and its arguments must be picklable: module-level functions with paths,
+    numbers and dataclasses. Class-level state (e.g. the block planner's statistics) is not
+    shared with the worker processes, so read it before and pass the value in.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_get_cpu_executor(),
+                                                            functools.partial(func, *args, **kwargs))
+
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Runs a blocking call (a TTS request, file hashing, fsync'ed writes) in the I/O thread pool.
+
+    The pool is separate from asyncio's default executor, so long TTS requests never delay
+    the short calls the request handlers make through `asyncio.to_thread`.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_io_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+def shutdown_executors():
+    """Stops the pipeline pools. Called when the server shuts down."""
+    global _cpu_executor, _io_executor
+    with _executor_lock:
+        if _cpu_executor is not None:
+            _cpu_executor.shutdown(wait=False, cancel_futures=True)
+        if _io_executor is not None:
+            _io_executor.shutdown(wait=False, cancel_futures=True)
+        _cpu_executor, _io_executor = None, None
+
+
+class LoopLagMonitor:
+    """
+    Warns when something blocks the event loop for longer than LOOP_LAG_WARNING_MS.
+
+    A task on the loop refreshes a heartbeat every `interval` seconds. A watchdog thread
+    checks it and, while the heartbeat is late, prints the loop thread's current stack, so the
+    warning names the code that is blocking instead of only reporting that something did.
+    """
+
+    def __init__(self, threshold_seconds: float, interval: float = 0.05):
+        self.threshold = threshold_seconds
+        self.interval = interval
+        self.heartbeat = time.monotonic()
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - expected
+            if lag > self.threshold:
+                self.stalls += 1
+                print(f"Warning: the event loop was blocked for {lag * 1000:.0f} ms in total.")
+            self.max_lag = max(self.max_lag, lag)
+            self.heartbeat = now
+
+    def _blocking_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return ""
+        stack = traceback.extract_stack(frame)
+        frames = [entry for entry in stack
+                  if entry.filename.startswith(_PROJECT_DIR) and "site-packages" not in entry.filename] or stack
+        return "".join(traceback.format_list(frames[-6:]))
+
+    def _watch(self):
+        reported_heartbeat = None
+        while not self._stopped.wait(self.interval):
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled > self.threshold and reported_heartbeat != self.heartbeat:
+                reported_heartbeat = self.heartbeat  # one stack per stall
+                print(f"Warning: the event loop has been blocked for {stalled * 1000:.0f} ms, in:\n"
+                      f"{self._blocking_stack()}", end="")
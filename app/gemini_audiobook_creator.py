@@ -1,47 +1,42 @@
 import asyncio
-import os
+import io
+import itertools
 import re
-import struct
+import threading
 import time
+import wave
+from collections import deque
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Union, List, Callable
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+from typing import Dict, Union, List, Callable, Optional, Awaitable, Deque, Tuple
 from app.api_manager import ApiKeyManager, is_quota_error, get_api_keys
-
-try:
-    from google.api_core.exceptions import ResourceExhausted, GoogleAPICallError
-except ImportError:
-    class ResourceExhausted(Exception):
-        pass
-
-    class GoogleAPICallError(Exception):
-        pass
+from app.audio_validation import BlockAudioValidator
+from app.block_planner import BlockSizePlanner
+from app.config import get_settings
+from app.executors import run_io
+from app.gemini_client import get_genai_client
 
 # --- Configuration ---
-load_dotenv()
-MAX_CONCURRENT_REQUESTS = int(os.environ["MAX_CONCURRENT_REQUESTS"])
-GEMINI_TTS_MODEL = os.environ.get("GEMINI_TTS_MODEL")
+# MAX_CONCURRENT_REQUESTS, GEMINI_TTS_MODEL and the rate limit are read through
+# get_settings() on first use, so importing this module needs no environment.
 
 # Add your style instruction here
 #STYLE_INSTRUCTION = "Leia em uma voz grave e calma."
 STYLE_INSTRUCTION = ""
 
-# --- Rate Limiting Configuration ---
-API_REQUEST_LIMIT = int(os.environ["API_REQUEST_LIMIT"])
-API_REQUEST_WINDOW_SECONDS = int(os.environ["API_REQUEST_WINDOW_SECONDS"])
+# --- Rate Limiting ---
 class RateLimiter:
-    def __init__(self, limit: int = 3, window_seconds: int = 60):
+    def __init__(self, limit: int = 3, window_seconds: int = 60, clock: Callable[[], float] = time.monotonic):
         self.limit = limit
         self.window = window_seconds
+        self.clock = clock  # the event loop's clock in the throughput simulator
         self.timestamps: List[float] = []
         self.lock = asyncio.Lock()
 
     async def wait_for_slot(self):
         while True:
             async with self.lock:
-                now = time.monotonic()
+                now = self.clock()
                 # Remove timestamps outside the window
                 self.timestamps = [ts for ts in self.timestamps if ts > now - self.window]
 
@@ -54,9 +49,45 @@ class RateLimiter:
 
             await asyncio.sleep(time_to_wait)
 
-def save_binary_file(file_name: Union[str, Path], data: bytes):
-    with open(file_name, "wb") as f:
-        f.write(data)
+    def try_acquire(self) -> bool:
+        """Takes a slot only if one is free right now (the lock is not needed: this never awaits)."""
+        now = self.clock()
+        self.timestamps = [ts for ts in self.timestamps if ts > now - self.window]
+        if len(self.timestamps) < self.limit:
+            self.timestamps.append(now)
+            return True
+        return False
+
+@dataclass
+class TtsScheduler:
+    """
+    The API key pool, concurrency limit and rate limiter that TTS workers draw from.
+
+    Every job creates its own by default. Jobs that share one (e.g. a bulk conversion run)
+    stay within MAX_CONCURRENT_REQUESTS and API_REQUEST_LIMIT together instead of each.
+    """
+    key_manager: ApiKeyManager
+    semaphore: asyncio.Semaphore
+    rate_limiter: RateLimiter
+    concurrency: int  # the semaphore's size, also the number of workers per job
+    hedger: Optional["TtsHedger"] = None  # request deadlines and hedging; None sends every request once
+
+    @classmethod
+    def create(cls, pause_callback: Optional[Callable[[float], None]] = None) -> "TtsScheduler":
+        """
+        Raises:
+            ValueError: If no API key is configured.
+        """
+        settings = get_settings()
+        key_manager = ApiKeyManager(get_api_keys(), pause_callback=pause_callback)
+        rate_limiter = RateLimiter(settings.api_request_limit, settings.api_request_window_seconds)
+        return cls(key_manager, asyncio.Semaphore(settings.max_concurrent_requests), rate_limiter,
+                   settings.max_concurrent_requests, TtsHedger.from_settings(key_manager, rate_limiter))
+
+    def requests_in_window(self) -> int:
+        """The number of TTS requests made within the current rate-limit window."""
+        now = self.rate_limiter.clock()
+        return sum(1 for ts in self.rate_limiter.timestamps if ts > now - self.rate_limiter.window)
 
 
 def parse_audio_mime_type(mime_type: str) -> Dict[str, Union[int, None]]:
@@ -78,18 +109,116 @@ def parse_audio_mime_type(mime_type: str) -> Dict[str, Union[int, None]]:
     return {"bits_per_sample": bits_per_sample, "rate": rate}
 
 
-def convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
-    params = parse_audio_mime_type(mime_type)
-    bps, sr = params["bits_per_sample"], params["rate"]
-    if bps is None or sr is None: raise ValueError(f"MIME type parse error: {mime_type}")
-    header = struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + len(audio_data), b"WAVE", b"fmt ",
-                         16, 1, 1, sr, sr * (bps // 8), bps // 8, bps, b"data", len(audio_data))
-    return header + audio_data
+class StreamingWavWriter:
+    """
+    Writes a block's audio to disk chunk by chunk as the TTS stream delivers it.
+
+    The audio goes to a '.part' file whose RIFF header is finalized on `close`, and the file
+    is only renamed to its final name once complete. Only the current chunk is held in memory,
+    and a failed request never leaves a truncated block behind.
+    """
+
+    def __init__(self, output_audio_path: Union[str, Path]):
+        self.output_audio_path = Path(output_audio_path)
+        self.part_path = self.output_audio_path.with_name(self.output_audio_path.name + ".part")
+        self.wav_file: Optional[wave.Wave_write] = None
+        self.bytes_written = 0
+
+    def write_chunk(self, data: bytes, mime_type: str):
+        """Appends one response chunk: raw PCM ('audio/L16;rate=24000') or a complete WAV."""
+        if mime_type.lower() == "audio/wav":
+            with wave.open(io.BytesIO(data), "rb") as chunk_wav:
+                channels, sample_width, rate = (chunk_wav.getnchannels(), chunk_wav.getsampwidth(),
+                                                chunk_wav.getframerate())
+                data = chunk_wav.readframes(chunk_wav.getnframes())
+        else:
+            params = parse_audio_mime_type(mime_type)
+            channels, sample_width, rate = 1, params["bits_per_sample"] // 8, params["rate"]
+
+        if self.wav_file is None:
+            self.wav_file = wave.open(str(self.part_path), "wb")
+            self.wav_file.setnchannels(channels)
+            self.wav_file.setsampwidth(sample_width)
+            self.wav_file.setframerate(rate)
+        elif (channels, sample_width, rate) != (self.wav_file.getnchannels(), self.wav_file.getsampwidth(),
+                                                self.wav_file.getframerate()):
+            raise ValueError(f"Audio format changed mid-stream for {self.output_audio_path.name}: {mime_type}")
+
+        self.wav_file.writeframesraw(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        """Finalizes the header and moves the finished file into place."""
+        wav_file, self.wav_file = self.wav_file, None
+        wav_file.close()  # wave patches the RIFF and data sizes here, and closes the file even if that fails
+        self.part_path.replace(self.output_audio_path)
+
+    def abort(self):
+        """Discards a partially written file."""
+        if self.wav_file is not None:
+            self.wav_file.close()
+        self.part_path.unlink(missing_ok=True)
 
 
 # --- Core TTS Generation Logic ---
-def sync_generate_and_save_tts(api_key: str, text_content: str, output_audio_path: Union[str, Path]):
-    client = genai.Client(api_key=api_key)
+@dataclass
+class TtsTiming:
+    first_audio_seconds: float  # time to the first audio byte
+    total_seconds: float
+    audio_bytes: int
+
+
+class TtsObservations:
+    """
+    Latency and quota errors of the real TTS requests made by this process, the inputs of the
+    throughput model behind the job ETA (see app.simulator).
+    """
+
+    _latencies: Deque[float] = deque(maxlen=200)  # seconds of the most recent successful requests
+    _requests = 0
+    _quota_errors = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def record_request(cls, seconds: Optional[float] = None, quota_error: bool = False):
+        with cls._lock:
+            cls._requests += 1
+            if quota_error:
+                cls._quota_errors += 1
+            elif seconds is not None:
+                cls._latencies.append(seconds)
+
+    @classmethod
+    def snapshot(cls) -> Tuple[List[float], float]:
+        """Returns the recent request latencies and the share of requests that hit a quota error."""
+        with cls._lock:
+            return list(cls._latencies), (cls._quota_errors / cls._requests if cls._requests else 0.0)
+
+
+class TtsRequestAbandoned(Exception):
+    """Raised in a TTS request's thread once its result is no longer wanted (a hedge won, or its deadline passed)."""
+
+
+def sync_generate_and_save_tts(api_key: str, text_content: str, output_audio_path: Union[str, Path],
+                               stop_event: Optional[threading.Event] = None,
+                               timeout_seconds: Optional[float] = None) -> TtsTiming:
+    """
+    Synthesizes one block and streams its audio into `output_audio_path` as it arrives.
+
+    Args:
+        api_key: The API key to use.
+        text_content: The text to narrate.
+        output_audio_path: Where the WAV is written.
+        stop_event: Optional event that, once set, stops the request at its next chunk and
+            discards what was written.
+        timeout_seconds: Optional HTTP timeout, so a stalled stream frees its thread.
+
+    Returns:
+        The request's timing: time to the first audio byte, total time and audio size.
+    """
+    from google.genai import types
+
+    client = get_genai_client(api_key)
     # Prepend the style instruction to the text_content.
     instructed_text_content = f"{STYLE_INSTRUCTION}. {text_content}"
 
@@ -99,38 +228,228 @@ def sync_generate_and_save_tts(api_key: str, text_content: str, output_audio_pat
         speech_config=types.SpeechConfig(
             voice_config=types.VoiceConfig(
                 prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Algenib")
-            )))
+            )),
+        http_options=types.HttpOptions(timeout=int(timeout_seconds * 1000)) if timeout_seconds else None)
+    started = time.perf_counter()
     try:
         response_chunks = client.models.generate_content_stream(
-            model=GEMINI_TTS_MODEL, contents=contents, config=generate_content_config)
+            model=get_settings().gemini_tts_model, contents=contents, config=generate_content_config)
     except Exception as e:
         raise RuntimeError(
             f"API call setup failed for {Path(output_audio_path).name}. Original error: {type(e).__name__}") from e
 
-    audio_data_found = False
-    for chunk in response_chunks:
-        if (chunk.candidates and chunk.candidates[0].content and
-                chunk.candidates[0].content.parts and chunk.candidates[0].content.parts[0].inline_data and
-                chunk.candidates[0].content.parts[0].inline_data.data):
-            inline_data = chunk.candidates[0].content.parts[0].inline_data
-            if inline_data.mime_type.lower() == "audio/wav":
-                final_audio_data = inline_data.data
-            else:
-                final_audio_data = convert_to_wav(inline_data.data, inline_data.mime_type)
-            save_binary_file(output_audio_path, final_audio_data)
-            audio_data_found = True
-            break
-        elif chunk.text:
-            print(f"Warning: Text from TTS API for {Path(output_audio_path).name}: {chunk.text}")
-    if not audio_data_found:
-        raise RuntimeError(f"No audio data in API response stream for {Path(output_audio_path).name}")
+    # Every audio chunk is appended as it arrives; long blocks are delivered in several chunks.
+    writer = StreamingWavWriter(output_audio_path)
+    first_audio_seconds = None
+    try:
+        for chunk in response_chunks:
+            if stop_event is not None and stop_event.is_set():
+                raise TtsRequestAbandoned(Path(output_audio_path).name)
+            if (chunk.candidates and chunk.candidates[0].content and
+                    chunk.candidates[0].content.parts and chunk.candidates[0].content.parts[0].inline_data and
+                    chunk.candidates[0].content.parts[0].inline_data.data):
+                inline_data = chunk.candidates[0].content.parts[0].inline_data
+                if first_audio_seconds is None:
+                    first_audio_seconds = time.perf_counter() - started
+                writer.write_chunk(inline_data.data, inline_data.mime_type)
+            elif chunk.text:
+                print(f"Warning: Text from TTS API for {Path(output_audio_path).name}: {chunk.text}")
+        if first_audio_seconds is None:
+            raise RuntimeError(f"No audio data in API response stream for {Path(output_audio_path).name}")
+        if stop_event is not None and stop_event.is_set():
+            raise TtsRequestAbandoned(Path(output_audio_path).name)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+    return TtsTiming(first_audio_seconds=first_audio_seconds, total_seconds=time.perf_counter() - started,
+                     audio_bytes=writer.bytes_written)
+
+# --- Deadlines and Hedged Requests ---
+HEDGE_MIN_SAMPLES = 20  # latencies needed before the hedge percentile is trusted
+DEADLINE_RETRIES = 1  # a request that misses its deadline is sent once more before the block fails
+# Each request writes to its own file ('block1.wav.3.tts'), renamed to the block's name if it wins,
+# so an abandoned request never touches the file of the one that replaced it. The suffix is not
+# '.wav', so a leftover is never taken for a block.
+REQUEST_FILE_SUFFIX = ".tts"
+
+
+class TtsDeadlineExceeded(TimeoutError):
+    """Raised when a block's TTS request (and its hedge, if any) ran past TTS_REQUEST_TIMEOUT_SECONDS."""
+
+
+@dataclass
+class _TtsRequest:
+    task: asyncio.Task
+    stop_event: threading.Event
+    output_path: Path
+    key_idx: int = -1  # set for hedges, whose key is not reported by the worker
+    hedge: bool = False
+
+
+class TtsHedger:
+    """
+    Puts a deadline on every TTS request and, with TTS_HEDGING, hedges the slow ones.
+
+    A request still running after the TTS_HEDGE_PERCENTILE of recent latencies gets a duplicate
+    on another API key that is not cooling down, if the rate limiter has a slot free right away.
+    The first response wins and the other request is abandoned. At most TTS_HEDGE_MAX_PERCENT
+    of the requests are hedged, which bounds the extra quota. A request (and its hedge) running
+    past TTS_REQUEST_TIMEOUT_SECONDS is abandoned and sent once more before the block fails.
+    """
+
+    def __init__(self, key_manager: ApiKeyManager, rate_limiter: RateLimiter, timeout_seconds: float,
+                 hedge_percentile: Optional[int] = None, max_hedge_share: float = 0.0):
+        self.key_manager = key_manager
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout_seconds
+        self.hedge_percentile = hedge_percentile  # None disables hedging
+        self.max_hedge_share = max_hedge_share
+        self.requests = 0
+        self.deadline_misses = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._files = itertools.count(1)
+
+    @classmethod
+    def from_settings(cls, key_manager: ApiKeyManager, rate_limiter: RateLimiter) -> "TtsHedger":
+        settings = get_settings()
+        return cls(key_manager, rate_limiter, settings.tts_request_timeout_seconds,
+                   hedge_percentile=settings.tts_hedge_percentile if settings.tts_hedging else None,
+                   max_hedge_share=settings.tts_hedge_max_percent / 100)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a request is hedged, or None if it may not be (disabled, budget spent, too few samples)."""
+        if self.hedge_percentile is None or self.hedges + 1 > self.max_hedge_share * self.requests:
+            return None
+        latencies, _ = TtsObservations.snapshot()
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies.sort()
+        return latencies[min(len(latencies) * self.hedge_percentile // 100, len(latencies) - 1)]
+
+    def summary(self) -> dict:
+        return {"requests": self.requests, "deadline_misses": self.deadline_misses, "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "extra_quota_share": round(self.hedges / self.requests, 4) if self.requests else 0.0}
+
+    def _start(self, api_key: str, text_content: str, output_audio_path: Path, key_idx: int = -1,
+               hedge: bool = False) -> _TtsRequest:
+        output_path = output_audio_path.with_name(f"{output_audio_path.name}.{next(self._files)}{REQUEST_FILE_SUFFIX}")
+        stop_event = threading.Event()
+        task = asyncio.ensure_future(run_io(sync_generate_and_save_tts, api_key, text_content, output_path,
+                                            stop_event=stop_event, timeout_seconds=self.timeout))
+        return _TtsRequest(task, stop_event, output_path, key_idx, hedge)
+
+    @staticmethod
+    def _abandon(request: _TtsRequest):
+        """Stops a request that lost; its thread finishes on its own and its file is discarded."""
+        request.stop_event.set()
+
+        def discard(task: asyncio.Future):
+            if not task.cancelled():
+                task.exception()  # retrieved, so a failure of the lost request is not logged as unhandled
+            request.output_path.unlink(missing_ok=True)
+
+        request.task.add_done_callback(discard)
+
+    async def _start_hedge(self, api_key: str, text_content: str, output_audio_path: Path) -> Optional[_TtsRequest]:
+        hedge_key, hedge_idx = await self.key_manager.get_spare_key(exclude_key=api_key)
+        if hedge_key is None or not self.rate_limiter.try_acquire():
+            return None
+        self.hedges += 1
+        print(f"'{output_audio_path.name}' is slow; hedging it on key ...{hedge_key[-4:]}.")
+        return self._start(hedge_key, text_content, output_audio_path, key_idx=hedge_idx, hedge=True)
+
+    async def _synthesize_once(self, api_key: str, text_content: str, output_audio_path: Path) -> TtsTiming:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.timeout
+        self.requests += 1
+        hedge_delay = self.hedge_delay()
+        requests = [self._start(api_key, text_content, output_audio_path)]
+        primary_error: Optional[Exception] = None  # kept while a hedge that may still succeed is running
+        try:
+            while True:
+                if not requests:
+                    raise primary_error  # the hedge failed too
+                hedge_at = started + hedge_delay if hedge_delay is not None else deadline
+                done, _ = await asyncio.wait([request.task for request in requests],
+                                             timeout=max(min(hedge_at, deadline) - loop.time(), 0),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if loop.time() >= deadline:
+                        if primary_error is not None:
+                            raise primary_error
+                        raise TtsDeadlineExceeded(f"No audio for {output_audio_path.name} after {self.timeout:.0f}s.")
+                    hedge_delay = None  # hedge at most once
+                    hedge = await self._start_hedge(api_key, text_content, output_audio_path)
+                    if hedge is not None:
+                        requests.append(hedge)
+                    continue
+
+                # A success wins over a failure that finished at the same time.
+                finished = sorted((request for request in requests if request.task in done),
+                                  key=lambda request: request.task.exception() is not None)
+                for request in finished:
+                    requests.remove(request)
+                    try:
+                        timing = request.task.result()
+                    except Exception as e:
+                        if not request.hedge:
+                            if requests:  # the hedge is still running and its quota is spent: wait for it
+                                primary_error = e
+                                continue
+                            raise  # the worker handles the primary request's errors, as without hedging
+                        if is_quota_error(e):
+                            await self.key_manager.report_quota_error(request.key_idx, e)
+                        print(f"Warning: The hedge of '{output_audio_path.name}' failed: {e}")
+                        continue
+                    if request.hedge:
+                        self.hedge_wins += 1
+                    request.output_path.replace(output_audio_path)
+                    return timing
+        finally:
+            for request in requests:
+                self._abandon(request)
+
+    async def synthesize(self, api_key: str, text_content: str, output_audio_path: Path) -> TtsTiming:
+        """
+        Narrates one block into `output_audio_path`, like `sync_generate_and_save_tts`.
+
+        Raises:
+            TtsDeadlineExceeded: If the request missed its deadline on every try.
+        """
+        for retry in range(DEADLINE_RETRIES + 1):
+            try:
+                return await self._synthesize_once(api_key, text_content, output_audio_path)
+            except TtsDeadlineExceeded as e:
+                self.deadline_misses += 1
+                if retry == DEADLINE_RETRIES:
+                    raise
+                print(f"Warning: {e} Sending it again.")
+                await self.rate_limiter.wait_for_slot()
+
 
 # --- Asynchronous Worker and Processing Logic ---
+class BlockAudioRejected(Exception):
+    """Raised when a block's audio failed validation; the block goes back to the queue."""
+
+
 async def process_file_attempt(
         txt_file_path: Path, output_audio_path: Path, audio_converted_dir: Path, api_key: str,
-        rate_limiter: RateLimiter, progress_callback: callable
+        rate_limiter: RateLimiter, progress_callback: callable,
+        block_callback: Optional[Callable[[Path, Path], None]] = None,
+        hedger: Optional["TtsHedger"] = None,
+        validator: Optional[BlockAudioValidator] = None
 ):
-    """Core logic for a single file processing attempt. Separated to be wrapped by a semaphore."""
+    """
+    Core logic for a single file processing attempt. Separated to be wrapped by a semaphore.
+
+    With a `hedger`, the request gets a deadline and may be hedged (see `TtsHedger`). With a
+    `validator`, audio that fails validation is deleted and `BlockAudioRejected` is raised.
+    """
     input_filename = txt_file_path.name
     with open(txt_file_path, 'r', encoding='utf-8') as f:
         text_content = f.read().strip()
@@ -142,44 +461,56 @@ async def process_file_attempt(
     key_suffix = api_key[-4:]
     print(f"'{input_filename}' converting (using API key ...{key_suffix})...")
 
-    await asyncio.to_thread(
-        sync_generate_and_save_tts, api_key, text_content, output_audio_path
-    )
+    try:
+        if hedger is not None:
+            timing = await hedger.synthesize(api_key, text_content, output_audio_path)
+        else:
+            timing = await run_io(sync_generate_and_save_tts, api_key, text_content, output_audio_path)
+    except Exception as e:
+        if is_quota_error(e):
+            TtsObservations.record_request(quota_error=True)
+        else:
+            BlockSizePlanner.record_result(len(text_content), succeeded=False)
+        raise
+    TtsObservations.record_request(timing.total_seconds)
+    problem = await run_io(validator.check, output_audio_path, text_content) if validator is not None else None
+    if problem is not None:
+        BlockSizePlanner.record_result(len(text_content), succeeded=False)
+        output_audio_path.unlink(missing_ok=True)
+        raise BlockAudioRejected(f"'{output_audio_path.name}' is {problem}")
+    BlockSizePlanner.record_result(len(text_content), succeeded=True)
+    if block_callback is not None:
+        await run_io(block_callback, txt_file_path, output_audio_path)
     progress_callback()
-    print(f"'{output_audio_path.name}' is ready.")
+    print(f"'{output_audio_path.name}' is ready (first audio after {timing.first_audio_seconds:.2f}s, "
+          f"{timing.total_seconds:.2f}s total, {timing.audio_bytes / 1e6:.1f} MB).")
     try:
         txt_file_path.rename(audio_converted_dir / txt_file_path.name)
     except OSError as move_err:
         print(f"Warning: Created '{output_audio_path.name}', but failed to move '{input_filename}': {move_err}")
 
 
-def is_quota_error(e: Exception) -> bool:
-    """Checks if a given exception is a quota-related error."""
-    actual_error = e.__cause__ if e.__cause__ else e
-    error_str = str(actual_error).upper()
-
-    if isinstance(actual_error, ResourceExhausted):
-        return True
-    if "429" in error_str and ("RESOURCE_EXHAUSTED" in error_str or "QUOTA" in error_str or "RATE LIMIT" in error_str):
-        return True
-    if isinstance(actual_error, GoogleAPICallError) and getattr(actual_error, 'code', None) == 429:
-        return True
-
-    return False
-
-
 async def worker(
         name: str,
         queue: asyncio.Queue,
         key_manager: ApiKeyManager,
         semaphore: asyncio.Semaphore,
-        stop_event: asyncio.Event,
         rate_limiter: RateLimiter,
         audio_output_blocks_dir: Path,
         audio_converted_dir: Path,
-        progress_callback: callable
+        progress_callback: callable,
+        block_callback: Optional[Callable[[Path, Path], None]] = None,
+        attempt: Optional[Callable[..., Awaitable[None]]] = None,
+        hedger: Optional["TtsHedger"] = None,
+        validator: Optional[BlockAudioValidator] = None
 ):
-    """A worker task that processes files from the queue until it receives a sentinel (None)."""
+    """
+    A worker task that processes files from the queue until it receives a sentinel (None).
+
+    `attempt` replaces `process_file_attempt` (same arguments); the throughput simulator uses
+    it to run this exact scheduling logic against modeled requests.
+    """
+    attempt = attempt or process_file_attempt
     while True:
 
         txt_file_path: Path = await queue.get()
@@ -189,24 +520,21 @@ async def worker(
             queue.task_done()
             break
 
+        key_idx = -1
         try:
-            # Check for key exhaustion *before* attempting to process.
-            current_api_key, key_idx = await key_manager.get_key_for_processing()
-
-            if current_api_key is None:
-                # All keys are exhausted. Re-queue the file and signal all workers to stop.
-                print(f"[{name}] All keys exhausted. Re-queueing '{txt_file_path.name}' and signaling stop.")
-                await queue.put(txt_file_path)
-                queue.task_done()
-                stop_event.set()
-                continue
-
             output_audio_path = audio_output_blocks_dir / (txt_file_path.stem + ".wav")
 
             # Use the semaphore to limit true concurrency of API calls
             async with semaphore:
-                await process_file_attempt(txt_file_path, output_audio_path, audio_converted_dir, current_api_key,
-                                           rate_limiter, progress_callback)
+                # Pauses here (instead of giving up) while every key is cooling down.
+                current_api_key, key_idx = await key_manager.wait_for_key()
+                await attempt(txt_file_path, output_audio_path, audio_converted_dir, current_api_key,
+                              rate_limiter, progress_callback, block_callback, hedger=hedger,
+                              validator=validator)
+            await key_manager.report_success(key_idx)
+        except BlockAudioRejected as e:
+            print(f"[{name}] {e}. Re-queueing it for synthesis.")
+            await queue.put(txt_file_path)
         except Exception as e:
             if is_quota_error(e):
                 short_error_msg = str(e.__cause__ or e).splitlines()[0]
@@ -214,7 +542,7 @@ async def worker(
                     f"[{name}] Quota error on '{txt_file_path.name}' with key #{key_idx + 1}. "
                     f"Re-queueing file. Error: {short_error_msg}"
                 )
-                await key_manager.report_quota_error(key_idx)
+                await key_manager.report_quota_error(key_idx, e)
                 await queue.put(txt_file_path)  # Re-queue the file for a later attempt
             else:
                 print(
@@ -230,18 +558,99 @@ def natural_sort_key(text_to_sort: str):
 
 
 # --- Main Orchestration ---
-async def generate_audio_from_blocks(text_input_dir: Path, audio_output_blocks_dir: Path, audio_converted_dir: Path,
-                                     progress_callback: callable):
+async def generate_audio_from_queue(file_queue: asyncio.Queue, audio_output_blocks_dir: Path,
+                                    audio_converted_dir: Path, progress_callback: callable,
+                                    producer: Optional[Awaitable] = None,
+                                    block_callback: Optional[Callable[[Path, Path], None]] = None,
+                                    pause_callback: Optional[Callable[[float], None]] = None,
+                                    scheduler: Optional[TtsScheduler] = None,
+                                    attempt: Optional[Callable[..., Awaitable[None]]] = None,
+                                    validator: Optional[BlockAudioValidator] = None) -> Optional[dict]:
+    """
+    Runs the TTS workers against a queue of block files.
+
+    Args:
+        file_queue: Queue of 'block*.txt' paths. It may still be filled while the workers run.
+        audio_output_blocks_dir: Where the generated block WAVs are written.
+        audio_converted_dir: Where processed text blocks are moved to.
+        progress_callback: Called after each block is converted.
+        producer: Optional coroutine that keeps putting files into the queue. The workers start
+            immediately and only shut down once the producer has finished and the queue is drained.
+        block_callback: Optional function called (in a thread) with the text and audio paths of
+            every finished block, e.g. to checkpoint it.
+        pause_callback: Optional function called with the expected wait in seconds when every API
+            key is cooling down and the job pauses, and with 0 when it continues.
+        scheduler: Optional key pool and limits shared with other jobs. Without one, the job gets
+            its own (and `pause_callback` is attached to it).
+        attempt: Optional replacement for `process_file_attempt`, used by the throughput simulator.
+        validator: Optional validator of every block's audio as it lands; blocks it rejects are
+            put back into the queue (see app.audio_validation).
+
+    Returns:
+        The scheduler's request statistics (deadline misses, hedges and their quota cost), or
+        None when it has no hedger.
+    """
+    if scheduler is None:
+        try:
+            scheduler = TtsScheduler.create(pause_callback=pause_callback)
+        except ValueError:
+            print(f"Error: No Gemini API keys found. Please set at least one of {', '.join(get_api_keys())}.")
+            if producer is not None:
+                producer.close()
+            return
+        print(f"Initialized with {len(scheduler.key_manager.api_keys)} API key(s).")
+    key_manager, semaphore, rate_limiter = scheduler.key_manager, scheduler.semaphore, scheduler.rate_limiter
 
-    raw_api_keys = get_api_keys()
+    # --- Create and start worker tasks ---
+    worker_tasks = []
+    for i in range(scheduler.concurrency):
+        task = asyncio.create_task(
+            worker(f"Worker-{i + 1}", file_queue, key_manager, semaphore, rate_limiter,
+                   audio_output_blocks_dir, audio_converted_dir, progress_callback, block_callback, attempt,
+                   scheduler.hedger, validator)
+        )
+        worker_tasks.append(task)
 
     try:
-        key_manager = ApiKeyManager(raw_api_keys)
-    except ValueError:
-        print(f"Error: No Gemini API keys found. Please set at least one of {', '.join(raw_api_keys)}.")
-        return
+        # --- Let the producer feed the queue while the workers consume it ---
+        if producer is not None:
+            await producer
+
+        # --- Wait for all files to be processed ---
+        # This will block until `task_done()` has been called for every file
+        # that was put into the queue.
+        await file_queue.join()
+    except BaseException:
+        # The producer failed (or we were cancelled): stop the workers instead of draining the queue.
+        for task in worker_tasks:
+            task.cancel()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+        raise
+
+    # --- Shutdown ---
+    for _ in worker_tasks:
+        await file_queue.put(None)
+
+    # Wait for all worker tasks to finish.
+    await asyncio.gather(*worker_tasks, return_exceptions=True)
 
-    print(f"Initialized with {len(key_manager.api_keys)} API key(s).")
+    print("All queued files have been processed at least once. Finalizing...")
+    print("Key usage: " + ", ".join(f"{health['key']} {health['requests']} request(s), "
+                                    f"{health['quota_errors']} quota error(s)" for health in key_manager.key_health()))
+    if scheduler.hedger is None:
+        return None
+    summary = scheduler.hedger.summary()
+    print(f"TTS requests: {summary['requests']} block request(s), {summary['deadline_misses']} deadline miss(es), "
+          f"{summary['hedges']} hedge(s) ({summary['hedge_wins']} won, {summary['extra_quota_share']:.1%} extra quota).")
+    return summary
+
+
+async def generate_audio_from_blocks(text_input_dir: Path, audio_output_blocks_dir: Path, audio_converted_dir: Path,
+                                     progress_callback: callable,
+                                     block_callback: Optional[Callable[[Path, Path], None]] = None,
+                                     pause_callback: Optional[Callable[[float], None]] = None,
+                                     scheduler: Optional[TtsScheduler] = None,
+                                     validator: Optional[BlockAudioValidator] = None):
 
     if not text_input_dir.exists() or not text_input_dir.is_dir():
         print(f"Error: Input directory '{text_input_dir}' does not exist.")
@@ -260,43 +669,6 @@ async def generate_audio_from_blocks(text_input_dir: Path, audio_output_blocks_d
     for txt_file in txt_files:
         await file_queue.put(txt_file)
 
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    stop_event = asyncio.Event()
-
-    # --- Create rate limiter ---
-    rate_limiter = RateLimiter(API_REQUEST_LIMIT, API_REQUEST_WINDOW_SECONDS)
-
-    # --- Create and start worker tasks ---
-    worker_tasks = []
-    for i in range(MAX_CONCURRENT_REQUESTS):
-        task = asyncio.create_task(
-            worker(f"Worker-{i + 1}", file_queue, key_manager, semaphore, stop_event, rate_limiter,
-                   audio_output_blocks_dir, audio_converted_dir, progress_callback)
-        )
-        worker_tasks.append(task)
-
-    # --- Wait for all files to be processed ---
-    # This will block until `task_done()` has been called for every file
-    # that was initially put into the queue.
-    await file_queue.join()
-
-    # --- Shutdown ---
-    print("All initial files have been processed at least once. Finalizing...")
-
-    for _ in worker_tasks:
-        await file_queue.put(None)
-
-    # Wait for all worker tasks to finish.
-    await asyncio.gather(*worker_tasks, return_exceptions=True)
-
-    # --- Final Status Report ---
-    if file_queue.empty():
-        print("TTS processing finished successfully for all files!")
-    else:
-        print(
-            f"\nProcessing stopped because all API keys were exhausted. "
-            f"{file_queue.qsize()} file(s) could not be processed:"
-        )
-        while not file_queue.empty():
-            remaining_file = file_queue.get_nowait()
-            print(f"  - {remaining_file.name}")
\ No newline at end of file
+    return await generate_audio_from_queue(file_queue, audio_output_blocks_dir, audio_converted_dir,
+                                           progress_callback, block_callback=block_callback,
+                                           pause_callback=pause_callback, scheduler=scheduler, validator=validator)
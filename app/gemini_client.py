@@ -1,15 +1,127 @@
 # gemini_client.py
-import os
-from typing import List, Callable, Optional
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+from functools import lru_cache
+from typing import List, Callable, Optional, Awaitable
 
-load_dotenv()
+from app.api_manager import ApiKeyManager, is_quota_error
+from app.checkpoint import JobCheckpoint
+from app.config import get_settings, get_text_model
+from app.executors import run_io
+from app.story_planner import ChapterBatchPlanner
 
-GEMINI_TEXT_MODEL = os.environ.get("GEMINI_TEXT_MODEL")
-if not GEMINI_TEXT_MODEL:
-    raise ValueError("GEMINI_TEXT_MODEL environment variable not set.")
+MAX_CONTINUATIONS = 3  # follow-up requests for an answer cut off by the output limit
+CONTINUATION_PROMPT = ("Sua resposta foi interrompida pelo limite de tamanho. Continue exatamente de onde parou, "
+                       "sem repetir nada e sem comentários.")
+
+
+@lru_cache(maxsize=None)
+def get_genai_client(api_key: str):
+    """
+    Returns the google-genai client for an API key, creating it on first use.
+
+    The SDK is imported here rather than at module level because it is slow to import,
+    and a client is reused for every request made with the same key.
+    """
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+
+def _response_text(response) -> str:
+    """The plain generated text of a response, or an empty string."""
+    from google.genai import types
+
+    # Prefer the convenient .text property for the plain generated text
+    text = getattr(response, "text", None)
+    if text is None:
+        # Fallback: attempt to pull from first candidate
+        if getattr(response, "candidates", None) and len(response.candidates) > 0:
+            # candidate.content might be a Content object — prefer its text representation if available
+            candidate = response.candidates[0]
+            text = getattr(candidate, "text", None) or getattr(candidate, "content", None)
+            if isinstance(text, types.Content):
+                # build text from parts (safe fallback)
+                text = "\n".join(p.text for p in text.parts if getattr(p, "text", None))
+        else:
+            text = ""
+
+    # Normalize to string
+    return text if isinstance(text, str) else str(text)
+
+
+def _is_truncated(response) -> bool:
+    """Whether the response stopped because it reached the output-token limit."""
+    candidates = getattr(response, "candidates", None)
+    finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+    return getattr(finish_reason, "name", finish_reason) == "MAX_TOKENS"
+
+
+class _StoryKeys:
+    """The API key a story is being written with; on a quota error the story moves to another key."""
+
+    def __init__(self, api_key: str, key_manager: Optional[ApiKeyManager] = None):
+        self.api_key = api_key
+        self.key_manager = key_manager
+        self.key_idx = key_manager.api_keys.index(api_key) if key_manager is not None else -1
+
+    async def generate_content(self, **request):
+        """
+        Sends a request with the current key. After a quota error the key is put in cooldown
+        and the request is sent again with the next available one (waiting while every key is
+        cooling down), so the conversation carries on where it was.
+        """
+        while True:
+            try:
+                return await get_genai_client(self.api_key).aio.models.generate_content(**request)
+            except Exception as e:
+                if self.key_manager is None or not is_quota_error(e):
+                    raise
+                await self.key_manager.report_quota_error(self.key_idx, e)
+                self.api_key, self.key_idx = await self.key_manager.wait_for_key()
+                print(f"Continuing the story with key ...{self.api_key[-4:]}.")
+
+
+def _model_content(text: str):
+    """A model turn of the conversation holding `text`."""
+    from google.genai import types
+    return types.Content(role="model", parts=[types.Part.from_text(text=text)])
+
+
+async def _generate_complete(keys: _StoryKeys, text_model: str, chat_history: list, prompt_content,
+                             label: str) -> str:
+    """
+    Sends `prompt_content` after the conversation so far and returns the whole answer.
+
+    While the answer is cut off by the output-token limit (STORY_MAX_OUTPUT_TOKENS), the model
+    is asked to continue where it stopped, up to MAX_CONTINUATIONS times, and the parts are
+    joined. The prompt, the answer and any continuation turns are appended to `chat_history`.
+    """
+    from google.genai import types
+
+    config = types.GenerateContentConfig(temperature=0.7, max_output_tokens=get_settings().story_max_output_tokens)
+    text = ""
+    for continuation in range(MAX_CONTINUATIONS + 1):
+        response = await keys.generate_content(model=text_model, contents=[*chat_history, prompt_content],
+                                               config=config)
+        part = _response_text(response)
+        usage = getattr(response, "usage_metadata", None)
+        ChapterBatchPlanner.record_output(len(part), getattr(usage, "candidates_token_count", None) or 0)
+        text += part
+
+        # Update history: append the user prompt and the model content (if present)
+        chat_history.append(prompt_content)
+        if getattr(response, "candidates", None) and len(response.candidates) > 0:
+            chat_history.append(response.candidates[0].content)
+        else:
+            # fallback: add model content derived from the text
+            chat_history.append(_model_content(part))
+
+        if not _is_truncated(response):
+            break
+        if continuation == MAX_CONTINUATIONS:
+            print(f"Warning: {label} is still cut off after {MAX_CONTINUATIONS} continuation(s).")
+            break
+        print(f"{label} was cut off by the output limit; asking the model to continue...")
+        prompt_content = types.Content(role="user", parts=[types.Part.from_text(text=CONTINUATION_PROMPT)])
+    return text
 
 
 async def generate_story_with_memory(
@@ -17,6 +129,9 @@ async def generate_story_with_memory(
     initial_prompt: str,
     chapter_prompts: List[str],
     progress_callback: Optional[Callable] = None,
+    chapter_callback: Optional[Callable[[int, str], Awaitable[None]]] = None,
+    key_manager: Optional[ApiKeyManager] = None,
+    checkpoint: Optional[JobCheckpoint] = None,
 ) -> str:
     """
     Generate a multi-chapter story preserving short-term 'memory' by keeping
@@ -29,11 +144,24 @@ async def generate_story_with_memory(
         api_key: API key to initialize genai.Client
         initial_prompt: first prompt (planning / story outline)
         chapter_prompts: list of prompts to request chapters (can be batched prompts)
+        chapter_callback: optional coroutine called with (batch_index, text) as soon as
+            each chapter batch is written, so consumers can start before the story ends
+        key_manager: optional pool `api_key` was taken from; on a quota error the story
+            continues with another of its keys instead of failing
+        checkpoint: optional job checkpoint with a story section (see `JobCheckpoint.start_story`).
+            The outline and each chapter batch are recorded in it as soon as they are written,
+            and the parts it already holds are not requested again: they go back into the
+            history, without calling `chapter_callback`.
 
     Returns:
         The full concatenated story text (string).
     """
-    client = genai.Client(api_key=api_key)
+    from google.genai import types
+
+    keys = _StoryKeys(api_key, key_manager)
+    text_model = get_text_model()
+    story = checkpoint.story if checkpoint is not None else None
+    written_chapters = list(story["chapters"]) if story else []
 
     chat_history: List[types.Content] = []
 
@@ -41,25 +169,14 @@ async def generate_story_with_memory(
         role="user", parts=[types.Part.from_text(text=initial_prompt)]
     )
 
-    print("Sending story plan prompt to Gemini (initial planning)...")
-    plan_response = await client.aio.models.generate_content(
-        model=GEMINI_TEXT_MODEL,
-        contents=initial_content,
-        config=types.GenerateContentConfig(temperature=0.7, max_output_tokens=10000),
-    )
-
-    # Add the user's initial prompt to history
-    chat_history.append(initial_content)
-
-    # Prefer to append the model-returned content candidate if present.
-    # If not present, fall back to creating a model Content from response.text.
-    if getattr(plan_response, "candidates", None) and len(plan_response.candidates) > 0:
-        chat_history.append(plan_response.candidates[0].content)
-
+    if story and story["outline"] is not None:
+        print(f"Resuming the story after {len(written_chapters)} written chapter batch(es)...")
+        chat_history += [initial_content, _model_content(story["outline"])]
     else:
-        chat_history.append(
-            types.Content(role="model", parts=[types.Part.from_text(text=plan_response.text)])
-        )
+        print("Sending story plan prompt to Gemini (initial planning)...")
+        outline = await _generate_complete(keys, text_model, chat_history, initial_content, "The story plan")
+        if checkpoint is not None:
+            await run_io(checkpoint.record_story_text, outline, outline=True)
 
     if progress_callback:
         progress_callback()
@@ -67,54 +184,28 @@ async def generate_story_with_memory(
     # Now iterate through chapter prompts, sending the accumulated history + new prompt.
     full_story_text = ""
     for idx, prompt in enumerate(chapter_prompts, start=1):
-        print(f"Sending prompt for chapter batch {idx}/{len(chapter_prompts)}...")
-
         prompt_content = types.Content(
             role="user", parts=[types.Part.from_text(text=prompt)]
         )
+        if idx <= len(written_chapters):
+            # Written before the job was interrupted: only the history needs it back.
+            chapter_text = written_chapters[idx - 1]
+            chat_history += [prompt_content, _model_content(chapter_text)]
+            full_story_text += chapter_text + "\n\n"
+            if progress_callback:
+                progress_callback()
+            continue
 
-        # Build the request contents: history + this new user prompt
-        request_contents = [*chat_history, prompt_content]
-
-        chapter_response = await client.aio.models.generate_content(
-            model=GEMINI_TEXT_MODEL,
-            contents=request_contents,
-            config=types.GenerateContentConfig(temperature=0.7, max_output_tokens=10000),
-        )
-
-        # Prefer the convenient .text property for the plain generated text
-        chapter_text = getattr(chapter_response, "text", None)
-        if chapter_text is None:
-            # Fallback: attempt to pull from first candidate
-            if getattr(chapter_response, "candidates", None) and len(chapter_response.candidates) > 0:
-                # candidate.content might be a Content object — prefer its text representation if available
-                candidate = chapter_response.candidates[0]
-                chapter_text = getattr(candidate, "text", None) or getattr(candidate, "content", None)
-                if isinstance(chapter_text, types.Content):
-                    # build text from parts (safe fallback)
-                    parts = []
-                    for p in chapter_text.parts:
-                        if getattr(p, "text", None):
-                            parts.append(p.text)
-                    chapter_text = "\n".join(parts)
-            else:
-                chapter_text = ""
-
-        # Normalize to string
-        if not isinstance(chapter_text, str):
-            chapter_text = str(chapter_text)
+        print(f"Sending prompt for chapter batch {idx}/{len(chapter_prompts)}...")
+        chapter_text = await _generate_complete(keys, text_model, chat_history, prompt_content,
+                                                f"Chapter batch {idx}")
+        if checkpoint is not None:
+            await run_io(checkpoint.record_story_text, chapter_text)
 
         full_story_text += chapter_text + "\n\n"
 
-        # Update history: append the user prompt and the model content (if present)
-        chat_history.append(prompt_content)
-        if getattr(chapter_response, "candidates", None) and len(chapter_response.candidates) > 0:
-            chat_history.append(chapter_response.candidates[0].content)
-        else:
-            # fallback: add model content derived from the text
-            chat_history.append(
-                types.Content(role="model", parts=[types.Part.from_text(text=chapter_text)])
-            )
+        if chapter_callback:
+            await chapter_callback(idx, chapter_text)
 
         if progress_callback:
             progress_callback()
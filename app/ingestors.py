@@ -0,0 +1,304 @@
+import io
+import json
+import posixpath
+import re
+import zipfile
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+from app.checkpoint import atomic_write_bytes
+
+READ_CHUNK_CHARACTERS = 64 * 1024
+MAX_CHAPTER_TITLE_LENGTH = 60
+CHAPTERS_FILE_NAME = "chapters.json"  # next to the block folders: the block each chapter starts at
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# HTML elements whose end is a paragraph break, elements that are never narrated, and headings.
+HTML_BLOCK_TAGS = {"p", "div", "li", "ul", "ol", "dl", "dt", "dd", "blockquote", "section", "article",
+                   "aside", "header", "footer", "table", "tr", "pre", "hr", "figure", "figcaption", "body"}
+HTML_SKIPPED_TAGS = {"head", "script", "style", "nav", "noscript", "template", "svg", "math"}
+HTML_CHAPTER_TAGS = {"h1", "h2"}
+HTML_HEADING_TAGS = HTML_CHAPTER_TAGS | {"h3", "h4", "h5", "h6"}
+
+CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+OPF_NS = "{http://www.idpf.org/2007/opf}"
+NCX_NS = "{http://www.daisy.org/z3986/2005/ncx/}"
+XHTML_NS = "{http://www.w3.org/1999/xhtml}"
+EPUB_TYPE_ATTRIBUTE = "{http://www.idpf.org/2007/ops}type"
+
+
+@dataclass
+class TextSection:
+    """
+    A paragraph (or a longer run of text) of a source document.
+
+    `chapter` is set on the first section of each chapter, to the chapter's title.
+    """
+    text: str
+    chapter: Optional[str] = None
+
+
+Ingestor = Callable[[Path], Iterator[TextSection]]
+
+
+def chapter_title(text: str) -> str:
+    """The first line of a text, cut at a word boundary, for a chapter without a title of its own."""
+    line = text.strip().split("\n", 1)[0]
+    if len(line) <= MAX_CHAPTER_TITLE_LENGTH:
+        return line
+    return line[:MAX_CHAPTER_TITLE_LENGTH].rsplit(" ", 1)[0].strip() + "…"
+
+
+# --- Plain text ---
+def ingest_text(path: Path) -> Iterator[TextSection]:
+    """Yields the paragraphs (runs of lines between blank lines) of a UTF-8 text file, one at a time."""
+    lines = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                lines.append(line.rstrip("\n"))
+            elif lines:
+                yield TextSection("\n".join(lines))
+                lines = []
+    if lines:
+        yield TextSection("\n".join(lines))
+
+
+# --- HTML ---
+class _HtmlTextParser(HTMLParser):
+    """
+    Turns HTML into paragraphs of plain text as it is fed, with chapters starting at headings
+    (`headings_start_chapters`), at the document start (`chapter_at_start`) or at the elements
+    whose id is in `anchors` (id -> chapter title).
+    """
+
+    def __init__(self, chapter_at_start: bool = False, chapter_title: Optional[str] = None,
+                 headings_start_chapters: bool = True, anchors: Optional[Dict[str, str]] = None):
+        super().__init__(convert_charrefs=True)
+        self.sections: List[TextSection] = []
+        self._parts: List[str] = []
+        self._skip_depth = 0
+        self._heading_tag: Optional[str] = None
+        self._chapter_open = chapter_at_start
+        self._chapter_title = chapter_title
+        self._headings_start_chapters = headings_start_chapters
+        self._anchors = anchors or {}
+
+    def _emit(self, text: str):
+        chapter = None
+        if self._chapter_open:
+            chapter = self._chapter_title or chapter_title(text)
+            self._chapter_open, self._chapter_title = False, None
+        self.sections.append(TextSection(text, chapter))
+
+    def _flush(self) -> str:
+        text = WHITESPACE_PATTERN.sub(" ", "".join(self._parts)).strip()
+        self._parts = []
+        return text
+
+    def _end_paragraph(self):
+        text = self._flush()
+        if text:
+            self._emit(text)
+
+    def _end_heading(self):
+        text = self._flush()
+        heading_tag, self._heading_tag = self._heading_tag, None
+        if not text:
+            return
+        if self._chapter_open:
+            self._chapter_title = self._chapter_title or text
+        elif self._headings_start_chapters and heading_tag in HTML_CHAPTER_TAGS:
+            self._chapter_open, self._chapter_title = True, text
+        self._emit(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SKIPPED_TAGS:
+            self._skip_depth += 1
+            return
+        anchor_id = dict(attrs).get("id")
+        if anchor_id in self._anchors:
+            self._end_paragraph()
+            self._chapter_open, self._chapter_title = True, self._anchors[anchor_id]
+        if tag == "br":
+            self._parts.append(" ")
+        elif tag in HTML_HEADING_TAGS:
+            self._end_paragraph()
+            self._heading_tag = tag
+        elif tag in HTML_BLOCK_TAGS and self._heading_tag is None:
+            self._end_paragraph()
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in HTML_SKIPPED_TAGS:
+            self._skip_depth -= 1
+
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag == self._heading_tag:
+            self._end_heading()
+        elif tag in HTML_BLOCK_TAGS and self._heading_tag is None:
+            self._end_paragraph()
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def finish(self):
+        self.close()
+        if self._heading_tag is not None:
+            self._end_heading()
+        self._end_paragraph()
+
+
+def _parse_html_stream(chunks: Iterable[str], parser: _HtmlTextParser) -> Iterator[TextSection]:
+    """Feeds HTML to the parser a chunk at a time, yielding the paragraphs finished so far."""
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.sections
+        parser.sections.clear()
+    parser.finish()
+    yield from parser.sections
+
+
+def _read_chunks(text_file) -> Iterator[str]:
+    for chunk in iter(lambda: text_file.read(READ_CHUNK_CHARACTERS), ""):
+        yield chunk
+
+
+def ingest_html(path: Path) -> Iterator[TextSection]:
+    """Yields the paragraphs of an HTML file; every <h1> and <h2> starts a chapter."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        yield from _parse_html_stream(_read_chunks(f), _HtmlTextParser())
+
+
+# --- EPUB ---
+def _resolve_href(base_path: str, href: str) -> Tuple[str, str]:
+    """Resolves a link inside the EPUB archive into (member path, fragment)."""
+    href, _, fragment = href.partition("#")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_path), unquote(href))), fragment
+
+
+def _epub_table_of_contents(archive: zipfile.ZipFile, opf_path: str, package: ElementTree.Element,
+                            manifest: Dict[str, dict]) -> List[Tuple[str, str, str]]:
+    """
+    Reads the EPUB 3 navigation document, or the EPUB 2 NCX file.
+
+    Returns:
+        (member path, fragment, title) of every table of contents entry, in order.
+    """
+    entries = []
+    nav_item = next((item for item in manifest.values() if "nav" in item.get("properties", "").split()), None)
+    if nav_item is not None:
+        nav_path, _ = _resolve_href(opf_path, nav_item["href"])
+        root = ElementTree.fromstring(archive.read(nav_path))
+        for nav in root.iter(f"{XHTML_NS}nav"):
+            if nav.get(EPUB_TYPE_ATTRIBUTE) != "toc":
+                continue
+            for link in nav.iter(f"{XHTML_NS}a"):
+                title = WHITESPACE_PATTERN.sub(" ", "".join(link.itertext())).strip()
+                if link.get("href") and title:
+                    entries.append((*_resolve_href(nav_path, link.get("href")), title))
+        if entries:
+            return entries
+
+    spine = package.find(f"{OPF_NS}spine")
+    ncx_item = manifest.get(spine.get("toc")) if spine is not None else None
+    if ncx_item is not None:
+        ncx_path, _ = _resolve_href(opf_path, ncx_item["href"])
+        root = ElementTree.fromstring(archive.read(ncx_path))
+        for nav_point in root.iter(f"{NCX_NS}navPoint"):
+            label, content = nav_point.find(f"{NCX_NS}navLabel/{NCX_NS}text"), nav_point.find(f"{NCX_NS}content")
+            if label is not None and content is not None and content.get("src") and (label.text or "").strip():
+                entries.append((*_resolve_href(ncx_path, content.get("src")), label.text.strip()))
+    return entries
+
+
+def ingest_epub(path: Path) -> Iterator[TextSection]:
+    """
+    Yields the paragraphs of an EPUB's reading order (its spine), one document at a time.
+
+    Chapters come from the table of contents: an entry pointing at a document starts a chapter
+    there, and one pointing at an anchor starts it at that element. Documents the table of
+    contents does not mention continue the current chapter. Without a table of contents every
+    document is a chapter, titled by its first heading.
+    """
+    with zipfile.ZipFile(path) as archive:
+        container = ElementTree.fromstring(archive.read("META-INF/container.xml"))
+        rootfile = container.find(f"{CONTAINER_NS}rootfiles/{CONTAINER_NS}rootfile")
+        if rootfile is None:
+            raise ValueError("The EPUB has no package document.")
+        opf_path = rootfile.get("full-path")
+        package = ElementTree.fromstring(archive.read(opf_path))
+        manifest = {item.get("id"): dict(item.attrib) for item in package.iter(f"{OPF_NS}item")}
+
+        chapters: Dict[str, Dict[str, str]] = {}  # member path -> fragment ("" for the start) -> title
+        for member_path, fragment, title in _epub_table_of_contents(archive, opf_path, package, manifest):
+            chapters.setdefault(member_path, {}).setdefault(fragment, title)
+
+        first_document = True
+        for itemref in package.iter(f"{OPF_NS}itemref"):
+            item = manifest.get(itemref.get("idref"))
+            if item is None or itemref.get("linear") == "no" or "html" not in item.get("media-type", ""):
+                continue
+            member_path, _ = _resolve_href(opf_path, item["href"])
+            anchors = dict(chapters.get(member_path, {}))
+            start_title = anchors.pop("", None)
+            parser = _HtmlTextParser(chapter_at_start=start_title is not None or not chapters or first_document,
+                                     chapter_title=start_title, headings_start_chapters=False, anchors=anchors)
+            first_document = False
+            with archive.open(member_path) as member:
+                text_file = io.TextIOWrapper(member, encoding="utf-8", errors="replace")
+                yield from _parse_html_stream(_read_chunks(text_file), parser)
+
+
+INGESTORS: Dict[str, Ingestor] = {
+    ".txt": ingest_text,
+    ".html": ingest_html,
+    ".htm": ingest_html,
+    ".xhtml": ingest_html,
+    ".epub": ingest_epub,
+}
+
+
+def register_ingestor(suffix: str, ingestor: Ingestor):
+    """
+    Adds (or replaces) the ingestor of a file type.
+
+    Sources are split in the CPU worker processes, so register ingestors at import time of a
+    module those processes import too.
+    """
+    INGESTORS[suffix.lower()] = ingestor
+
+
+def get_ingestor(path: Path) -> Optional[Ingestor]:
+    return INGESTORS.get(path.suffix.lower())
+
+
+# --- Chapter map ---
+def chapter_map_path(blocks_dir: Path) -> Path:
+    """The chapter map of a job, shared by its backlog and converted block folders."""
+    return blocks_dir.parent / CHAPTERS_FILE_NAME
+
+
+def write_chapter_map(blocks_dir: Path, chapters: Dict[str, str]):
+    """Saves the block each chapter starts at ({block name: chapter title}), or removes a stale map."""
+    if chapters:
+        atomic_write_bytes(chapter_map_path(blocks_dir),
+                           json.dumps(chapters, indent=2, ensure_ascii=False).encode("utf-8"))
+    else:
+        chapter_map_path(blocks_dir).unlink(missing_ok=True)
+
+
+def read_chapter_map(blocks_dir: Path) -> Optional[Dict[str, str]]:
+    """The chapter map written when the source was split, or None if the source had no chapters."""
+    try:
+        return json.loads(chapter_map_path(blocks_dir).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
@@ -1,33 +1,169 @@
+import asyncio
 import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class JobState:
+    """The status of one job. Slots keep thousands of tracked jobs cheap."""
+
+    __slots__ = ("status", "message", "progress", "report", "blocks_total", "blocks_done", "version")
+
+    def __init__(self):
+        self.status: Optional[str] = None
+        self.message: Optional[str] = None
+        self.progress: Optional[float] = None
+        self.report: Optional[dict] = None
+        self.blocks_total: Optional[int] = None
+        self.blocks_done = 0
+        self.version = 0
+
+    def to_dict(self) -> dict:
+        """The status as returned by the API; fields that were never set are left out."""
+        status = {"status": self.status, "message": self.message, "version": self.version}
+        if self.progress is not None:
+            status["progress"] = self.progress
+        if self.report is not None:
+            status["report"] = self.report.copy()
+        if self.blocks_total is not None:
+            status["blocks"] = {"done": self.blocks_done, "total": self.blocks_total}
+        return status
+
+
+class _ChangeWaiter:
+    """Wakes up a long-polling request on its event loop when one of its jobs changes."""
+
+    __slots__ = ("loop", "event")
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:  # the loop has been closed
+            pass
+
 
 class JobManager:
 
-    job_statuses = {}
+    job_statuses: Dict[str, JobState] = {}
     _lock = threading.Lock()
+    # Every change gets the next version, so a job's version also tells whether it changed since a poll.
+    _version = 0
+    _waiters: Dict[str, Set[_ChangeWaiter]] = {}
+
+    @classmethod
+    def _changed(cls, job_id: str, state: JobState):
+        """Gives the job a new version and wakes up its long polls. Called with the lock held."""
+        cls._version += 1
+        state.version = cls._version
+        for waiter in cls._waiters.get(job_id, ()):
+            waiter.notify()
 
     @classmethod
     def update_job_status(cls, job_id: str, status: str, message: str, progress: int = -1):
         """Updates the status and message for a given job."""
         with cls._lock:
-            if job_id not in cls.job_statuses:
-                cls.job_statuses[job_id] = {}
+            state = cls.job_statuses.get(job_id)
+            if state is None:
+                state = cls.job_statuses[job_id] = JobState()
 
-            cls.job_statuses[job_id]["status"] = status
-            cls.job_statuses[job_id]["message"] = message
+            state.status = status
+            state.message = message
 
             if progress >= 0:
-                cls.job_statuses[job_id]["progress"] = progress
+                state.progress = progress
+            cls._changed(job_id, state)
 
     @classmethod
     def increment_job_progress(cls, job_id: str, increment: float):
         """Safely increments the progress for a given job."""
         with cls._lock:
-            if job_id in cls.job_statuses:
-                current_progress = cls.job_statuses[job_id].get("progress", 0)
-                cls.job_statuses[job_id]["progress"] = current_progress + increment
+            state = cls.job_statuses.get(job_id)
+            if state is not None:
+                state.progress = min((state.progress or 0) + increment, 100)
+                cls._changed(job_id, state)
+
+    @classmethod
+    def update_job_report(cls, job_id: str, **entries):
+        """Adds entries to the job's report (e.g. what a pipeline stage removed or repaired)."""
+        with cls._lock:
+            state = cls.job_statuses.get(job_id)
+            if state is not None:
+                if state.report is None:
+                    state.report = {}
+                state.report.update(entries)
+                cls._changed(job_id, state)
+
+    @classmethod
+    def update_job_blocks(cls, job_id: str, total: int, done: Optional[int] = None):
+        """Sets how many audio blocks the job has and, optionally, how many of them are done."""
+        with cls._lock:
+            state = cls.job_statuses.get(job_id)
+            if state is not None:
+                state.blocks_total = total
+                if done is not None:
+                    state.blocks_done = done
+                cls._changed(job_id, state)
+
+    @classmethod
+    def increment_blocks_done(cls, job_id: str):
+        with cls._lock:
+            state = cls.job_statuses.get(job_id)
+            if state is not None and state.blocks_total is not None:
+                state.blocks_done += 1
+                cls._changed(job_id, state)
 
     @classmethod
     def retrieve_job_status(cls, job_id: str):
         """Retrieves the status object for a given job."""
         with cls._lock:
-            return cls.job_statuses.get(job_id, {}).copy()
\ No newline at end of file
+            state = cls.job_statuses.get(job_id)
+            return state.to_dict() if state is not None else {}
+
+    @classmethod
+    def retrieve_job_statuses(cls, job_ids: Iterable[str]) -> Dict[str, dict]:
+        """Retrieves the status objects of several jobs at once; unknown job IDs are left out."""
+        with cls._lock:
+            return {job_id: cls.job_statuses[job_id].to_dict()
+                    for job_id in job_ids if job_id in cls.job_statuses}
+
+    @classmethod
+    async def wait_for_change(cls, job_ids: List[str], versions: Dict[str, int], timeout: float) -> bool:
+        """
+        Waits until one of the jobs changes, for at most `timeout` seconds.
+
+        Args:
+            job_ids: The jobs to watch.
+            versions: The version of each job the caller has seen; a missing entry means the
+                job did not exist yet.
+            timeout: The longest time to wait, in seconds.
+
+        Returns:
+            True if a job changed, False if the timeout passed first.
+        """
+        waiter = _ChangeWaiter()
+        with cls._lock:
+            # Register before comparing, so a change between the caller's read and now still wakes us.
+            for job_id in job_ids:
+                cls._waiters.setdefault(job_id, set()).add(waiter)
+            changed = any(cls.job_statuses[job_id].version != versions.get(job_id, 0)
+                          if job_id in cls.job_statuses else job_id in versions
+                          for job_id in job_ids)
+        try:
+            if changed:
+                return True
+            try:
+                await asyncio.wait_for(waiter.event.wait(), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+        finally:
+            with cls._lock:
+                for job_id in job_ids:
+                    waiters = cls._waiters.get(job_id)
+                    if waiters is not None:
+                        waiters.discard(waiter)
+                        if not waiters:
+                            del cls._waiters[job_id]
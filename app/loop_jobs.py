@@ -0,0 +1,111 @@
+import asyncio
+import multiprocessing
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from app.config import get_settings
+from app.executors import run_io
+from app.job_manager import JobManager
+from app.storage import publish_files
+
+PROGRESS_REPORT_INTERVAL_SECONDS = 1.0
+
+_loop_executor: Optional[ProcessPoolExecutor] = None
+_progress_manager = None
+
+
+def _get_loop_executor() -> ProcessPoolExecutor:
+    """Creates the encode process pool on first use, capped by LOOP_MAX_CONCURRENT_ENCODES."""
+    global _loop_executor, _progress_manager
+    if _loop_executor is None:
+        context = multiprocessing.get_context("spawn")
+        _progress_manager = context.Manager()
+        _loop_executor = ProcessPoolExecutor(max_workers=get_settings().loop_max_concurrent_encodes,
+                                             mp_context=context)
+    return _loop_executor
+
+
+def shutdown_loop_executor():
+    """Stops the encode processes. Called when the server shuts down."""
+    global _loop_executor, _progress_manager
+    if _loop_executor is not None:
+        _loop_executor.shutdown(wait=False, cancel_futures=True)
+        _progress_manager.shutdown()
+        _loop_executor, _progress_manager = None, None
+
+
+def create_loop_output_path(job_dir: Path, has_video: bool) -> Path:
+    """Returns where a loop job writes its artifact: an .mp4 for videos, an .mp3 for audio only."""
+    return job_dir / "media-output" / ("looped_video.mp4" if has_video else "looped_audio.mp3")
+
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s" if hours else f"{minutes}m {seconds:02d}s"
+
+
+def encode_loop(video_path: Optional[Path], audio_path: Optional[Path], output_path: Path, target_seconds: float,
+                crossfade: float, progress_queue=None) -> Path:
+    """
+    Runs a loop encode. Executed in a worker process of the encode pool.
+
+    Progress is sent back as (seconds_done, target_seconds) tuples through `progress_queue`,
+    at most once per PROGRESS_REPORT_INTERVAL_SECONDS.
+    """
+    from app.audio_loop import loop_audio
+    from app.video_loop import loop_video
+
+    last_report = 0.0
+
+    def report_progress(seconds_done: float, total_seconds: float):
+        nonlocal last_report
+        now = time.monotonic()
+        if progress_queue is not None and (now - last_report >= PROGRESS_REPORT_INTERVAL_SECONDS
+                                           or seconds_done >= total_seconds):
+            last_report = now
+            progress_queue.put((seconds_done, total_seconds))
+
+    if video_path is not None:
+        return loop_video(video_path, output_path, target_seconds, crossfade, audio_path=audio_path,
+                          progress_callback=report_progress)
+    return loop_audio(audio_path, output_path, target_seconds, crossfade, progress_callback=report_progress)
+
+
+async def run_loop_pipeline(job_id: str, video_path: Optional[Path], audio_path: Optional[Path], output_path: Path,
+                            target_seconds: float, crossfade: float, base_data_dir: Optional[Path] = None):
+    """
+    The background task of a loop job: runs the encode in the process pool, off the event loop,
+    and mirrors its progress into the JobManager. With `base_data_dir`, the result is then
+    copied to the storage (see app.storage).
+    """
+    try:
+        executor = _get_loop_executor()
+        progress_queue = _progress_manager.Queue()
+
+        JobManager.update_job_status(job_id, "processing", "Waiting for a free encoder...", progress=0)
+        encode = asyncio.get_running_loop().run_in_executor(
+            executor, encode_loop, video_path, audio_path, output_path, target_seconds, crossfade, progress_queue)
+
+        while not encode.done():
+            try:
+                seconds_done, total_seconds = await asyncio.to_thread(progress_queue.get, True, 0.5)
+            except queue.Empty:
+                continue
+            JobManager.update_job_status(
+                job_id, "processing",
+                f"Encoding loop: {_format_seconds(seconds_done)} of {_format_seconds(total_seconds)}...",
+                progress=int(seconds_done / total_seconds * 100) if total_seconds else 0)
+
+        await encode
+        if base_data_dir is not None:
+            await run_io(publish_files, base_data_dir, [output_path])
+        JobManager.update_job_status(job_id, "complete", "Your looped media is ready for download!", progress=100)
+        print(f"[{job_id}] Loop job completed successfully.")
+
+    except Exception as e:
+        print(f"[{job_id}] An error occurred in the loop pipeline: {e}")
+        JobManager.update_job_status(job_id, "error", f"An error occurred: {e}")
@@ -1,40 +1,116 @@
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, BackgroundTasks, HTTPException, Header
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
 from fastapi.responses import HTMLResponse
-from app.processor import run_conversion_pipeline, create_job_folders
+from app.processor import run_conversion_pipeline, create_job_folders, run_story_audiobook_pipeline, \
+    resume_checkpointed_job, remove_job_folders
+from app.checkpoint import JobCheckpoint, find_resumable_jobs, STAGE_COMPLETE
 from app.story_creator import run_story_creation_pipeline
 from app.job_manager import JobManager
-from pathlib import Path
+from app.config import get_settings, validate_settings
+from app.warmup import prewarm
+from app.loop_jobs import run_loop_pipeline, create_loop_output_path, shutdown_loop_executor
+from app.storage import get_storage, publish_files, storage_key
+from app.simulator import EtaEstimator
+from app.executors import run_io, shutdown_executors, LoopLagMonitor
+from pathlib import Path, PurePosixPath
 from pydantic import BaseModel, Field
+from typing import Coroutine, Dict, List, Optional
+import hashlib
 import uuid
 
+MAX_BATCH_STATUS_JOBS = 1000
+MAX_LONG_POLL_SECONDS = 60
+
 class StoryRequest(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
     summary: str = Field(..., min_length=10, max_length=2000)
     chapters: int = Field(..., gt=0, le=20)
     chars_per_chapter: int = Field(..., gt=100, le=10000)
 
-app = FastAPI()
+class StoryAudiobookRequest(StoryRequest):
+    include_pdf: bool = False
 
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+class JobStatusesRequest(BaseModel):
+    job_ids: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_STATUS_JOBS)
+    wait_seconds: float = Field(0, ge=0, le=MAX_LONG_POLL_SECONDS)
 
-templates = Jinja2Templates(directory="app/templates")
+MAX_LOOP_DURATION_SECONDS = 12 * 3600
+MAX_LOOP_CROSSFADE_SECONDS = 10
 
 # Define a root directory for all job-related data
 DATA_DIR = Path(__file__).resolve().parent.parent / "data/job-data"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+# The running conversion and story jobs, so they can be cancelled; the references also keep the
+# tasks from being garbage collected.
+job_tasks: Dict[str, asyncio.Task] = {}
+cancelled_job_ids = set()
+CANCEL_WAIT_SECONDS = 10
+
+
+async def run_cancellable_job(job_id: str, pipeline: Coroutine):
+    """Runs a job's pipeline and, if the job is cancelled through /cancel, deletes its files."""
+    try:
+        await pipeline
+    except asyncio.CancelledError:
+        if job_id not in cancelled_job_ids:
+            raise  # e.g. the server is shutting down: keep the files, so the job can be resumed
+        JobManager.update_job_status(job_id, "cancelled", "The job was cancelled.")
+        await run_io(remove_job_folders, DATA_DIR, job_id)
+        print(f"[{job_id}] Job cancelled; its files were deleted.")
+    finally:
+        cancelled_job_ids.discard(job_id)
+
+
+def start_job_task(job_id: str, pipeline: Coroutine):
+    task = asyncio.create_task(run_cancellable_job(job_id, pipeline))
+    job_tasks[job_id] = task
+    task.add_done_callback(lambda done: job_tasks.pop(job_id) if job_tasks.get(job_id) is done else None)
+
+
+def start_resumed_job(job_id: str):
+    JobManager.update_job_status(job_id=job_id, status="accepted", message="Job queued for resuming.")
+    start_job_task(job_id, resume_checkpointed_job(job_id, DATA_DIR))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fail fast on a bad configuration, then warm the heavy dependencies up in the
+    # background so the server answers requests right away.
+    validate_settings()
+    settings = get_settings()
+    if settings.prewarm_on_startup:
+        asyncio.get_running_loop().run_in_executor(None, prewarm)
+    if settings.resume_jobs_on_startup:
+        for job_id in find_resumable_jobs(DATA_DIR):
+            print(f"Resuming interrupted job {job_id}")
+            start_resumed_job(job_id)
+    loop_lag_monitor = LoopLagMonitor(settings.loop_lag_warning_ms / 1000)
+    loop_lag_monitor.start()
+    yield
+    loop_lag_monitor.stop()
+    shutdown_executors()
+    shutdown_loop_executor()
+
+app = FastAPI(lifespan=lifespan)
+
+app.mount("/static", StaticFiles(directory="app/static"), name="static")
+
+templates = Jinja2Templates(directory="app/templates")
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.post("/create-job")
-async def create_job(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def create_job(file: UploadFile = File(...)):
     """
-    Accepts a PDF file, creates a unique job, saves the file,
+    Accepts a PDF (or EPUB, HTML or text) file, creates a unique job, saves the file,
     and starts the conversion pipeline in the background.
     """
 
@@ -48,8 +124,8 @@ async def create_job(background_tasks: BackgroundTasks, file: UploadFile = File(
 
         # Save the uploaded file
         source_pdf_path = text_input_dir / file.filename
-        with open(source_pdf_path, "wb") as buffer:
-            buffer.write(await file.read())
+        await run_io(source_pdf_path.write_bytes, await file.read())
+        await run_io(publish_files, DATA_DIR, [source_pdf_path])
         print(f"File '{file.filename}' saved for job {job_id}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to initialize job: {e}")
@@ -57,10 +133,11 @@ async def create_job(background_tasks: BackgroundTasks, file: UploadFile = File(
     # Set the initial status
     JobManager.update_job_status(job_id=job_id, status="accepted", message="Job accepted and queued.")
 
-    # Add the long-running task to the background
-    background_tasks.add_task(run_conversion_pipeline, job_id=job_id, text_input_dir=text_input_dir,
-                              audio_input_dir=audio_input_dir, audio_converted_dir=audio_converted_dir,
-                              audio_output_blocks_dir=audio_output_blocks_dir, final_audio_dir=final_audio_dir)
+    # Run the long-running pipeline in the background
+    start_job_task(job_id, run_conversion_pipeline(
+        job_id=job_id, text_input_dir=text_input_dir, audio_input_dir=audio_input_dir,
+        audio_converted_dir=audio_converted_dir, audio_output_blocks_dir=audio_output_blocks_dir,
+        final_audio_dir=final_audio_dir))
 
     return {"job_id": job_id}
 
@@ -68,14 +145,101 @@ async def create_job(background_tasks: BackgroundTasks, file: UploadFile = File(
 async def get_status(job_id: str):
     """
     Retrieves the current status of a conversion job.
+
+    Running jobs with audio blocks also get `eta_seconds`, estimated by simulating their
+    remaining blocks with the latency and quota errors measured so far (see app.simulator).
     """
     try:
-        return JobManager.retrieve_job_status(job_id)
+        status = JobManager.retrieve_job_status(job_id)
     except KeyError:
         raise HTTPException(status_code=404, detail="Job ID not found")
+    blocks = status.get("blocks")
+    if status.get("status") in ("processing", "paused") and blocks:
+        status["eta_seconds"] = await asyncio.to_thread(EtaEstimator.eta_seconds, job_id,
+                                                        blocks["total"] - blocks["done"])
+    else:
+        EtaEstimator.forget(job_id)
+    return status
+
+def job_statuses_etag(job_ids: List[str], statuses: dict) -> str:
+    """An ETag for a batch of job statuses, derived from the version of every job in it."""
+    versions = "\n".join(f"{job_id}:{statuses[job_id]['version'] if job_id in statuses else 0}"
+                          for job_id in job_ids)
+    return f'"{hashlib.sha1(versions.encode()).hexdigest()[:20]}"'
+
+@app.post("/job-statuses")
+async def get_job_statuses(request: JobStatusesRequest, if_none_match: Optional[str] = Header(None)):
+    """
+    Retrieves the status of many jobs in one request, e.g. for a dashboard.
+
+    Every status carries a `version` that grows whenever the job changes, and the response
+    has an ETag. Sent back as `If-None-Match`, it gets a `304 Not Modified` while none of the
+    jobs has changed. With `wait_seconds` as well, the request is held until one of the jobs
+    changes (and then answered right away) or the wait is over (304). Unknown job IDs are
+    listed under `missing`.
+    """
+    job_ids = list(dict.fromkeys(request.job_ids))
+    statuses = JobManager.retrieve_job_statuses(job_ids)
+    etag = job_statuses_etag(job_ids, statuses)
+    client_etags = {tag.strip().removeprefix("W/") for tag in (if_none_match or "").split(",")}
+    if etag in client_etags:
+        versions = {job_id: status["version"] for job_id, status in statuses.items()}
+        if not request.wait_seconds or not await JobManager.wait_for_change(job_ids, versions,
+                                                                            request.wait_seconds):
+            return Response(status_code=304, headers={"ETag": etag})
+        statuses = JobManager.retrieve_job_statuses(job_ids)
+        etag = job_statuses_etag(job_ids, statuses)
+    return JSONResponse({"jobs": statuses, "missing": [job_id for job_id in job_ids if job_id not in statuses]},
+                        headers={"ETag": etag})
+
+@app.post("/cancel/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancels a running conversion or story job and deletes its files.
+
+    The job's queued blocks are dropped with its TTS workers, which release their
+    concurrency slots, and its in-flight TTS requests are abandoned at their next chunk.
+    Rate-limit slots of requests that were already sent stay taken, since the API counted
+    them. Answers once the job has stopped (or after CANCEL_WAIT_SECONDS).
+    """
+    task = job_tasks.get(job_id)
+    if task is None or task.done():  # a finished task stays listed until its done-callback has run
+        if not JobManager.retrieve_job_status(job_id):
+            raise HTTPException(status_code=404, detail="Job ID not found")
+        raise HTTPException(status_code=409, detail="This job is not running.")
+    cancelled_job_ids.add(job_id)
+    JobManager.update_job_status(job_id, "cancelling", "Cancelling the job...")
+    task.cancel()
+    await asyncio.wait({task}, timeout=CANCEL_WAIT_SECONDS)
+    return {"job_id": job_id, "status": JobManager.retrieve_job_status(job_id).get("status")}
+
+@app.post("/resume/{job_id}")
+async def resume_job(job_id: str):
+    """
+    Resumes an interrupted or failed job from its checkpoint. The audio made so far is verified
+    and kept; only the missing blocks are generated. Story jobs continue after the last chapter
+    batch written, without asking the model for the earlier ones again.
+    """
+    checkpoint = JobCheckpoint.load(DATA_DIR / job_id)
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail="No checkpoint found for this job ID.")
+    if checkpoint.stage == STAGE_COMPLETE:
+        raise HTTPException(status_code=409, detail="This job is already complete.")
+    if job_id in job_tasks:
+        raise HTTPException(status_code=409, detail="This job is already running.")
+    start_resumed_job(job_id)
+    return {"job_id": job_id}
+
+@app.post("/resume-jobs")
+async def resume_jobs():
+    """Rescans the job folder and resumes every interrupted job that is not already running."""
+    job_ids = [job_id for job_id in find_resumable_jobs(DATA_DIR) if job_id not in job_tasks]
+    for job_id in job_ids:
+        start_resumed_job(job_id)
+    return {"resumed_job_ids": job_ids}
 
 @app.post("/create-story-job")
-async def create_story_job(background_tasks: BackgroundTasks, request: StoryRequest):
+async def create_story_job(request: StoryRequest):
     job_id = str(uuid.uuid4())
     try:
         # Create a simpler folder structure for story jobs
@@ -85,28 +249,150 @@ async def create_story_job(background_tasks: BackgroundTasks, request: StoryRequ
         raise HTTPException(status_code=500, detail=f"Failed to initialize story job: {e}")
 
     JobManager.update_job_status(job_id=job_id, status="accepted", message="Story job accepted.")
-    background_tasks.add_task(run_story_creation_pipeline, job_id=job_id, base_data_dir=DATA_DIR, story_params=request.dict())
+    start_job_task(job_id, run_story_creation_pipeline(job_id=job_id, base_data_dir=DATA_DIR,
+                                                       story_params=request.dict()))
+    return {"job_id": job_id}
+
+@app.post("/create-story-audiobook-job")
+async def create_story_audiobook_job(request: StoryAudiobookRequest):
+    """
+    Writes a story and narrates it in a single job, without the PDF round trip.
+    """
+    job_id = str(uuid.uuid4())
+    JobManager.update_job_status(job_id=job_id, status="accepted", message="Story audiobook job accepted.")
+    start_job_task(job_id, run_story_audiobook_pipeline(job_id=job_id, base_data_dir=DATA_DIR,
+                                                        story_params=request.dict()))
+    return {"job_id": job_id}
+
+
+@app.post("/create-loop-job")
+async def create_loop_job(background_tasks: BackgroundTasks, video: Optional[UploadFile] = File(None),
+                          audio: Optional[UploadFile] = File(None), duration_seconds: int = Form(3600),
+                          crossfade_seconds: float = Form(1)):
+    """
+    Accepts a video and/or an audio file and loops it to `duration_seconds` in the background.
+    The encode runs in a process pool, so several loop jobs can run without blocking the server.
+    """
+    if video is None and audio is None:
+        raise HTTPException(status_code=400, detail="Upload a video file, an audio file, or both.")
+    if not 0 < duration_seconds <= MAX_LOOP_DURATION_SECONDS:
+        raise HTTPException(status_code=400,
+                            detail=f"duration_seconds must be between 1 and {MAX_LOOP_DURATION_SECONDS}.")
+    if not 0 <= crossfade_seconds <= MAX_LOOP_CROSSFADE_SECONDS:
+        raise HTTPException(status_code=400,
+                            detail=f"crossfade_seconds must be between 0 and {MAX_LOOP_CROSSFADE_SECONDS}.")
+
+    job_id = str(uuid.uuid4())
+    job_dir = DATA_DIR / job_id
+    try:
+        media_input_dir = job_dir / "media-input"
+        media_input_dir.mkdir(parents=True, exist_ok=True)
+
+        saved_paths = {}
+        for field_name, upload in (("video", video), ("audio", audio)):
+            if upload is not None:
+                saved_paths[field_name] = media_input_dir / f"{field_name}{Path(upload.filename).suffix.lower()}"
+                await run_io(saved_paths[field_name].write_bytes, await upload.read())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to initialize loop job: {e}")
+
+    JobManager.update_job_status(job_id=job_id, status="accepted", message="Loop job accepted and queued.")
+    background_tasks.add_task(run_loop_pipeline, job_id=job_id, video_path=saved_paths.get("video"),
+                              audio_path=saved_paths.get("audio"),
+                              output_path=create_loop_output_path(job_dir, has_video=video is not None),
+                              target_seconds=duration_seconds, crossfade=crossfade_seconds,
+                              base_data_dir=DATA_DIR)
     return {"job_id": job_id}
 
 
+class StoredFileResponse(FileResponse):
+    """A FileResponse for a file of the storage that releases it once sent, even if the client went away."""
+
+    def __init__(self, key: str, path: Path, **kwargs):
+        super().__init__(path=path, **kwargs)
+        self.key = key
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await run_io(get_storage(DATA_DIR).release, self.key)
+
+
+async def stored_file_response(key: str, media_type: str) -> Optional[Response]:
+    """
+    Serves a job file kept in the storage, or returns None if there is no such file.
+
+    The file is served from disk with HTTP Range support (downloaded into the cache first when
+    the storage is remote); an object too large for the cache is streamed from the storage instead.
+    """
+    storage = get_storage(DATA_DIR)
+    filename = PurePosixPath(key).name
+    try:
+        path = await run_io(storage.local_path, key)
+        if path is not None:
+            return StoredFileResponse(key, path, media_type=media_type, filename=filename)
+        size = await run_io(storage.size, key)
+    except ValueError:  # a key that climbs out of the storage
+        return None
+    if size is None:
+        return None
+    return StreamingResponse(storage.iter_chunks(key), media_type=media_type,
+                             headers={"Content-Length": str(size),
+                                      "Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @app.get("/download/{job_id}")
-async def download_file(job_id: str):
+async def download_file(job_id: str, artifact: Optional[str] = None):
+    """
+    Serves the final file of a job. Narrated stories have both an audiobook and a PDF,
+    so `artifact` ("audio" or "pdf") can select one; by default the audiobook wins.
+    Loop jobs serve their looped video or audio.
+
+    Every file is served with HTTP Range support, so a player can fetch just the part it
+    plays; the byte offsets of the chapters are in the job's 'manifest.json'.
+    """
     job_dir = DATA_DIR / job_id
 
-    # Check for story PDF first
-    story_dir = job_dir / "final-story"
-    if story_dir.exists():
-        # Find the first PDF in the directory
-        pdf_files = list(story_dir.glob("*.pdf"))
-        if pdf_files:
-            return FileResponse(path=pdf_files[0], media_type='application/pdf', filename=pdf_files[0].name)
-
-    # Check for audiobook WAV next
-    audio_dir = job_dir / "audio-output" / "final-audio"
-    audio_file = audio_dir / "final_audio.wav"
-    print(audio_file)
-    if audio_file.exists():
-        return FileResponse(path=audio_file, media_type='audio/wav', filename='final_audio.wav')
-
-    # If neither exists, raise an error
-    raise HTTPException(status_code=404, detail="Final file not ready or job ID not found.")
\ No newline at end of file
+    # Check for audiobook WAV first
+    if artifact in (None, "audio"):
+        response = await stored_file_response(f"{job_id}/audio-output/final-audio/final_audio.wav", "audio/wav")
+        if response is not None:
+            return response
+
+    # Check for story PDF next
+    if artifact in (None, "pdf"):
+        try:
+            story_keys = await run_io(get_storage(DATA_DIR).list_keys, f"{job_id}/final-story")
+        except ValueError:
+            story_keys = []
+        # Serve the first PDF in the folder
+        pdf_keys = [key for key in story_keys if key.endswith(".pdf")]
+        response = await stored_file_response(pdf_keys[0], "application/pdf") if pdf_keys else None
+        if response is not None:
+            return response
+
+    # Check for looped media last
+    if artifact in (None, "loop"):
+        for has_video, media_type in ((True, "video/mp4"), (False, "audio/mpeg")):
+            response = await stored_file_response(
+                storage_key(DATA_DIR, create_loop_output_path(job_dir, has_video=has_video)), media_type)
+            if response is not None:
+                return response
+
+    # If none exists, raise an error
+    raise HTTPException(status_code=404, detail="Final file not ready or job ID not found.")
+
+
+@app.get("/download/{job_id}/{artifact_path:path}")
+async def download_audiobook_artifact(job_id: str, artifact_path: str):
+    """
+    Serves the audiobook index files of a job: 'manifest.json', 'playlist.m3u' and the
+    'segments/segmentNNN.wav' files written when AUDIO_SEGMENT_MODE is "fixed" or "chapters".
+    """
+    media_types = {".json": "application/json", ".m3u": "audio/x-mpegurl", ".wav": "audio/wav"}
+    response = await stored_file_response(f"{job_id}/audio-output/final-audio/{artifact_path}",
+                                          media_types.get(PurePosixPath(artifact_path).suffix, "application/octet-stream"))
+    if response is None:
+        raise HTTPException(status_code=404, detail="File not found for this job.")
+    return response
@@ -1,7 +1,94 @@
 import os
 import re
-from PyPDF2 import PdfReader  # Or from pypdf import PdfReader for newer installations
+from collections import Counter
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import List, Tuple
+
+# --- Automatic header/footer detection ---
+EDGE_LINES = 2  # how many non-empty lines at the top and bottom of a page are header/footer candidates
+MIN_REPEAT_RATIO = 0.3  # a candidate is stripped if it repeats on at least this share of the pages...
+MIN_REPEAT_PAGES = 3  # ...and on at least this many pages
+MAX_EDGE_LINE_LENGTH = 120  # running headers and footers are short; longer lines are always kept
+DIGITS_PATTERN = re.compile(r"\d+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+@dataclass
+class HeaderFooterReport:
+    pages: int = 0
+    lines_removed: int = 0
+    characters_removed: int = 0  # i.e. TTS characters saved
+    repeated_lines: List[str] = field(default_factory=list)  # the normalized lines that were stripped
+
+    def to_dict(self) -> dict:
+        return {
+            "pages": self.pages,
+            "lines_removed": self.lines_removed,
+            "characters_removed": self.characters_removed,
+            "repeated_lines": self.repeated_lines,
+        }
+
+
+def normalize_edge_line(line: str) -> str:
+    """Normalizes a line for comparison across pages: digits become '#', case and spacing are ignored."""
+    return WHITESPACE_PATTERN.sub(" ", DIGITS_PATTERN.sub("#", line)).strip().lower()
+
+
+def _edge_line_indexes(lines: List[str]) -> Tuple[List[int], List[int]]:
+    """Returns the indexes of the first and of the last EDGE_LINES non-empty lines of a page."""
+    non_empty = [i for i, line in enumerate(lines) if line.strip()]
+    return non_empty[:EDGE_LINES], non_empty[::-1][:EDGE_LINES]
+
+
+def remove_repeated_headers_footers(pages: List[str]) -> Tuple[List[str], HeaderFooterReport]:
+    """
+    Detects running headers, footers and page numbers and removes them from every page.
+
+    The first and last lines of each page are indexed in one pass, with digits normalized so
+    that "Page 12 of 130" and "Page 13 of 130" count as the same line. Lines that repeat on
+    enough pages are then stripped from the top and bottom of every page; text in the middle
+    of a page is never touched.
+
+    Args:
+        pages: The text of each page, in order.
+
+    Returns:
+        A tuple with the cleaned pages and a report of what was removed.
+    """
+    report = HeaderFooterReport(pages=len(pages))
+    page_lines = [page.splitlines() for page in pages]
+
+    # --- One pass: count each normalized edge line once per page ---
+    frequency = Counter()
+    for lines in page_lines:
+        top, bottom = _edge_line_indexes(lines)
+        frequency.update({normalize_edge_line(lines[i]) for i in top + bottom
+                          if len(lines[i].strip()) <= MAX_EDGE_LINE_LENGTH})
+
+    threshold = max(MIN_REPEAT_PAGES, MIN_REPEAT_RATIO * len(pages))
+    repeated = {line for line, count in frequency.items() if line and count >= threshold}
+    if not repeated:
+        return pages, report
+    report.repeated_lines = sorted(repeated)
+
+    # --- Strip the repeated lines, peeling inwards from both edges of each page ---
+    cleaned_pages = []
+    for lines in page_lines:
+        top, bottom = _edge_line_indexes(lines)
+        removed = set()
+        for edge in (top, bottom):
+            for i in edge:
+                if normalize_edge_line(lines[i]) not in repeated:
+                    break
+                removed.add(i)
+        for i in removed:
+            report.lines_removed += 1
+            report.characters_removed += len(lines[i].strip())
+        cleaned_pages.append("\n".join(line for i, line in enumerate(lines) if i not in removed))
+
+    return cleaned_pages, report
+
 
 def find_first_pdf(folder_path):
     """Finds the first PDF file in the given folder."""
@@ -23,6 +110,8 @@ def clean_pdf_text(pdf_path, output_path, header_text, footer_page_number_patter
                                             Example: r"^\d+ of \d+$" for "X of Y"
         skip_first_page_cleaning (bool): If True, the first page will not have headers/footers removed.
     """
+    from PyPDF2 import PdfReader  # Or from pypdf import PdfReader for newer installations
+
     all_pages_cleaned_text = []
     try:
         reader = PdfReader(pdf_path)
@@ -116,29 +205,22 @@ def clean_pdf_text(pdf_path, output_path, header_text, footer_page_number_patter
 
 
 def main():
-    input_folder = Path(__file__).resolve().parent.parent / "data/text-input"
-
-    # Parameters for "Alice's Adventures in Wonderland"
-    header_to_remove = "Alice’s Adventures in Wonderland"  # Exact header text
-
-    # Regex for "X of Y" (e.g., "1 of 130", "12 of 130")
-    # This pattern is used for both standalone line matching and prefix matching.
-    # It must have ^ and $ for standalone_page_num_regex.fullmatch()
-    page_number_pattern = r"^\d+ of \d+$"
+    from app.pdf_handler import extract_pages_from_pdf
 
+    input_folder = Path(__file__).resolve().parent.parent / "data/text-input"
     pdf_file_path = find_first_pdf(input_folder)
 
     if pdf_file_path:
         base_name = os.path.splitext(os.path.basename(pdf_file_path))[0]
         output_file_path = os.path.join(input_folder, f"{base_name}_cleaned.txt")
 
-        clean_pdf_text(
-            pdf_path=pdf_file_path,
-            output_path=output_file_path,
-            header_text=header_to_remove,
-            footer_page_number_pattern_str=page_number_pattern,
-            skip_first_page_cleaning=True
-        )
+        # Headers, footers and page numbers are detected from the document itself.
+        pages, report = remove_repeated_headers_footers(extract_pages_from_pdf(Path(pdf_file_path)))
+        with open(output_file_path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(page for page in pages if page.strip()))
+        print(f"Removed {report.lines_removed} header/footer line(s) ({report.characters_removed} characters) "
+              f"from {report.pages} pages: {report.repeated_lines}")
+        print(f"Cleaned text saved to: {output_file_path}")
     else:
         print(f"No PDF files found in {input_folder}")
 
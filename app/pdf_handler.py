@@ -1,14 +1,28 @@
 import re
+import textwrap
 from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
 
-from PyPDF2 import PdfReader
+from app.block_planner import BlockSizePlanner
+from app.ingestors import INGESTORS, TextSection, get_ingestor, write_chapter_map
+from app.pdf_cleaner import HeaderFooterReport, remove_repeated_headers_footers
 
-CHARACTER_LIMIT = 1000
+PARAGRAPH_SEPARATOR_PATTERN = re.compile(r"\n\s*\n")
+SENTENCE_SEPARATOR_PATTERN = re.compile(r"(?<=[.!?…])\s+")
+CLAUSE_SEPARATOR_PATTERN = re.compile(r"(?<=[,;:—])\s+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+PARAGRAPH_BREAK_FILL = 0.8  # a block this full ends at the paragraph boundary instead of taking more sentences
+STREAM_BUFFER_BLOCKS = 4  # streamed text is split once this many blocks' worth of it is buffered
+
+
+def source_suffixes() -> Tuple[str, ...]:
+    """The file types a conversion job accepts: PDFs and every type with an ingestor."""
+    return (".pdf", *INGESTORS)
 
 
 def find_source_file(folder_path: Path) -> Path:
     """
-    Finds the first .pdf or .txt file in the specified folder.
+    Finds the first source file (.pdf, .txt, .epub, .html, ...) in the specified folder.
 
     Args:
         folder_path: The directory to search in.
@@ -17,12 +31,29 @@ def find_source_file(folder_path: Path) -> Path:
         The full path to the first found file.
 
     Raises:
-        FileNotFoundError: If no .pdf or .txt file is found.
+        FileNotFoundError: If no supported file is found.
     """
+    suffixes = source_suffixes()
     for file_path in folder_path.iterdir():
-        if file_path.is_file() and file_path.suffix.lower() in [".pdf", ".txt"]:
+        if file_path.is_file() and file_path.suffix.lower() in suffixes:
             return file_path
-    raise FileNotFoundError("No source .pdf or .txt file found in the input folder.")
+    raise FileNotFoundError(f"No source file ({', '.join(suffixes)}) found in the input folder.")
+
+
+def extract_pages_from_pdf(pdf_path: Path) -> list[str]:
+    """
+    Extracts the text of each page of a given PDF file.
+
+    Args:
+        pdf_path: The path to the PDF file.
+
+    Returns:
+        A list with the text of every page that has any.
+    """
+    from PyPDF2 import PdfReader  # imported on first use to keep the API process start fast
+
+    reader = PdfReader(pdf_path)
+    return [page_text for page_text in (page.extract_text() for page in reader.pages) if page_text]
 
 
 def extract_text_from_pdf(pdf_path: Path) -> str:
@@ -35,18 +66,42 @@ def extract_text_from_pdf(pdf_path: Path) -> str:
     Returns:
         A single string containing all the text from the PDF.
     """
-    reader = PdfReader(pdf_path)
-    text = ""
-    for page in reader.pages:
-        page_text = page.extract_text()
-        if page_text:
-            text += page_text + "\n"
-    return text
+    return "".join(page_text + "\n" for page_text in extract_pages_from_pdf(pdf_path))
+
+
+def _split_long_sentence(sentence: str, limit: int) -> list[str]:
+    """
+    Splits a sentence longer than `limit` at clause punctuation, then at spaces,
+    and only as a last resort in the middle of a word.
+    """
+    pieces = []
+    for clause in CLAUSE_SEPARATOR_PATTERN.split(sentence):
+        if len(clause) > limit:
+            pieces.extend(textwrap.wrap(clause, width=limit, break_long_words=True, break_on_hyphens=False))
+        elif clause:
+            pieces.append(clause)
+
+    # Re-pack the pieces so the sentence is cut as few times as possible.
+    parts = []
+    current_part = ""
+    for piece in pieces:
+        if current_part and len(current_part) + 1 + len(piece) > limit:
+            parts.append(current_part)
+            current_part = piece
+        else:
+            current_part = f"{current_part} {piece}" if current_part else piece
+    if current_part:
+        parts.append(current_part)
+    return parts
 
 
 def split_text_into_blocks(text: str, limit: int) -> list[str]:
     """
-    Splits a large text into smaller blocks, ensuring sentences are not cut off.
+    Splits a large text into blocks of at most `limit` characters, with as few blocks as possible.
+
+    Blocks end at paragraph boundaries when the block is already mostly full, and otherwise
+    at sentence boundaries. Sentences longer than `limit` are split at clauses or words, so no
+    block ever exceeds the limit.
 
     Args:
         text: The full text to be split.
@@ -56,62 +111,154 @@ def split_text_into_blocks(text: str, limit: int) -> list[str]:
         A list of text blocks.
     """
     blocks = []
-    # Split by sentence-ending punctuation, keeping the punctuation
-    sentences = re.split(r'(?<=[.!?])\s+', text.replace('\n', ' '))
     current_block = ""
 
-    for sentence in sentences:
-        # Check if adding the next sentence exceeds the limit
-        if len(current_block) + len(sentence) + 1 <= limit:
-            current_block += sentence + " "
+    def append(unit: str, separator: str):
+        nonlocal current_block
+        if not current_block:
+            current_block = unit
+        elif len(current_block) + len(separator) + len(unit) <= limit:
+            current_block += separator + unit
         else:
-            # If the current block is not empty, save it
-            if current_block:
-                blocks.append(current_block.strip())
-            # Start a new block with the current sentence
-            current_block = sentence + " "
+            blocks.append(current_block)
+            current_block = unit
+
+    for paragraph in PARAGRAPH_SEPARATOR_PATTERN.split(text):
+        paragraph = WHITESPACE_PATTERN.sub(" ", paragraph).strip()
+        if not paragraph:
+            continue
+
+        # Close a mostly full block at the paragraph boundary rather than mid-paragraph.
+        if current_block and len(current_block) + 2 + len(paragraph) > limit \
+                and len(current_block) >= PARAGRAPH_BREAK_FILL * limit:
+            blocks.append(current_block)
+            current_block = ""
+
+        separator = "\n\n"
+        # Split by sentence-ending punctuation, keeping the punctuation
+        for sentence in SENTENCE_SEPARATOR_PATTERN.split(paragraph):
+            for part in (_split_long_sentence(sentence, limit) if len(sentence) > limit else [sentence]):
+                append(part, separator)
+                separator = " "
 
     # Add the last remaining block if it exists
     if current_block:
-        blocks.append(current_block.strip())
+        blocks.append(current_block)
 
     return blocks
 
 
-def save_blocks_to_files(blocks: list[str], destination_folder: Path):
+def split_sections_into_blocks(sections: Iterable[TextSection], limit: int) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Splits a stream of text sections into blocks, like `split_text_into_blocks`, holding only a
+    few blocks' worth of text at a time.
+
+    Every chapter starts a new block, so its audio can be cut and indexed at the chapter start.
+
+    Args:
+        sections: The text of the document, in order (see app.ingestors).
+        limit: The maximum character limit for each block.
+
+    Yields:
+        (block text, chapter title) pairs. The title is set on the first block of each chapter.
+    """
+    buffered_text = []
+    buffered_length = 0
+    chapter = None
+
+    def split_buffer(final: bool):
+        nonlocal buffered_text, buffered_length, chapter
+        blocks = split_text_into_blocks("\n\n".join(buffered_text), limit)
+        # The last block may still grow with the next paragraphs, so it stays buffered.
+        kept = [] if final or not blocks else [blocks.pop()]
+        for block in blocks:
+            yield block, chapter
+            chapter = None
+        buffered_text, buffered_length = kept, sum(len(text) for text in kept)
+
+    for section in sections:
+        if section.chapter is not None:
+            yield from split_buffer(final=True)
+            chapter = section.chapter
+        buffered_text.append(section.text)
+        buffered_length += len(section.text) + 2
+        if buffered_length >= STREAM_BUFFER_BLOCKS * limit:
+            yield from split_buffer(final=False)
+    yield from split_buffer(final=True)
+
+
+def save_block_to_file(block: str, destination_folder: Path, index: int) -> Path:
+    """Saves one text block as 'block<index>.txt' and returns its path."""
+    file_path = destination_folder / f"block{index}.txt"
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(block)
+    return file_path
+
+
+def save_blocks_to_files(blocks: list[str], destination_folder: Path, start_index: int = 1) -> list[Path]:
     """
     Saves a list of text blocks into sequentially numbered .txt files.
 
     Args:
         blocks: The list of text blocks to save.
         destination_folder: The directory where files will be saved.
+        start_index: Number of the first block file, so blocks can be appended in several batches.
+
+    Returns:
+        The paths of the saved files, in order.
     """
     destination_folder.mkdir(parents=True, exist_ok=True)
-    for i, block in enumerate(blocks, start=1):
-        filename = f"block{i}.txt"
-        file_path = destination_folder / filename
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(block)
+    return [save_block_to_file(block, destination_folder, i) for i, block in enumerate(blocks, start=start_index)]
+
+
+def process_pdf_to_blocks(source_pdf_path: Path, output_dir: Path, clean_headers: bool = False,
+                          block_size: Optional[int] = None) -> Tuple[int, Optional[HeaderFooterReport]]:
+    """
+    Main execution process to find, process, and save text blocks.
 
+    Text, HTML and EPUB sources are read by their ingestor (see app.ingestors) and split as they
+    are read, so the whole document is never held in memory. Their chapters start new blocks
+    and are saved as the job's chapter map, which the audiobook index uses for its chapters.
 
-def process_pdf_to_blocks(source_pdf_path: Path, output_dir: Path) -> int:
-    """Main execution process to find, process, and save text blocks."""
+    Args:
+        source_pdf_path: The folder holding the source file (.pdf, .txt, .epub, .html, ...).
+        output_dir: Where the block files are saved.
+        clean_headers: Remove running headers, footers and page numbers from PDFs before splitting.
+        block_size: The block size in characters. By default it is planned here, which needs the
+            planner's statistics, so callers running this in another process should plan it first.
+
+    Returns:
+        A tuple with the number of blocks saved and the header/footer report (None if no cleaning ran).
+    """
+    report = None
     try:
         source_file_path = find_source_file(source_pdf_path)
         print(f"Source file found: {source_file_path}")
 
         # Handle file based on its type
         if source_file_path.suffix.lower() == ".pdf":
-            text_content = extract_text_from_pdf(source_file_path)
-        else:  # .txt file
-            with open(source_file_path, "r", encoding="utf-8") as f:
-                text_content = f.read()
+            pages = extract_pages_from_pdf(source_file_path)
+            if clean_headers:
+                pages, report = remove_repeated_headers_footers(pages)
+                print(f"Removed {report.lines_removed} header/footer line(s) from {report.pages} pages, "
+                      f"saving {report.characters_removed} TTS characters.")
+            sections = [TextSection("".join(page_text + "\n" for page_text in pages))]
+        else:
+            sections = get_ingestor(source_file_path)(source_file_path)
 
-        blocks = split_text_into_blocks(text_content, limit=CHARACTER_LIMIT)
-        save_blocks_to_files(blocks, output_dir)
-        num_blocks = len(blocks)
+        block_size = block_size or BlockSizePlanner.plan_block_size()
+        output_dir.mkdir(parents=True, exist_ok=True)
+        num_blocks = 0
+        chapters = {}
+        for num_blocks, (block, chapter) in enumerate(split_sections_into_blocks(sections, limit=block_size), start=1):
+            block_path = save_block_to_file(block, output_dir, num_blocks)
+            if chapter is not None:
+                chapters[block_path.stem] = chapter
+        write_chapter_map(output_dir, chapters)
 
-        print(f"{num_blocks} blocks successfully saved to '{output_dir}'")
-        return num_blocks
+        print(f"{num_blocks} blocks of up to {block_size} characters successfully saved to '{output_dir}'"
+              + (f" ({len(chapters)} chapters)" if chapters else ""))
+        return num_blocks, report
     except Exception as e:
-        print(f"An error occurred: {e}")
\ No newline at end of file
+        print(f"An error occurred: {e}")
+        return 0, report
\ No newline at end of file
@@ -0,0 +1,214 @@
+import copy
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fontTools import ttLib
+from fpdf import FPDF
+
+from app.api_manager import natural_sort_key
+
+FONT_PATH = Path(__file__).resolve().parent.parent / "assets/fonts/DejaVuSans.ttf"
+FONT_FAMILY = "DejaVu"
+
+BODY_FONT_SIZE = 12
+BODY_LINE_HEIGHT = 7
+HEADING_FONT_SIZE = 18
+HEADING_LINE_HEIGHT = 10
+PARAGRAPH_SPACING = 3
+
+# A line such as "Capítulo 3", "Capítulo 3: O Retorno" or "Chapter 12 - The End" starts a new chapter
+CHAPTER_HEADING_PATTERN = re.compile(r"^\s*(cap[ií]tulo|chapter)\s+[\w\-]+\b.*$", re.IGNORECASE | re.MULTILINE)
+PARAGRAPH_SEPARATOR_PATTERN = re.compile(r"\n\s*\n")
+
+
+class PDF(FPDF):
+    def header(self):
+        pass
+
+    def footer(self):
+        pass
+
+
+_font_template: Optional[PDF] = None
+_font_template_lock = threading.Lock()
+
+
+def load_font_template() -> PDF:
+    """
+    Returns an empty document with the DejaVu font added, parsed once per process (the
+    character widths and glyph ids of every code point are the expensive part, ~50 ms).
+    """
+    global _font_template
+    with _font_template_lock:
+        if _font_template is None:
+            template = PDF()
+            template.add_font(FONT_FAMILY, "", str(FONT_PATH))
+            _font_template = template
+        return _font_template
+
+
+def new_document() -> PDF:
+    """
+    Creates a document with the DejaVu font, as a deep copy of the cached template.
+
+    fpdf2 deep-copies the font metrics and subset map but shares two objects that writing a
+    document changes: the fontTools font, which is subset in place, and the font descriptor,
+    which gets the document's object number. Every document gets its own of both, so
+    documents rendered at the same time on different threads never touch each other's.
+    """
+    template = load_font_template()
+    with _font_template_lock:
+        pdf = copy.deepcopy(template)
+    for font in pdf.fonts.values():
+        font.ttfont = ttLib.TTFont(font.ttffile, recalcTimestamp=False, lazy=True)
+        font.desc = copy.deepcopy(font.desc)
+    return pdf
+
+
+def split_chapters(text: str) -> List[Tuple[Optional[str], str]]:
+    """
+    Splits story text into chapters using its "Capítulo N"/"Chapter N" heading lines.
+
+    Args:
+        text: The story text (one or more chapters).
+
+    Returns:
+        A list of (heading, body) tuples. Text before the first heading is returned with
+        a heading of None.
+    """
+    chapters = []
+    matches = list(CHAPTER_HEADING_PATTERN.finditer(text))
+    if not matches:
+        return [(None, text.strip())] if text.strip() else []
+
+    preamble = text[:matches[0].start()].strip()
+    if preamble:
+        chapters.append((None, preamble))
+
+    for i, match in enumerate(matches):
+        body_end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        chapters.append((match.group(0).strip(), text[match.end():body_end].strip()))
+    return chapters
+
+
+class StoryPdfRenderer:
+    """
+    Lays out a story chapter by chapter as the chapters become available.
+
+    Every chapter starts on a new page with its heading. Paragraphs are word-wrapped here,
+    with word widths cached, and written one line per cell: fpdf2's multi_cell re-measures
+    the whole line for every character, which dominates the rendering time of long stories.
+    Call `save` once all chapters were added.
+    """
+
+    def __init__(self, title: str):
+        self.pdf = new_document()
+        self.pdf.set_title(title)
+        self.chapter_count = 0
+        self._word_widths: Dict[Tuple[str, int], float] = {}
+
+    def _word_width(self, word: str, font_size: int) -> float:
+        key = (word, font_size)
+        width = self._word_widths.get(key)
+        if width is None:
+            width = self._word_widths[key] = self.pdf.get_string_width(word)
+        return width
+
+    def _wrap(self, paragraph: str, font_size: int) -> Iterator[str]:
+        """Greedily wraps a paragraph into lines that fit the page width."""
+        max_width = self.pdf.epw
+        space_width = self._word_width(" ", font_size)
+        line: List[str] = []
+        line_width = 0.0
+
+        for word in paragraph.split():
+            word_width = self._word_width(word, font_size)
+            while word_width > max_width:
+                # A single "word" wider than the page (e.g. a URL): hard-break it.
+                if line:
+                    yield " ".join(line)
+                    line, line_width = [], 0.0
+                cut = len(word) - 1
+                while cut > 1 and self.pdf.get_string_width(word[:cut]) > max_width:
+                    cut -= 1
+                yield word[:cut]
+                word = word[cut:]
+                word_width = self._word_width(word, font_size)
+
+            if line and line_width + space_width + word_width > max_width:
+                yield " ".join(line)
+                line, line_width = [], 0.0
+            line_width = line_width + space_width + word_width if line else word_width
+            line.append(word)
+
+        if line:
+            yield " ".join(line)
+
+    def _write_paragraph(self, paragraph: str, font_size: int, line_height: float):
+        self.pdf.set_font(FONT_FAMILY, size=font_size)
+        for line in self._wrap(paragraph, font_size):
+            self.pdf.cell(0, line_height, line, new_x="LMARGIN", new_y="NEXT")
+
+    def add_chapter(self, heading: Optional[str], body: str):
+        """Renders one chapter, starting on a new page."""
+        self.pdf.add_page()
+        self.chapter_count += 1
+
+        if heading:
+            self._write_paragraph(heading, HEADING_FONT_SIZE, HEADING_LINE_HEIGHT)
+            self.pdf.ln(HEADING_LINE_HEIGHT)
+
+        for paragraph in PARAGRAPH_SEPARATOR_PATTERN.split(body):
+            if paragraph.strip():
+                self._write_paragraph(paragraph, BODY_FONT_SIZE, BODY_LINE_HEIGHT)
+                self.pdf.ln(PARAGRAPH_SPACING)
+
+    def add_text(self, text: str):
+        """Renders a piece of story text, which may hold several chapters."""
+        for heading, body in split_chapters(text):
+            self.add_chapter(heading, body)
+
+    def save(self, output_path: Path):
+        if self.chapter_count == 0:
+            self.pdf.add_page()
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.pdf.output(str(output_path))
+        print(f"PDF saved to {output_path}")
+
+
+def render_story_pdf(title: str, chapters: Iterable[str], output_path: Path):
+    """
+    Renders a story PDF from an iterable of chapter texts.
+
+    Args:
+        title: The document title.
+        chapters: The chapter (or chapter batch) texts, in order.
+        output_path: Where the PDF is written.
+    """
+    renderer = StoryPdfRenderer(title)
+    for chapter_text in chapters:
+        renderer.add_text(chapter_text)
+    renderer.save(output_path)
+
+
+def save_chapter_artifact(chapter_dir: Path, index: int, text: str) -> Path:
+    """Saves one generated chapter batch as 'batch<index>.txt' so the PDF can be rendered from disk."""
+    chapter_dir.mkdir(parents=True, exist_ok=True)
+    chapter_path = chapter_dir / f"batch{index}.txt"
+    chapter_path.write_text(text, encoding="utf-8")
+    return chapter_path
+
+
+def render_pdf_from_chapter_files(title: str, chapter_dir: Path, output_path: Path):
+    """
+    Renders a story PDF from the chapter artifacts saved in `chapter_dir`.
+
+    The files are read one at a time, so the full story never has to be held in memory.
+    """
+    def read_chapters():
+        for chapter_file in sorted(chapter_dir.glob("*.txt"), key=lambda path: natural_sort_key(path.name)):
+            yield chapter_file.read_text(encoding="utf-8")
+
+    render_story_pdf(title, read_chapters(), output_path)
@@ -1,9 +1,31 @@
+import asyncio
+import math
+import shutil
 from pathlib import Path
-from typing import Callable
+from typing import TYPE_CHECKING, Callable, Dict, Any, List, Optional
 from app.job_manager import JobManager
-from app.gemini_audiobook_creator import generate_audio_from_blocks
-from app.wav_handler import concatenate_audio_blocks
-from app.pdf_handler import process_pdf_to_blocks
+from app.gemini_audiobook_creator import generate_audio_from_blocks, generate_audio_from_queue, TtsScheduler
+from app.config import get_settings
+from app.pdf_handler import process_pdf_to_blocks, split_text_into_blocks, save_blocks_to_files
+from app.block_planner import BlockSizePlanner
+from app.executors import run_cpu, run_io
+from app.checkpoint import (JobCheckpoint, STAGE_WRITING, STAGE_GENERATING, STAGE_CONCATENATING, STAGE_COMPLETE,
+                            STAGE_ERROR)
+from app.api_manager import ApiKeyManager, get_api_keys
+from app.audio_validation import BlockAudioValidator
+from app.storage import fetch_folder, get_storage, publish_folder
+from app.gemini_client import generate_story_with_memory
+from app.story_creator import build_story_prompts, clean_markdown, run_story_creation_pipeline
+
+if TYPE_CHECKING:
+    from app.wav_handler import ConcatenatedAudio, PostProcessingOptions
+
+
+def get_post_processing_options() -> Optional["PostProcessingOptions"]:
+    """Returns the audio post-processing settings, or None when AUDIO_POST_PROCESSING is off."""
+    from app.wav_handler import PostProcessingOptions  # numpy is only imported once a job needs it
+
+    return PostProcessingOptions() if get_settings().audio_post_processing else None
 
 
 def create_job_folders(base_data_dir: Path, job_id: str) -> tuple[Path, Path, Path, Path, Path]:
@@ -24,13 +46,29 @@ def create_job_folders(base_data_dir: Path, job_id: str) -> tuple[Path, Path, Pa
 
     return text_input_dir, audio_input_dir, audio_converted_dir, audio_output_blocks_dir, final_audio_dir
 
-def create_progress_updater(job_id: str, num_blocks: int) -> Callable:
+def clear_text_blocks(blocks_dir: Path):
+    """Deletes the text blocks left in a folder by an interrupted split."""
+    for stale_block in blocks_dir.glob("block*.txt"):
+        stale_block.unlink()
+
+
+def list_text_blocks(blocks_dir: Path) -> List[Path]:
+    return list(blocks_dir.glob("block*.txt"))
+
+
+def remove_job_folders(base_data_dir: Path, job_id: str):
+    """Deletes a job's folder with everything in it, and its files in the storage, e.g. once the job is cancelled."""
+    shutil.rmtree(base_data_dir / job_id, ignore_errors=True)
+    get_storage(base_data_dir).delete_prefix(job_id)
+
+def create_progress_updater(job_id: str, num_blocks: int, blocks_done: int = 0) -> Callable:
     """
     Calculates progress increments and creates a callback function for workers.
 
     Args:
         job_id: The ID of the job to update.
         num_blocks: The number of audio blocks to be processed.
+        blocks_done: Blocks that already have audio (when resuming).
 
     Returns:
         A tuple containing the increment value and the callback function.
@@ -41,49 +79,299 @@ def create_progress_updater(job_id: str, num_blocks: int) -> Callable:
         total_steps = num_blocks + 2
 
     increment_value = 100 / total_steps
+    JobManager.update_job_blocks(job_id, total=num_blocks, done=blocks_done)
 
-    def update_progress_callback():
-        """This function will be called by each worker after it finishes a block."""
+    def update_progress_callback(block_finished: bool = True):
+        """This function will be called by each worker after it finishes a block (and once per other step)."""
         JobManager.increment_job_progress(job_id, increment_value)
+        if block_finished:
+            JobManager.increment_blocks_done(job_id)
 
     return update_progress_callback
 
+async def concatenate_final_audio(audio_output_blocks_dir: Path, final_audio_dir: Path) -> "ConcatenatedAudio":
+    """Joins the block WAVs into the final audio in the process pool, post-processing them if enabled."""
+    from app.wav_handler import concatenate_audio_blocks
+
+    return await run_cpu(concatenate_audio_blocks, base_audio_folder=audio_output_blocks_dir,
+                         final_audio_dir=final_audio_dir, post_processing=get_post_processing_options())
+
+
+async def write_final_audio_index(final_audio: "ConcatenatedAudio", audio_converted_dir: Path):
+    """Writes the chapter manifest (and the segments, if AUDIO_SEGMENT_MODE asks for them) next to the final audio."""
+    from app.audio_index import write_audiobook_index
+
+    settings = get_settings()
+    await run_cpu(write_audiobook_index, final_audio, audio_converted_dir, mode=settings.audio_segment_mode,
+                  segment_seconds=settings.audio_segment_seconds)
+
+
+async def finish_audio_job(job_id: str, checkpoint: JobCheckpoint, ready_message: str):
+    """
+    Marks a job whose audio was concatenated as "complete", or as "partial" if blocks still
+    have no audio (they failed even after re-synthesis). Those blocks stay pending in the
+    checkpoint and are listed under `missing_blocks` in the report, so resuming the job fills them in.
+    """
+    missing_blocks = checkpoint.pending_blocks()
+    await run_io(checkpoint.set_stage, STAGE_ERROR if missing_blocks else STAGE_COMPLETE)
+    if not missing_blocks:
+        JobManager.update_job_status(job_id, "complete", ready_message, progress=100)
+        print(f"[{job_id}] Job completed successfully.")
+        return
+    JobManager.update_job_report(job_id, missing_blocks=missing_blocks)
+    JobManager.update_job_status(job_id, "partial",
+                                 f"The audio is incomplete: {len(missing_blocks)} of {len(checkpoint.blocks)} "
+                                 f"block(s) have no audio. Resume the job to fill them in.")
+    print(f"[{job_id}] Job finished with {len(missing_blocks)} block(s) missing: {', '.join(missing_blocks)}")
+
+
+def create_pause_notifier(job_id: str, running_message: str) -> Callable[[float], None]:
+    """
+    Creates the callback that shows a job as paused while every API key is cooling down.
+
+    Args:
+        job_id: The ID of the job to update.
+        running_message: The status message restored when the job continues.
+    """
+    def notify_pause(wait_seconds: float):
+        if wait_seconds > 0:
+            minutes = max(round(wait_seconds / 60), 1)
+            JobManager.update_job_status(job_id, "paused", f"All API keys are rate limited. "
+                                                           f"Continuing automatically in about {minutes} min.")
+        else:
+            JobManager.update_job_status(job_id, "processing", running_message)
+
+    return notify_pause
+
+def create_block_validator(job_id: str) -> Optional[BlockAudioValidator]:
+    """
+    Creates the validator of the job's block audio, which lists the blocks it sent back to TTS
+    under `audio_validation` in the job report. Returns None when AUDIO_VALIDATION is off.
+    """
+    if not get_settings().audio_validation:
+        return None
+    return BlockAudioValidator(report_callback=lambda report: JobManager.update_job_report(
+        job_id, audio_validation=report))
+
 async def run_conversion_pipeline(job_id: str, text_input_dir: Path, audio_input_dir: Path, audio_converted_dir: Path,
-                                  audio_output_blocks_dir: Path, final_audio_dir: Path):
+                                  audio_output_blocks_dir: Path, final_audio_dir: Path,
+                                  scheduler: Optional[TtsScheduler] = None):
+    """
+    Converts the uploaded PDF (or text) into an audiobook.
+
+    Progress is checkpointed in the job folder, block by block. If the job already has a
+    checkpoint (it was interrupted), the existing audio is verified and only the blocks that
+    are missing or invalid are generated again.
+
+    `scheduler` lets several jobs share one API key pool and rate limit (see app.bulk_convert).
+    """
+    job_dir = text_input_dir.parent
+    checkpoint = await run_io(JobCheckpoint.load, job_dir)
     try:
-        # --- Step 1: Process PDF to text blocks ---
-        JobManager.update_job_status(job_id, "processing", "Step 1/3: Splitting PDF into text blocks...")
-        print(f"[{job_id}] Starting Step 1: PDF Processing")
-        num_blocks = process_pdf_to_blocks(source_pdf_path=text_input_dir, output_dir=audio_input_dir)
-        if num_blocks == 0:
-            raise ValueError("No text blocks were generated from the source file.")
+        if checkpoint is not None and checkpoint.blocks:
+            # --- Resume: Step 1 is already done, verify the audio made so far ---
+            JobManager.update_job_status(job_id, "processing", "Resuming: verifying the audio generated so far...")
+            pending_blocks = await run_io(checkpoint.verify_blocks, audio_input_dir, audio_converted_dir,
+                                          audio_output_blocks_dir)
+            num_blocks = len(checkpoint.blocks)
+            print(f"[{job_id}] Resuming job: {num_blocks - pending_blocks} of {num_blocks} blocks already have audio.")
+            await run_io(checkpoint.set_stage, STAGE_GENERATING)
+            JobManager.update_job_status(job_id, "processing", "Resuming...",
+                                         progress=int(100 * (num_blocks - pending_blocks + 1) / (num_blocks + 2)))
+            progress_callback = create_progress_updater(job_id, num_blocks, blocks_done=num_blocks - pending_blocks)
+        else:
+            # --- Step 1: Process PDF to text blocks ---
+            checkpoint = await run_io(JobCheckpoint.create, job_dir, job_type="conversion")
+            JobManager.update_job_status(job_id, "processing", "Step 1/3: Splitting PDF into text blocks...")
+            await run_io(fetch_folder, job_dir.parent, text_input_dir)  # the upload may have reached another node
+            print(f"[{job_id}] Starting Step 1: PDF Processing")
+            await run_io(clear_text_blocks, audio_input_dir)
+            num_blocks, cleanup_report = await run_cpu(
+                process_pdf_to_blocks, source_pdf_path=text_input_dir, output_dir=audio_input_dir,
+                clean_headers=get_settings().pdf_header_footer_cleanup, block_size=BlockSizePlanner.plan_block_size())
+            if cleanup_report is not None:
+                JobManager.update_job_report(job_id, header_footer_cleanup=cleanup_report.to_dict())
+            if num_blocks == 0:
+                raise ValueError("No text blocks were generated from the source file.")
+            await run_io(checkpoint.record_blocks, await run_io(list_text_blocks, audio_input_dir))
 
-        progress_callback = create_progress_updater(job_id, num_blocks)
+            progress_callback = create_progress_updater(job_id, num_blocks)
 
-        progress_callback()
+            progress_callback(block_finished=False)
 
-        print(f"[{job_id}] Finished Step 1: Created {num_blocks} text blocks.")
+            print(f"[{job_id}] Finished Step 1: Created {num_blocks} text blocks.")
 
         # --- Step 2: Generate audio from text blocks ---
-        JobManager.update_job_status(job_id, "processing", "Step 2/3: Generating audio..."
-                                                           " (This may take a while)")
+        generating_message = "Step 2/3: Generating audio... (This may take a while)"
+        JobManager.update_job_status(job_id, "processing", generating_message)
         print(f"[{job_id}] Starting Step 2: Audio Generation")
-        await generate_audio_from_blocks(text_input_dir=audio_input_dir,
-                                         audio_output_blocks_dir=audio_output_blocks_dir,
-                                         audio_converted_dir=audio_converted_dir,
-                                         progress_callback=progress_callback)
+        request_summary = await generate_audio_from_blocks(
+            text_input_dir=audio_input_dir, audio_output_blocks_dir=audio_output_blocks_dir,
+            audio_converted_dir=audio_converted_dir, progress_callback=progress_callback,
+            block_callback=checkpoint.mark_block_done,
+            pause_callback=create_pause_notifier(job_id, generating_message), scheduler=scheduler,
+            validator=create_block_validator(job_id))
+        if request_summary is not None:
+            JobManager.update_job_report(job_id, tts_requests=request_summary)
         print(f"[{job_id}] Finished Step 2: Audio files generated.")
 
         # --- Step 3: Concatenate audio blocks ---
+        await run_io(checkpoint.set_stage, STAGE_CONCATENATING)
         JobManager.update_job_status(job_id, "processing", "Step 3/3: Combining audio files...")
         print(f"[{job_id}] Starting Step 3: Concatenation")
-        concatenate_audio_blocks(base_audio_folder=audio_output_blocks_dir, final_audio_dir=final_audio_dir)
+        final_audio = await concatenate_final_audio(audio_output_blocks_dir, final_audio_dir)
+        await write_final_audio_index(final_audio, audio_converted_dir)
+        await run_io(publish_folder, job_dir.parent, final_audio_dir)
         print(f"[{job_id}] Finished Step 3: Final audiobook created.")
 
         # --- Final Step: Mark as complete ---
-        JobManager.update_job_status(job_id, "complete", "Your audiobook is ready for download!")
-        print(f"[{job_id}] Job completed successfully.")
+        await finish_audio_job(job_id, checkpoint, "Your audiobook is ready for download!")
 
     except Exception as e:
         print(f"[{job_id}] An error occurred in the pipeline: {e}")
-        JobManager.update_job_status(job_id, "error", f"An error occurred: {e}")
\ No newline at end of file
+        if checkpoint is not None:
+            await run_io(checkpoint.set_stage, STAGE_ERROR)
+        JobManager.update_job_status(job_id, "error", f"An error occurred: {e}")
+
+
+async def resume_conversion_job(job_id: str, base_data_dir: Path):
+    """Resumes an interrupted conversion job from its checkpoint."""
+    (text_input_dir, audio_input_dir, audio_converted_dir, audio_output_blocks_dir,
+     final_audio_dir) = await run_io(create_job_folders, base_data_dir=base_data_dir, job_id=job_id)
+    await run_conversion_pipeline(job_id, text_input_dir, audio_input_dir, audio_converted_dir,
+                                  audio_output_blocks_dir, final_audio_dir)
+
+async def run_story_audiobook_pipeline(job_id: str, base_data_dir: Path,
+                                       story_params: Optional[Dict[str, Any]] = None):
+    """
+    Generates an original story and narrates it in a single job.
+
+    Each chapter batch is split into text blocks and queued for TTS as soon as the model
+    returns it, so audio for the first chapters is produced while later chapters are still
+    being written. The story PDF is only rendered when `include_pdf` is set.
+
+    The story and the audio blocks are checkpointed as they are made. If the job already has a
+    story checkpoint, `story_params` may be omitted: the audio made so far is verified, the
+    blocks still missing audio are queued again and the story continues after the last
+    chapter batch written.
+    """
+    job_dir = base_data_dir / job_id
+    checkpoint = await run_io(JobCheckpoint.load, job_dir)
+
+    try:
+        JobManager.update_job_status(job_id, "processing", "Step 1/3: Initializing and preparing prompts...",
+                                     progress=0)
+
+        (text_input_dir, audio_input_dir, audio_converted_dir, audio_output_blocks_dir,
+         final_audio_dir) = await run_io(create_job_folders, base_data_dir=base_data_dir, job_id=job_id)
+
+        file_queue = asyncio.Queue()
+        if checkpoint is not None and checkpoint.story is not None:
+            story = checkpoint.story
+            story_params, initial_prompt, chapter_prompts = (story["params"], story["initial_prompt"],
+                                                             story["chapter_prompts"])
+            JobManager.update_job_status(job_id, "processing", "Resuming: verifying the audio generated so far...")
+            pending_blocks = await run_io(checkpoint.verify_blocks, audio_input_dir, audio_converted_dir,
+                                          audio_output_blocks_dir)
+            for name in checkpoint.pending_blocks():
+                await file_queue.put(audio_input_dir / f"{name}.txt")
+            await run_io(checkpoint.set_stage, STAGE_WRITING)
+            print(f"[{job_id}] Resuming story audiobook: {len(story['chapters'])} of {len(chapter_prompts)} "
+                  f"chapter batch(es) written, {pending_blocks} block(s) still need audio.")
+        else:
+            if story_params is None:
+                raise ValueError("The job has no story checkpoint to resume from.")
+            initial_prompt, chapter_prompts = build_story_prompts(story_params)
+            checkpoint = await run_io(JobCheckpoint.create, job_dir, job_type="story-audiobook")
+            await run_io(checkpoint.start_story, story_params, initial_prompt, chapter_prompts)
+        story_name = story_params.get("name")
+        blocks_done = len(checkpoint.blocks) - len(checkpoint.pending_blocks())
+
+        # The number of blocks is only known once the story is written, so estimate it from the request.
+        block_size = BlockSizePlanner.plan_block_size()
+        estimated_blocks = math.ceil(story_params.get("chapters") * story_params.get("chars_per_chapter")
+                                     / block_size)
+        progress_callback = create_progress_updater(job_id, estimated_blocks + len(chapter_prompts) + 1,
+                                                    blocks_done=blocks_done)
+        JobManager.update_job_blocks(job_id, total=max(estimated_blocks, len(checkpoint.blocks)), done=blocks_done)
+
+        # --- Steps 1 and 2 run together: writing feeds the TTS queue ---
+        writing_message = "Step 2/3: Writing and narrating the story... (This may take a while)"
+        api_keys = get_api_keys()
+        key_manager = ApiKeyManager(api_keys, pause_callback=create_pause_notifier(job_id, writing_message))
+        api_key, key_idx = await key_manager.wait_for_key()
+
+        from app.pdf_renderer import StoryPdfRenderer, save_chapter_artifact
+
+        renderer = await run_io(StoryPdfRenderer, story_name) if story_params.get("include_pdf") else None
+        if renderer is not None:
+            for chapter_text in checkpoint.story["chapters"][:checkpoint.story["chapters_split"]]:
+                await run_io(renderer.add_text, clean_markdown(chapter_text))
+        chapter_dir = job_dir / "story-chapters"
+        next_block_index = len(checkpoint.blocks) + 1
+
+        async def queue_chapter_blocks(batch_index: int, chapter_text: str):
+            nonlocal next_block_index
+            cleaned_text = clean_markdown(chapter_text)
+            await run_io(save_chapter_artifact, chapter_dir, batch_index, cleaned_text)
+            if renderer is not None:
+                await run_io(renderer.add_text, cleaned_text)
+            blocks = await run_cpu(split_text_into_blocks, cleaned_text, limit=block_size)
+            block_paths = await run_io(save_blocks_to_files, blocks, audio_input_dir, start_index=next_block_index)
+            await run_io(checkpoint.record_blocks, block_paths, stage=STAGE_WRITING, story_chapter=batch_index)
+            next_block_index += len(block_paths)
+            JobManager.update_job_blocks(job_id, total=max(estimated_blocks, next_block_index - 1))
+            for block_path in block_paths:
+                await file_queue.put(block_path)
+            print(f"[{job_id}] Chapter batch {batch_index}: queued {len(block_paths)} block(s) for TTS.")
+
+        # A chapter batch written just before the job stopped may not have been split into blocks yet.
+        written_chapters = checkpoint.story["chapters"]
+        for batch_index in range(checkpoint.story["chapters_split"] + 1, len(written_chapters) + 1):
+            await queue_chapter_blocks(batch_index, written_chapters[batch_index - 1])
+
+        JobManager.update_job_status(job_id, "processing", writing_message)
+        story_writer = generate_story_with_memory(api_key, initial_prompt, chapter_prompts,
+                                                  lambda: progress_callback(block_finished=False),
+                                                  chapter_callback=queue_chapter_blocks, key_manager=key_manager,
+                                                  checkpoint=checkpoint)
+        request_summary = await generate_audio_from_queue(
+            file_queue, audio_output_blocks_dir=audio_output_blocks_dir, audio_converted_dir=audio_converted_dir,
+            progress_callback=progress_callback, block_callback=checkpoint.mark_block_done, producer=story_writer,
+            pause_callback=create_pause_notifier(job_id, writing_message), validator=create_block_validator(job_id))
+        if request_summary is not None:
+            JobManager.update_job_report(job_id, tts_requests=request_summary)
+
+        if next_block_index == 1:
+            raise ValueError("No text blocks were generated from the story.")
+
+        # --- Step 3: Concatenate audio blocks (and optionally render the PDF) ---
+        await run_io(checkpoint.set_stage, STAGE_CONCATENATING)
+        JobManager.update_job_status(job_id, "processing", "Step 3/3: Combining audio files...")
+        final_audio = await concatenate_final_audio(audio_output_blocks_dir, final_audio_dir)
+        await write_final_audio_index(final_audio, audio_converted_dir)
+        await run_io(publish_folder, base_data_dir, final_audio_dir)
+
+        if renderer is not None:
+            await run_io(renderer.save, job_dir / "final-story" / f"{story_name.replace(' ', '_')}.pdf")
+            await run_io(publish_folder, base_data_dir, job_dir / "final-story")
+
+        await finish_audio_job(job_id, checkpoint, "Your narrated story is ready for download!")
+
+    except Exception as e:
+        print(f"[{job_id}] An error occurred in the story audiobook pipeline: {e}")
+        if checkpoint is not None and checkpoint.story is not None:
+            await run_io(checkpoint.set_stage, STAGE_ERROR)
+        JobManager.update_job_status(job_id, "error", f"An error occurred: {e}")
+
+
+async def resume_checkpointed_job(job_id: str, base_data_dir: Path):
+    """Resumes an interrupted or failed job from its checkpoint, with the pipeline of its job type."""
+    checkpoint = await run_io(JobCheckpoint.load, base_data_dir / job_id)
+    job_type = checkpoint.job_type if checkpoint is not None else "conversion"
+    if job_type == "story":
+        await run_story_creation_pipeline(job_id, base_data_dir)
+    elif job_type == "story-audiobook":
+        await run_story_audiobook_pipeline(job_id, base_data_dir)
+    else:
+        await resume_conversion_job(job_id, base_data_dir)
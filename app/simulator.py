@@ -0,0 +1,354 @@
+"""
+Quota and throughput simulator for capacity planning, and the model behind the job ETA.
+
+It runs the real TTS scheduling (`generate_audio_from_queue` with its workers, `RateLimiter`
+and `ApiKeyManager`) against modeled requests: each request takes a random latency and may
+be rejected with a 429, either by a per-key quota or at a given rate. The event loop runs on
+a virtual clock that jumps straight to the next timer, so hours of simulated work take
+seconds.
+
+Usage:
+    python -m app.simulator --pages 900 --keys 3 --key-rpm 5 [--key-rpd 100] [--latency 60]
+        [--concurrency 5] [--request-limit 30] [--request-window 60] [--runs 5]
+"""
+import argparse
+import asyncio
+import io
+import math
+import random
+import selectors
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from app.api_manager import ApiKeyManager, get_api_keys
+from app.block_planner import BlockSizePlanner
+from app.config import ConfigError, get_settings
+from app.gemini_audiobook_creator import RateLimiter, TtsObservations, TtsScheduler, generate_audio_from_queue
+
+SECONDS_PER_DAY = 24 * 60 * 60
+CHARACTERS_PER_PAGE = 2000
+QUOTA_ERROR_LATENCY_SECONDS = 0.5  # a rejected request fails fast
+DEFAULT_LATENCY_SECONDS = 60.0  # assumed TTS latency until real requests have been measured
+DEFAULT_LATENCY_SPREAD = 0.3  # sigma of the log-normal latency
+ETA_CACHE_SECONDS = 15  # a job's ETA is simulated again at most this often
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    """A selector that never blocks: instead of waiting for the next timer, it moves the clock to it."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._keys: Dict[int, selectors.SelectorKey] = {}
+
+    @staticmethod
+    def _fd(fileobj) -> int:
+        return fileobj if isinstance(fileobj, int) else fileobj.fileno()
+
+    def register(self, fileobj, events, data=None):
+        key = selectors.SelectorKey(fileobj, self._fd(fileobj), events, data)
+        self._keys[key.fd] = key
+        return key
+
+    def unregister(self, fileobj):
+        return self._keys.pop(self._fd(fileobj))
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("The simulation is stuck: every task is waiting and no timer is pending.")
+        self.now += timeout
+        return []
+
+    def get_map(self):
+        return self._keys
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """An event loop whose time only advances when every task is waiting on a timer."""
+
+    def __init__(self):
+        self._virtual_selector = _VirtualSelector()
+        super().__init__(self._virtual_selector)
+
+    def time(self) -> float:
+        return self._virtual_selector.now
+
+
+class _ThreadMutedStdout(io.TextIOBase):
+    """Forwards to the real stdout, except for the threads that are running a simulation."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.muted = threading.local()
+
+    def write(self, text: str) -> int:
+        if getattr(self.muted, "enabled", False):
+            return len(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+_stdout_lock = threading.Lock()
+
+
+@contextmanager
+def _muted_output():
+    """Silences the pipeline's progress prints for the current thread only (the server keeps logging)."""
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ThreadMutedStdout):
+            sys.stdout = _ThreadMutedStdout(sys.stdout)
+        stdout = sys.stdout
+    stdout.muted.enabled = True
+    try:
+        yield
+    finally:
+        stdout.muted.enabled = False
+
+
+@dataclass(frozen=True)
+class SimulationParams:
+    blocks: int
+    keys: int = 1
+    key_requests_per_minute: Optional[int] = None  # the API's per-key quota (None: unlimited)
+    key_requests_per_day: Optional[int] = None
+    concurrency: int = 5  # MAX_CONCURRENT_REQUESTS
+    request_limit: int = 30  # API_REQUEST_LIMIT
+    request_window_seconds: int = 60  # API_REQUEST_WINDOW_SECONDS
+    latency_seconds: float = DEFAULT_LATENCY_SECONDS  # mean time of a successful TTS request
+    latency_spread: float = DEFAULT_LATENCY_SPREAD
+    quota_error_rate: float = 0.0  # share of requests rejected with a 429 that has no retry hint
+    seed: int = 0
+
+    @classmethod
+    def from_settings(cls, blocks: int, **overrides) -> "SimulationParams":
+        """The parameters of this server: its keys, concurrency and client-side rate limit."""
+        settings = get_settings()
+        keys = len([key for key in get_api_keys() if key]) or 1
+        return cls(blocks=blocks, keys=keys, concurrency=settings.max_concurrent_requests,
+                   request_limit=settings.api_request_limit,
+                   request_window_seconds=settings.api_request_window_seconds, **overrides)
+
+
+@dataclass
+class SimulationResult:
+    simulated_seconds: float
+    blocks_done: int
+    requests: int
+    quota_errors: int
+    wall_seconds: float
+
+    @property
+    def blocks_per_minute(self) -> float:
+        return self.blocks_done / self.simulated_seconds * 60 if self.simulated_seconds else 0.0
+
+
+class _ModeledApi:
+    """Stands in for the TTS API: modeled latency, per-key minute/day quotas and random 429s."""
+
+    def __init__(self, params: SimulationParams, clock: Callable[[], float]):
+        self.params = params
+        self.clock = clock
+        self.rng = random.Random(params.seed)
+        self.minute_requests: Dict[str, Deque[float]] = {}
+        self.day_requests: Dict[str, int] = {}
+        self.day = 0
+        self.requests = 0
+        self.quota_errors = 0
+        sigma = params.latency_spread
+        self.latency_mu = math.log(max(params.latency_seconds, 0.001)) - sigma * sigma / 2  # keeps the mean
+
+    def _quota_error(self, api_key: str) -> Optional[str]:
+        now, params = self.clock(), self.params
+        if int(now // SECONDS_PER_DAY) != self.day:
+            self.day, self.day_requests = int(now // SECONDS_PER_DAY), {}
+        recent = self.minute_requests.setdefault(api_key, deque())
+        while recent and recent[0] <= now - 60:
+            recent.popleft()
+
+        if params.key_requests_per_day and self.day_requests.get(api_key, 0) >= params.key_requests_per_day:
+            return "429 RESOURCE_EXHAUSTED: Quota exceeded for metric generate_requests_per_model_per_day."
+        if params.key_requests_per_minute and len(recent) >= params.key_requests_per_minute:
+            return (f"429 RESOURCE_EXHAUSTED: Quota exceeded for metric generate_requests_per_model_per_minute. "
+                    f"Please retry in {recent[0] + 60 - now:.1f}s.")
+        if params.quota_error_rate and self.rng.random() < params.quota_error_rate:
+            return "429 RESOURCE_EXHAUSTED: Resource has been exhausted (e.g. check quota)."
+        recent.append(now)
+        self.day_requests[api_key] = self.day_requests.get(api_key, 0) + 1
+        return None
+
+    async def attempt(self, txt_file_path: Path, output_audio_path: Path, audio_converted_dir: Path, api_key: str,
+                      rate_limiter: RateLimiter, progress_callback: callable, block_callback=None, hedger=None,
+                      validator=None):
+        """A modeled `process_file_attempt` (without deadlines, hedging or audio validation)."""
+        await rate_limiter.wait_for_slot()
+        self.requests += 1
+        error = self._quota_error(api_key)
+        if error is not None:
+            self.quota_errors += 1
+            await asyncio.sleep(QUOTA_ERROR_LATENCY_SECONDS)
+            raise RuntimeError(error)
+        await asyncio.sleep(self.rng.lognormvariate(self.latency_mu, self.params.latency_spread))
+        progress_callback()
+
+
+async def _run_simulation(params: SimulationParams) -> Tuple[float, int, _ModeledApi]:
+    loop = asyncio.get_running_loop()
+    api = _ModeledApi(params, loop.time)
+    key_manager = ApiKeyManager([f"simulated-key-{index + 1:04d}" for index in range(params.keys)], clock=loop.time,
+                                daily_reset=lambda: SECONDS_PER_DAY - loop.time() % SECONDS_PER_DAY)
+    scheduler = TtsScheduler(key_manager, asyncio.Semaphore(params.concurrency),
+                             RateLimiter(params.request_limit, params.request_window_seconds, clock=loop.time),
+                             params.concurrency)
+    file_queue = asyncio.Queue()
+    for index in range(params.blocks):
+        file_queue.put_nowait(Path(f"block{index + 1}.txt"))
+
+    blocks_done = 0
+
+    def count_block():
+        nonlocal blocks_done
+        blocks_done += 1
+
+    await generate_audio_from_queue(file_queue, Path("."), Path("."), count_block, scheduler=scheduler,
+                                    attempt=api.attempt)
+    return loop.time(), blocks_done, api
+
+
+def simulate(params: SimulationParams) -> SimulationResult:
+    """
+    Simulates narrating `params.blocks` blocks and returns how long it would take.
+
+    Runs in a fresh event loop on a virtual clock, so it can be called from any thread that
+    is not already running an event loop (e.g. via `asyncio.to_thread`).
+    """
+    started = time.perf_counter()
+    loop = VirtualClockEventLoop()
+    try:
+        with _muted_output():
+            simulated_seconds, blocks_done, api = loop.run_until_complete(_run_simulation(params))
+    finally:
+        loop.close()
+    return SimulationResult(simulated_seconds, blocks_done, api.requests, api.quota_errors,
+                            time.perf_counter() - started)
+
+
+class EtaEstimator:
+    """
+    Estimates how long a running job still needs by simulating its remaining blocks with this
+    server's settings and the latency and 429 rate measured on the real requests so far.
+    """
+
+    _cache: Dict[str, Tuple[float, int, float]] = {}  # job id -> (computed at, remaining blocks, ETA)
+    _lock = threading.Lock()
+
+    @classmethod
+    def model_params(cls, remaining_blocks: int) -> SimulationParams:
+        latencies, quota_error_rate = TtsObservations.snapshot()
+        overrides = {"quota_error_rate": quota_error_rate}
+        if latencies:
+            overrides["latency_seconds"] = statistics.fmean(latencies)
+        if len(latencies) >= 2:
+            overrides["latency_spread"] = statistics.pstdev(math.log(max(seconds, 0.001)) for seconds in latencies)
+        return SimulationParams.from_settings(remaining_blocks, **overrides)
+
+    @classmethod
+    def eta_seconds(cls, job_id: str, remaining_blocks: int) -> Optional[float]:
+        """Returns the job's ETA in seconds (None if it cannot be estimated)."""
+        if remaining_blocks <= 0:
+            return 0.0
+        now = time.monotonic()
+        with cls._lock:
+            cached = cls._cache.get(job_id)
+        if cached is not None and cached[1] == remaining_blocks and now - cached[0] < ETA_CACHE_SECONDS:
+            return round(max(cached[2] - (now - cached[0]), 0.0))
+        try:
+            eta = simulate(cls.model_params(remaining_blocks)).simulated_seconds
+        except (ConfigError, RuntimeError) as e:
+            print(f"Could not estimate the ETA of job {job_id}: {e}")
+            return None
+        with cls._lock:
+            cls._cache[job_id] = (now, remaining_blocks, eta)
+        return round(eta)
+
+    @classmethod
+    def forget(cls, job_id: str):
+        with cls._lock:
+            cls._cache.pop(job_id, None)
+
+
+def format_duration(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes >= 24 * 60:
+        return f"{minutes // (24 * 60)}d{minutes // 60 % 24:02d}h{minutes % 60:02d}m"
+    return f"{minutes // 60}h{minutes % 60:02d}m" if minutes >= 60 else f"{minutes}m{int(seconds % 60):02d}s"
+
+
+def _default_settings() -> Dict[str, int]:
+    try:
+        settings = get_settings()
+    except ConfigError:
+        return {"concurrency": 5, "request_limit": 30, "request_window": 60}
+    return {"concurrency": settings.max_concurrent_requests, "request_limit": settings.api_request_limit,
+            "request_window": settings.api_request_window_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate how long an audiobook takes under the API quotas.")
+    size = parser.add_mutually_exclusive_group(required=True)
+    size.add_argument("--pages", type=int, help=f"Book length in pages (about {CHARACTERS_PER_PAGE} characters each).")
+    size.add_argument("--blocks", type=int, help="Book length in TTS blocks.")
+    parser.add_argument("--block-characters", type=int, default=BlockSizePlanner.model_block_limit(),
+                        help="Characters per block (default: the planned size).")
+    parser.add_argument("--keys", type=int, default=1, help="Number of API keys.")
+    parser.add_argument("--key-rpm", type=int, help="Requests per minute the API allows per key.")
+    parser.add_argument("--key-rpd", type=int, help="Requests per day the API allows per key.")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY_SECONDS,
+                        help="Mean seconds per TTS request.")
+    parser.add_argument("--latency-spread", type=float, default=DEFAULT_LATENCY_SPREAD,
+                        help="Sigma of the log-normal latency.")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0,
+                        help="Share of requests rejected with a 429 that has no retry hint.")
+    parser.set_defaults(**_default_settings())
+    parser.add_argument("--concurrency", type=int, help="MAX_CONCURRENT_REQUESTS (default: from the environment).")
+    parser.add_argument("--request-limit", type=int, help="API_REQUEST_LIMIT (default: from the environment).")
+    parser.add_argument("--request-window", type=int, help="API_REQUEST_WINDOW_SECONDS (default: from the environment).")
+    parser.add_argument("--runs", type=int, default=1, help="Runs with different random seeds.")
+    args = parser.parse_args()
+
+    blocks = args.blocks or math.ceil(args.pages * CHARACTERS_PER_PAGE / args.block_characters)
+    params = SimulationParams(blocks=blocks, keys=args.keys, key_requests_per_minute=args.key_rpm,
+                              key_requests_per_day=args.key_rpd, concurrency=args.concurrency,
+                              request_limit=args.request_limit, request_window_seconds=args.request_window,
+                              latency_seconds=args.latency, latency_spread=args.latency_spread,
+                              quota_error_rate=args.quota_error_rate)
+    print(f"{blocks} block(s) of up to {args.block_characters} characters, {args.keys} key(s)"
+          f"{f' at {args.key_rpm} RPM' if args.key_rpm else ''}{f' / {args.key_rpd} RPD' if args.key_rpd else ''}, "
+          f"{args.concurrency} concurrent, client limit {args.request_limit}/{args.request_window}s, "
+          f"~{args.latency:.0f}s per request")
+
+    results: List[SimulationResult] = []
+    for run in range(max(args.runs, 1)):
+        result = simulate(replace(params, seed=run))
+        results.append(result)
+        print(f"run {run + 1}: {format_duration(result.simulated_seconds)}  {result.blocks_per_minute:6.2f} blocks/min  "
+              f"{result.requests} request(s), {result.quota_errors} quota error(s)  "
+              f"(simulated in {result.wall_seconds:.2f}s)")
+    if len(results) > 1:
+        durations = sorted(result.simulated_seconds for result in results)
+        print(f"median {format_duration(statistics.median(durations))}, "
+              f"worst {format_duration(durations[-1])} over {len(results)} runs")
+
+
+if __name__ == "__main__":
+    main()
@@ -73,6 +73,13 @@ document.addEventListener('DOMContentLoaded', () => {
             chapters: parseInt(document.getElementById('story-chapters').value, 10),
             chars_per_chapter: parseInt(document.getElementById('story-chars').value, 10)
         };
+
+        // Narrated stories run as a single job: chapters go straight to TTS, the PDF is kept as an extra.
+        if (document.getElementById('story-narrate').checked) {
+            storyData.include_pdf = true;
+            startJob('/create-story-audiobook-job', JSON.stringify(storyData), 'story');
+            return;
+        }
         
         startJob('/create-story-job', JSON.stringify(storyData), 'story');
     });
@@ -125,18 +132,20 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error('Could not fetch status.');
             }
             const data = await response.json();
-            if (data.status === 'processing' && data.progress !== undefined && data.progress >= 0) {
+            if ((data.status === 'processing' || data.status === 'paused') && data.progress !== undefined && data.progress >= 0) {
                 progressBarContainer.style.display = 'block';
                 const progressInt = Math.floor(data.progress);
                 progressBar.style.width = `${progressInt}%`;
-                progressText.textContent = `${progressInt}%`;
+                progressText.textContent = data.eta_seconds > 0
+                    ? `${progressInt}% (about ${Math.ceil(data.eta_seconds / 60)} min left)`
+                    : `${progressInt}%`;
             } else {
                 progressBarContainer.style.display = 'none';
             }
 
             statusText.textContent = data.message;
 
-            if (data.status === 'complete') {
+            if (data.status === 'complete' || data.status === 'partial') {
                 progressBar.style.width = '100%';
                 progressText.textContent = '100%';
                 clearInterval(pollingInterval);
@@ -147,10 +156,10 @@ document.addEventListener('DOMContentLoaded', () => {
             }
             statusText.textContent = data.message;
 
-            if (data.status === 'complete') {
+            if (data.status === 'complete' || data.status === 'partial') {
                 clearInterval(pollingInterval);
                 showSuccess(jobId, data.message);
-            } else if (data.status === 'error') {
+            } else if (data.status === 'error' || data.status === 'cancelled') {
                 clearInterval(pollingInterval);
                 showError(data.message);
             }
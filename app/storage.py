@@ -0,0 +1,410 @@
+import os
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+from app.config import get_settings
+
+# --- S3 ---
+MULTIPART_THRESHOLD_BYTES = 16 * 1024 * 1024  # larger files (final WAVs) are uploaded in parts
+MULTIPART_PART_BYTES = 8 * 1024 * 1024  # S3 needs at least 5 MB per part, except the last one
+DELETE_BATCH_KEYS = 1000  # the most keys one DeleteObjects request takes
+COPY_CHUNK_BYTES = 1024 * 1024
+MISSING_OBJECT_CODES = ("404", "NoSuchKey", "NotFound")
+
+# --- Cache ---
+CACHE_KEY_LOCK_STRIPES = 64  # concurrent downloads of different objects rarely share a lock
+
+
+def validate_key(key: str) -> str:
+    """
+    Checks that a storage key is a relative path that stays inside the storage ('job/a/b.wav').
+
+    Raises:
+        ValueError: If the key is absolute, empty or climbs out with '..'.
+    """
+    parts = PurePosixPath(key).parts
+    if not parts or key.startswith("/") or ".." in parts or "\\" in key:
+        raise ValueError(f"Invalid storage key: {key!r}")
+    return key
+
+
+def _write_atomically(path: Path, chunks: Iterable[bytes]):
+    """Streams chunks into a temporary file next to `path` and renames it into place."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False) as tmp:
+        try:
+            for chunk in chunks:
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    os.replace(tmp.name, path)
+
+
+def _read_chunks(stream: BinaryIO) -> Iterable[bytes]:
+    for chunk in iter(lambda: stream.read(COPY_CHUNK_BYTES), b""):
+        yield chunk
+
+
+class Storage(ABC):
+    """
+    Where job artifacts live, addressed by keys relative to the data folder
+    ('<job_id>/audio-output/final-audio/final_audio.wav').
+
+    Jobs still work in their local job folder; their inputs and final artifacts go through the
+    storage, so any node can serve or resume a job. Every method blocks, so call them from
+    worker threads (`run_io`).
+    """
+
+    @abstractmethod
+    def open_read(self, key: str) -> BinaryIO:
+        """Opens an object for streaming reads. Raises FileNotFoundError if it does not exist."""
+
+    @abstractmethod
+    def write_stream(self, key: str, chunks: Iterable[bytes]):
+        """Writes an object from a stream of chunks, never holding all of it in memory."""
+
+    def upload_file(self, key: str, local_path: Path):
+        with open(local_path, "rb") as f:
+            self.write_stream(key, _read_chunks(f))
+
+    def download_file(self, key: str, local_path: Path):
+        """Copies an object to a local file. Raises FileNotFoundError if it does not exist."""
+        with closing(self.open_read(key)) as stream:
+            _write_atomically(local_path, _read_chunks(stream))
+
+    def iter_chunks(self, key: str) -> Iterator[bytes]:
+        """Streams an object's bytes (e.g. into an HTTP response). Raises FileNotFoundError if it does not exist."""
+        with closing(self.open_read(key)) as stream:
+            yield from _read_chunks(stream)
+
+    @abstractmethod
+    def size(self, key: str) -> Optional[int]:
+        """The object's size in bytes, or None if it does not exist."""
+
+    def exists(self, key: str) -> bool:
+        return self.size(key) is not None
+
+    @abstractmethod
+    def list_keys(self, prefix: str) -> List[str]:
+        """The keys of every object under `prefix` (a folder such as '<job_id>/final-story')."""
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str):
+        """Deletes every object under `prefix`."""
+
+    @abstractmethod
+    def local_path(self, key: str) -> Optional[Path]:
+        """
+        A local file holding the object (e.g. to serve it with HTTP Range support), or None if
+        the object does not exist or is not kept locally (then stream it with `iter_chunks`).
+
+        The file stays in place until `release(key)` is called, so call it once the file has
+        been served.
+        """
+
+    def release(self, key: str):
+        """Ends a use of the file returned by `local_path`."""
+
+
+class LocalStorage(Storage):
+    """Objects are files under `root`: the job folders themselves, so publishing a job's files costs nothing."""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _path(self, key: str) -> Path:
+        return self.root / validate_key(key)
+
+    def open_read(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def write_stream(self, key: str, chunks: Iterable[bytes]):
+        _write_atomically(self._path(key), chunks)
+
+    def upload_file(self, key: str, local_path: Path):
+        path = self._path(key)
+        if path.exists() and path.samefile(local_path):
+            return
+        super().upload_file(key, local_path)
+
+    def size(self, key: str) -> Optional[int]:
+        path = self._path(key)
+        return path.stat().st_size if path.is_file() else None
+
+    def list_keys(self, prefix: str) -> List[str]:
+        folder = self._path(prefix)
+        if not folder.is_dir():
+            return []
+        return sorted(path.relative_to(self.root).as_posix() for path in folder.rglob("*")
+                      if path.is_file() and not path.name.endswith(".tmp"))
+
+    def delete_prefix(self, prefix: str):
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        return path if path.is_file() else None
+
+
+class S3Storage(Storage):
+    """
+    Objects in an S3 bucket, or in any S3-compatible store (MinIO, LocalStack, ...) at
+    `endpoint_url`, which also serves as a local stand-in for development.
+
+    boto3 is only needed, and only imported, when this backend is used.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.endpoint_url = endpoint_url
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                try:
+                    import boto3
+                except ImportError as e:
+                    raise RuntimeError("STORAGE_BACKEND=s3 needs the 'boto3' package (pip install boto3).") from e
+                self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+            return self._client
+
+    def _object_key(self, key: str) -> str:
+        validate_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    @staticmethod
+    def _is_missing(error: Exception) -> bool:
+        response = getattr(error, "response", None)  # botocore's ClientError
+        return isinstance(response, dict) and str(response.get("Error", {}).get("Code")) in MISSING_OBJECT_CODES
+
+    def open_read(self, key: str) -> BinaryIO:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))["Body"]
+        except Exception as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def write_stream(self, key: str, chunks: Iterable[bytes]):
+        """
+        Writes an object from a stream. Up to MULTIPART_THRESHOLD_BYTES it is a single PUT;
+        beyond that the data is sent as a multipart upload, one part in memory at a time.
+        """
+        object_key = self._object_key(key)
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+        try:
+            for chunk in chunks:
+                buffer += chunk
+                if upload_id is None and len(buffer) < MULTIPART_THRESHOLD_BYTES:
+                    continue
+                if upload_id is None:
+                    upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key)["UploadId"]
+                while len(buffer) >= MULTIPART_PART_BYTES:
+                    parts.append(self._upload_part(object_key, upload_id, len(parts) + 1,
+                                                   bytes(buffer[:MULTIPART_PART_BYTES])))
+                    del buffer[:MULTIPART_PART_BYTES]
+
+            if upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=object_key, Body=bytes(buffer))
+                return
+            if buffer or not parts:
+                parts.append(self._upload_part(object_key, upload_id, len(parts) + 1, bytes(buffer)))
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                                                  MultipartUpload={"Parts": parts})
+        except BaseException:
+            if upload_id is not None:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+            raise
+
+    def _upload_part(self, object_key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+        response = self.client.upload_part(Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                                           PartNumber=part_number, Body=data)
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))["ContentLength"]
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def _list_object_keys(self, prefix: str) -> Iterable[str]:
+        object_prefix = self._object_key(prefix).rstrip("/") + "/"
+        request = {"Bucket": self.bucket, "Prefix": object_prefix}
+        while True:
+            response = self.client.list_objects_v2(**request)
+            for item in response.get("Contents", []):
+                yield item["Key"]
+            if not response.get("IsTruncated"):
+                return
+            request["ContinuationToken"] = response["NextContinuationToken"]
+
+    def list_keys(self, prefix: str) -> List[str]:
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        return sorted(object_key[strip:] for object_key in self._list_object_keys(prefix))
+
+    def delete_prefix(self, prefix: str):
+        object_keys = list(self._list_object_keys(prefix))
+        for start in range(0, len(object_keys), DELETE_BATCH_KEYS):
+            batch = object_keys[start:start + DELETE_BATCH_KEYS]
+            self.client.delete_objects(Bucket=self.bucket,
+                                       Delete={"Objects": [{"Key": object_key} for object_key in batch]})
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return None  # only available through a CachedStorage
+
+
+class CachedStorage(Storage):
+    """
+    A remote storage with a local read-through cache: `local_path` downloads an object on its
+    first use and serves it from disk afterwards. The least recently used files are evicted
+    once the cache grows past `max_bytes`, except those in use (between `local_path` and
+    `release`); an object larger than the whole cache is never cached. Writes go to the remote
+    storage and drop the cached copy.
+    """
+
+    def __init__(self, backend: Storage, cache_dir: Path, max_bytes: int):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()  # guards the pins and the eviction
+        self._pins: Dict[str, int] = {}  # key -> uses of its cached file in progress
+        self._key_locks = [threading.Lock() for _ in range(CACHE_KEY_LOCK_STRIPES)]
+
+    def _cache_path(self, key: str) -> Path:
+        return self.cache_dir / validate_key(key)
+
+    def _forget(self, key: str):
+        self._cache_path(key).unlink(missing_ok=True)
+
+    def open_read(self, key: str) -> BinaryIO:
+        path = self._cache_path(key)
+        if path.is_file():
+            return open(path, "rb")
+        return self.backend.open_read(key)
+
+    def write_stream(self, key: str, chunks: Iterable[bytes]):
+        self._forget(key)
+        self.backend.write_stream(key, chunks)
+
+    def upload_file(self, key: str, local_path: Path):
+        self._forget(key)
+        self.backend.upload_file(key, local_path)
+
+    def size(self, key: str) -> Optional[int]:
+        path = self._cache_path(key)
+        return path.stat().st_size if path.is_file() else self.backend.size(key)
+
+    def list_keys(self, prefix: str) -> List[str]:
+        return self.backend.list_keys(prefix)
+
+    def delete_prefix(self, prefix: str):
+        shutil.rmtree(self._cache_path(prefix), ignore_errors=True)
+        self.backend.delete_prefix(prefix)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        path = self._cache_path(key)
+        self._pin(key)  # from here on, no eviction removes the file
+        try:
+            # Concurrent readers of the same object wait for a single download.
+            with self._key_locks[hash(key) % CACHE_KEY_LOCK_STRIPES]:
+                if path.is_file():
+                    os.utime(path)  # the modification time orders the eviction
+                    return path
+                size = self.backend.size(key)
+                if size is None or size > self.max_bytes:
+                    self.release(key)
+                    return None
+                self.backend.download_file(key, path)
+        except FileNotFoundError:
+            self.release(key)
+            return None
+        except BaseException:
+            self.release(key)
+            raise
+        self._evict()
+        return path
+
+    def _pin(self, key: str):
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def release(self, key: str):
+        with self._lock:
+            uses = self._pins.pop(key, 0) - 1
+            if uses > 0:
+                self._pins[key] = uses
+
+    def _evict(self):
+        """Removes the least recently used files that are not in use until the cache fits in `max_bytes`."""
+        with self._lock:
+            files = []
+            for path in self.cache_dir.rglob("*"):
+                try:
+                    if path.is_file() and not path.name.endswith(".tmp"):
+                        files.append((path.stat(), path))
+                except FileNotFoundError:  # deleted meanwhile, e.g. by a write of the same key
+                    continue
+            total = sum(stat.st_size for stat, _ in files)
+            for stat, path in sorted(files, key=lambda entry: entry[0].st_mtime):
+                if total <= self.max_bytes:
+                    break
+                if path.relative_to(self.cache_dir).as_posix() in self._pins:
+                    continue
+                path.unlink(missing_ok=True)
+                total -= stat.st_size
+
+
+@lru_cache(maxsize=None)
+def get_storage(base_data_dir: Path) -> Storage:
+    """
+    Returns the storage of the job artifacts (STORAGE_BACKEND). With the local backend the
+    storage is `base_data_dir` itself; with S3 it is the bucket behind a local read-through cache.
+    """
+    settings = get_settings()
+    if settings.storage_backend == "s3":
+        backend = S3Storage(settings.s3_bucket, prefix=settings.s3_prefix, endpoint_url=settings.s3_endpoint_url)
+        return CachedStorage(backend, Path(settings.storage_cache_dir), settings.storage_cache_mb * 1024 * 1024)
+    return LocalStorage(base_data_dir)
+
+
+def storage_key(base_data_dir: Path, path: Path) -> str:
+    """The key of a file in a job folder."""
+    return path.relative_to(base_data_dir).as_posix()
+
+
+def publish_files(base_data_dir: Path, paths: Iterable[Path]):
+    """Copies files of job folders to the storage, so other nodes can serve them."""
+    storage = get_storage(base_data_dir)
+    for path in paths:
+        if path.is_file():
+            storage.upload_file(storage_key(base_data_dir, path), path)
+
+
+def publish_folder(base_data_dir: Path, folder: Path):
+    """Copies every file of a job's folder (e.g. its final audio and index) to the storage."""
+    publish_files(base_data_dir, sorted(folder.rglob("*")))
+
+
+def fetch_folder(base_data_dir: Path, folder: Path):
+    """Downloads the files of a job folder kept in the storage that are missing locally (e.g. on another node)."""
+    storage = get_storage(base_data_dir)
+    for key in storage.list_keys(storage_key(base_data_dir, folder)):
+        local_path = base_data_dir / key
+        if not local_path.exists():
+            storage.download_file(key, local_path)
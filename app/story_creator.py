@@ -1,21 +1,16 @@
 import os
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
-from fpdf import FPDF
 from app.job_manager import JobManager
-from app.api_manager import ApiKeyManager, get_api_keys, is_quota_error
+from app.api_manager import ApiKeyManager, get_api_keys
+from app.checkpoint import JobCheckpoint, STAGE_WRITING, STAGE_COMPLETE, STAGE_ERROR
+from app.executors import run_io
+from app.storage import publish_folder
+from app.story_planner import ChapterBatchPlanner
 from app.gemini_client import generate_story_with_memory
 
 
-class PDF(FPDF):
-    def header(self):
-        pass
-
-    def footer(self):
-        pass
-
-
 def clean_markdown(text: str) -> str:
     """Removes common Markdown formatting from text."""
     text = text.replace("### ", "").replace("## ", "").replace("# ", "")
@@ -25,21 +20,9 @@ def clean_markdown(text: str) -> str:
 
 def create_pdf(title: str, content: str, output_path: Path):
     """Creates a PDF file from the generated story text using a Unicode font."""
-    pdf = PDF()
-    pdf.set_title(title)
-
-    font_path = Path(__file__).resolve().parent.parent / "assets/fonts/DejaVuSans.ttf"
-    pdf.add_font("DejaVu", "", str(font_path), uni=True)
-
-    pdf.add_page()
-
-    pdf.set_font("DejaVu", size=12)
+    from app.pdf_renderer import render_story_pdf
 
-    pdf.multi_cell(0, 10, content)
-
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    pdf.output(str(output_path))
-    print(f"PDF saved to {output_path}")
+    render_story_pdf(title, [content], output_path)
 
 
 def create_story_progress_updater(job_id: str, num_chapter_batches: int) -> callable:
@@ -60,65 +43,120 @@ def create_story_progress_updater(job_id: str, num_chapter_batches: int) -> call
     return update_progress_callback
 
 
-async def run_story_creation_pipeline(job_id: str, base_data_dir: Path, story_params: Dict[str, Any]):
+def build_story_prompts(story_params: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """
+    Builds the planning prompt and the batched chapter prompts for a story.
+
+    Args:
+        story_params: The validated story request (name, summary, chapters, chars_per_chapter).
+
+    Returns:
+        A tuple with the initial (outline) prompt and the list of chapter batch prompts.
+    """
+    # 1.1 Load prompt templates from files
+    prompt_dir = Path(__file__).resolve().parent.parent / "prompts"
+    with open(prompt_dir / "story_creator_prompt.txt", "r", encoding="utf-8") as f:
+        initial_prompt_template = f.read()
+    with open(prompt_dir / "story_creator_prompt2.txt", "r", encoding="utf-8") as f:
+        chapter_prompt_template = f.read()
+
+    # 1.2 Format the initial prompt
+    initial_prompt = initial_prompt_template.replace("[INSIRA AQUI]", story_params.get("name")) \
+        .replace("[INSIRA UM RESUMO GERAL DO ENREDO, AMBIENTAÇÃO, PERSONAGENS PRINCIPAIS ETC.]",
+                 story_params.get("summary")) \
+        .replace("[INSIRA O NÚMERO TOTAL DE CAPÍTULOS]", str(story_params.get("chapters"))) \
+        .replace("[INSIRA UM NÚMERO APROXIMADO, EX: 3.000 CARACTERES]", str(story_params.get("chars_per_chapter")))
+
+    # 1.3 Create batched chapter prompts, as many chapters per request as fit the output budget
+    num_chapters = story_params.get("chapters")
+    chapter_prompts = []
+    for batch in ChapterBatchPlanner.plan_batches(num_chapters, story_params.get("chars_per_chapter")):
+        if len(batch) > 1:
+            numbers = ", ".join(str(number) for number in batch[:-1]) + f" e {batch[-1]}"
+            prompt_text = f"Perfeito!\nAgora, escreva os capítulos {numbers} da história."
+        elif batch[0] == num_chapters:
+            prompt_text = f"Perfeito!\nAgora, escreva o capítulo final, o de número {batch[0]}."
+        else:
+            prompt_text = f"Perfeito!\nAgora, escreva o capítulo {batch[0]} da história."
+
+        # Add the crucial instruction from prompt2 to every request
+        prompt_text += (
+            "\nImportante: sua resposta deve ser apenas o nome e texto do capítulo, você não deve fazer "
+            "nenhum tipo de interação comigo na resposta ou falar algo que não seja o capítulo em si.")
+        prompt_text += "\nNão use formatação Markdown como '#', '*' ou '_'. Escreva apenas o texto puro."
+
+        chapter_prompts.append(prompt_text)
+
+    return initial_prompt, chapter_prompts
+
+
+async def run_story_creation_pipeline(job_id: str, base_data_dir: Path, story_params: Optional[Dict[str, Any]] = None):
     """
     The main background task for the story creation pipeline.
+
+    The prompts, the outline and every chapter batch are checkpointed in the job folder as
+    they are written. If the job already has a story checkpoint (it was interrupted or
+    failed), `story_params` may be omitted: the story continues after the last chapter batch
+    written, without asking for the earlier ones again.
     """
-    final_story_dir = base_data_dir / job_id / "final-story"
-    story_name = story_params.get("name")
+    from app.processor import create_pause_notifier
+
+    job_dir = base_data_dir / job_id
+    final_story_dir = job_dir / "final-story"
+    checkpoint = await run_io(JobCheckpoint.load, job_dir)
 
     try:
         JobManager.update_job_status(job_id, "processing", "Step 1/3: Initializing and "
                                                            "preparing prompts...", progress=0)
-        # --- Prepare Prompts ---
-        # 1.1 Load prompt templates from files
-        prompt_dir = Path(__file__).resolve().parent.parent / "prompts"
-        with open(prompt_dir / "story_creator_prompt.txt", "r", encoding="utf-8") as f:
-            initial_prompt_template = f.read()
-        with open(prompt_dir / "story_creator_prompt2.txt", "r", encoding="utf-8") as f:
-            chapter_prompt_template = f.read()
-
-        # 1.2 Format the initial prompt
-        initial_prompt = initial_prompt_template.replace("[INSIRA AQUI]", story_name) \
-            .replace("[INSIRA UM RESUMO GERAL DO ENREDO, AMBIENTAÇÃO, PERSONAGENS PRINCIPAIS ETC.]",
-                     story_params.get("summary")) \
-            .replace("[INSIRA O NÚMERO TOTAL DE CAPÍTULOS]", str(story_params.get("chapters"))) \
-            .replace("[INSIRA UM NÚMERO APROXIMADO, EX: 3.000 CARACTERES]", str(story_params.get("chars_per_chapter")))
-
-        # 1.3 Create batched chapter prompts
-        num_chapters = story_params.get("chapters")
-        chapter_prompts = []
-        for i in range(1, num_chapters + 1, 2):
-            if i + 1 <= num_chapters:
-                prompt_text = f"Perfeito!\nAgora, escreva os capítulos {i} e {i + 1} da história."
-            else:
-                prompt_text = f"Perfeito!\nAgora, escreva o capítulo final, o de número {i}."
-
-            # Add the crucial instruction from prompt2 to every request
-            prompt_text += (
-                "\nImportante: sua resposta deve ser apenas o nome e texto do capítulo, você não deve fazer "
-                "nenhum tipo de interação comigo na resposta ou falar algo que não seja o capítulo em si.")
-            prompt_text += "\nNão use formatação Markdown como '#', '*' ou '_'. Escreva apenas o texto puro."
-
-            chapter_prompts.append(prompt_text)
+        # --- Prepare Prompts (or take them from the checkpoint) ---
+        if checkpoint is not None and checkpoint.story is not None:
+            story = checkpoint.story
+            story_params, initial_prompt, chapter_prompts = (story["params"], story["initial_prompt"],
+                                                             story["chapter_prompts"])
+            written_chapters = list(story["chapters"])
+            await run_io(checkpoint.set_stage, STAGE_WRITING)
+            print(f"[{job_id}] Resuming story: {len(written_chapters)} of {len(chapter_prompts)} "
+                  f"chapter batch(es) already written.")
+        else:
+            if story_params is None:
+                raise ValueError("The job has no story checkpoint to resume from.")
+            initial_prompt, chapter_prompts = build_story_prompts(story_params)
+            written_chapters = []
+            checkpoint = await run_io(JobCheckpoint.create, job_dir, job_type="story")
+            await run_io(checkpoint.start_story, story_params, initial_prompt, chapter_prompts)
+        story_name = story_params.get("name")
 
         num_batches = len(chapter_prompts)
         progress_callback = create_story_progress_updater(job_id, num_batches)
 
-        JobManager.update_job_status(job_id, "processing", "Step 2/3:"
-                                                       " Generating story with AI... (This can take time)", progress=-1)
+        writing_message = "Step 2/3: Generating story with AI... (This can take time)"
+        JobManager.update_job_status(job_id, "processing", writing_message, progress=-1)
 
         # --- Initialize API Manager and get a key ---
+        # The manager stays with the story: a quota error moves it to the next key, or pauses it
+        # until one comes back, instead of failing the job.
         api_keys = get_api_keys()
-        key_manager = ApiKeyManager(api_keys)
-        api_key, key_idx = await key_manager.get_key_for_processing()
-        if not api_key:
-            raise RuntimeError("All API keys are exhausted.")
+        key_manager = ApiKeyManager(api_keys, pause_callback=create_pause_notifier(job_id, writing_message))
+        api_key, key_idx = await key_manager.wait_for_key()
 
         # --- Generate Story ---
-        full_story_text = await generate_story_with_memory(api_key, initial_prompt, chapter_prompts, progress_callback)
+        # Each chapter batch is saved as an artifact and laid out as soon as it arrives,
+        # so only the final serialization is left once the story is complete.
+        from app.pdf_renderer import StoryPdfRenderer, save_chapter_artifact
+
+        renderer = await run_io(StoryPdfRenderer, story_name)
+        chapter_dir = job_dir / "story-chapters"
+        for chapter_text in written_chapters:
+            await run_io(renderer.add_text, clean_markdown(chapter_text))
 
-        cleaned_story_text = clean_markdown(full_story_text)
+        async def render_chapter(batch_index: int, chapter_text: str):
+            cleaned_text = clean_markdown(chapter_text)
+            await run_io(save_chapter_artifact, chapter_dir, batch_index, cleaned_text)
+            await run_io(renderer.add_text, cleaned_text)
+
+        await generate_story_with_memory(api_key, initial_prompt, chapter_prompts, progress_callback,
+                                         chapter_callback=render_chapter, key_manager=key_manager,
+                                         checkpoint=checkpoint)
 
         current_progress = JobManager.retrieve_job_status(job_id).get("progress", 0)
         JobManager.update_job_status(job_id, "processing", "Step 3/3: Creating final PDF document...",
@@ -126,18 +164,17 @@ async def run_story_creation_pipeline(job_id: str, base_data_dir: Path, story_pa
 
         # --- Create PDF ---
         pdf_output_path = final_story_dir / f"{story_name.replace(' ', '_')}.pdf"
-        create_pdf(title=story_name, content=cleaned_story_text, output_path=pdf_output_path)
+        await run_io(renderer.save, pdf_output_path)
+        await run_io(publish_folder, base_data_dir, final_story_dir)
 
+        await run_io(checkpoint.set_stage, STAGE_COMPLETE)
         JobManager.update_job_status(job_id, "complete", "Your story is ready for download!", progress=100)
         print(f"[{job_id}] Story creation job completed successfully.")
 
     except Exception as e:
-        if is_quota_error(e):
-            # In a future version, you could implement re-queueing logic here.
-            # For now, we will mark it as a clear error.
-            error_msg = "API quota exhausted. Please try again later or add a new API key."
-            print(f"[{job_id}] A quota error occurred: {error_msg}")
-            JobManager.update_job_status(job_id, "error", error_msg)
-        else:
-            print(f"[{job_id}] An error occurred in the story pipeline: {e}")
-            JobManager.update_job_status(job_id, "error", f"An error occurred: {e}", progress=-1)
+        print(f"[{job_id}] An error occurred in the story pipeline: {e}")
+        error_msg = f"An error occurred: {e}"
+        if checkpoint is not None and checkpoint.story is not None:
+            await run_io(checkpoint.set_stage, STAGE_ERROR)
+            error_msg += " (the story written so far is saved; resume the job to continue it)"
+        JobManager.update_job_status(job_id, "error", error_msg, progress=-1)
@@ -0,0 +1,62 @@
+import math
+import threading
+from typing import List
+
+from app.config import get_settings
+
+# --- Output budget of the story requests ---
+DEFAULT_CHARACTERS_PER_TOKEN = 4.0  # until enough text has been generated to measure it
+MIN_MEASURED_TOKENS = 2000  # the measured ratio is only trusted after this many output tokens
+CHARACTERS_PER_TOKEN_RANGE = (2.0, 6.0)  # a measurement outside this range is clamped to it
+BUDGET_SHARE = 0.7  # chapters run longer than asked for, and the title and breaks need room too
+MAX_CHAPTERS_PER_BATCH = 5  # more chapters per request make the model rush them
+
+
+class ChapterBatchPlanner:
+    """
+    Decides how many chapters each story request asks for: as many as fit the output-token
+    budget (STORY_MAX_OUTPUT_TOKENS), so short chapters need few round trips and long ones
+    are not cut off.
+
+    Every story response reports its length in characters and tokens, so the budget is
+    planned with the characters per token measured for the language the stories are written in.
+    """
+
+    _characters = 0
+    _tokens = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def record_output(cls, characters: int, tokens: int):
+        """Records the length of one response, in characters and in output tokens."""
+        if tokens <= 0:
+            return
+        with cls._lock:
+            cls._characters += characters
+            cls._tokens += tokens
+
+    @classmethod
+    def characters_per_token(cls) -> float:
+        with cls._lock:
+            if cls._tokens < MIN_MEASURED_TOKENS:
+                return DEFAULT_CHARACTERS_PER_TOKEN
+            ratio = cls._characters / cls._tokens
+        return min(max(ratio, CHARACTERS_PER_TOKEN_RANGE[0]), CHARACTERS_PER_TOKEN_RANGE[1])
+
+    @classmethod
+    def chapters_per_batch(cls, chars_per_chapter: int) -> int:
+        """How many chapters of `chars_per_chapter` characters fit in one response (at least one)."""
+        budget_characters = get_settings().story_max_output_tokens * BUDGET_SHARE * cls.characters_per_token()
+        return max(1, min(MAX_CHAPTERS_PER_BATCH, math.floor(budget_characters / chars_per_chapter)))
+
+    @classmethod
+    def plan_batches(cls, chapters: int, chars_per_chapter: int) -> List[List[int]]:
+        """
+        Splits the chapters into request batches.
+
+        Returns:
+            The chapter numbers (starting at 1) of each batch, e.g. [[1, 2, 3], [4, 5]].
+        """
+        per_batch = cls.chapters_per_batch(chars_per_chapter)
+        numbers = list(range(1, chapters + 1))
+        return [numbers[start:start + per_batch] for start in range(0, chapters, per_batch)]
@@ -1,10 +1,9 @@
-import os
+import re
+import shutil
+import subprocess
+import tempfile
 from pathlib import Path
-
-from moviepy.editor import (
-    VideoFileClip, AudioFileClip,
-    concatenate_videoclips, concatenate_audioclips
-)
+from typing import Callable, List, Optional
 
 # --- CONFIGURATION ---
 MEDIA_FOLDER = Path(__file__).resolve().parent.parent / "data/media"
@@ -17,96 +16,217 @@ LOOP_DURATION_SECONDS = 3600  # 1 hour (or 10800 for 3 hours)
 CROSSFADE_TIME = 1  # in seconds
 # --- END OF CONFIGURATION ---
 
-# --- Path definitions ---
-# Using pathlib's "/" operator is the modern way to join paths
-video_path = MEDIA_FOLDER / INPUT_VIDEO_NAME
-audio_path = MEDIA_FOLDER / INPUT_AUDIO_NAME
-output_video_path = MEDIA_FOLDER / OUTPUT_VIDEO_NAME
-output_audio_path = MEDIA_FOLDER / OUTPUT_AUDIO_NAME
-
-# Check if files exist using pathlib's .exists() method
-video_exists = video_path.exists()
-audio_exists = audio_path.exists()
-
-# Case 1: No media files found
-if not video_exists and not audio_exists:
-    print("No video or audio files found in the media folder.")
-    exit()
-
-# Case 2: Only audio found -> process just the audio with a crossfade loop
-if not video_exists and audio_exists:
-    print(f"Only audio found: {audio_path}")
-    try:
-        audio_clip = AudioFileClip(str(audio_path))
-        original_duration = audio_clip.duration
-
-        # Calculate repetitions needed to fill the target duration
-        # We subtract the crossfade time as that part overlaps
-        repetitions = int(LOOP_DURATION_SECONDS / (original_duration - CROSSFADE_TIME)) + 1
-        print(f"Looping audio {repetitions} times with a {CROSSFADE_TIME}-second fade-in.")
-
-        audio_clips = [audio_clip]
-        for _ in range(repetitions - 1):
-            # Each subsequent clip fades in to create the crossfade effect
-            audio_clips.append(audio_clip.audio_fadein(CROSSFADE_TIME))
-
-        final_audio = concatenate_audioclips(audio_clips)
-        # Trim the final audio to the exact desired duration
-        final_audio = final_audio.subclip(0, LOOP_DURATION_SECONDS)
-        final_audio.write_audiofile(str(output_audio_path))
-
-        print(f"Final audio exported to: {output_audio_path}")
-    except Exception as e:
-        print("An error occurred while processing the audio.")
-        print(f"Details: {e}")
-    exit()
-
-# Case 3: Video file exists -> process it (with or without a separate audio file)
-try:
-    print(f"Loading video from: {video_path}")
-    video_clip = VideoFileClip(str(video_path))
+# Encoder settings shared by the loop cycle and the final partial cycle. They must match,
+# otherwise the concat demuxer cannot stream-copy the two into one file.
+VIDEO_ENCODER_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-pix_fmt", "yuv420p"]
 
-    repetitions = int(LOOP_DURATION_SECONDS / (video_clip.duration - CROSSFADE_TIME)) + 1
-    print(f"Looping video {repetitions} times with a {CROSSFADE_TIME}-second crossfade.")
+DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+FRAME_RATE_PATTERN = re.compile(r"(\d+(?:\.\d+)?) fps")
+DEFAULT_FRAME_RATE = 30
 
-    video_clips = [video_clip]
-    for _ in range(repetitions - 1):
-        # crossfadein is the video equivalent of audio_fadein
-        video_clips.append(video_clip.crossfadein(CROSSFADE_TIME))
 
-    # Concatenate with a negative padding to create the visual crossfade
-    final_video = concatenate_videoclips(video_clips, method="compose", padding=-CROSSFADE_TIME)
-    # Trim the final video to the exact desired duration
-    final_video = final_video.subclip(0, LOOP_DURATION_SECONDS)
+class LoopError(RuntimeError):
+    """Raised when ffmpeg fails or the input media cannot be looped."""
 
-except Exception as e:
-    print("An error occurred while processing the video.")
-    print(f"Details: {e}")
-    exit()
 
-# If a separate audio file also exists, loop it and add it to the final video
-if audio_exists:
+def find_ffmpeg() -> str:
+    """Returns the ffmpeg executable: the one on PATH, or the binary bundled with moviepy (imageio-ffmpeg)."""
+    ffmpeg_path = shutil.which("ffmpeg")
+    if ffmpeg_path:
+        return ffmpeg_path
     try:
-        print(f"Loading audio from: {audio_path}")
-        audio_clip = AudioFileClip(str(audio_path))
-
-        # This logic is repeated from Case 2; it could be moved to a function
-        # in a larger application, but is fine here for clarity.
-        audio_clips = [audio_clip]
-        for _ in range(repetitions - 1):
-            audio_clips.append(audio_clip.audio_fadein(CROSSFADE_TIME))
-
-        final_audio = concatenate_audioclips(audio_clips)
-        final_audio = final_audio.subclip(0, LOOP_DURATION_SECONDS)
-
-        # Replace the video's original audio with the new, looped audio
-        final_video = final_video.set_audio(final_audio)
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError) as e:
+        raise LoopError("ffmpeg was not found. Install it or the 'imageio-ffmpeg' package.") from e
+
+
+def probe_media(media_path: Path) -> dict:
+    """
+    Reads the duration and stream types of a media file from ffmpeg's input summary.
+
+    Returns:
+        A dict with 'duration' (seconds), 'fps', 'has_video' and 'has_audio'.
+    """
+    result = subprocess.run([find_ffmpeg(), "-hide_banner", "-i", str(media_path)],
+                            capture_output=True, text=True)
+    match = DURATION_PATTERN.search(result.stderr)
+    if not match:
+        raise LoopError(f"Could not read the duration of '{media_path.name}'.")
+    hours, minutes, seconds = match.groups()
+    frame_rate_match = FRAME_RATE_PATTERN.search(result.stderr)
+    return {
+        "duration": int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        "fps": float(frame_rate_match.group(1)) if frame_rate_match else DEFAULT_FRAME_RATE,
+        "has_video": "Video:" in result.stderr,
+        "has_audio": "Audio:" in result.stderr,
+    }
+
+
+def run_ffmpeg(args: List[str], expected_seconds: float = 0,
+               progress_callback: Optional[Callable[[float, float], None]] = None):
+    """
+    Runs ffmpeg with the given arguments and reports its progress.
+
+    Args:
+        args: The ffmpeg arguments (without the executable).
+        expected_seconds: Duration of the output, used for the progress report.
+        progress_callback: Called with (seconds_done, expected_seconds) as ffmpeg advances.
+    """
+    command = [find_ffmpeg(), "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+               "-progress", "pipe:1", *args]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        if key == "out_time_us" and value.isdigit() and progress_callback:
+            progress_callback(min(int(value) / 1_000_000, expected_seconds), expected_seconds)
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise LoopError(f"ffmpeg failed: {stderr.strip()[-500:]}")
+
+
+def render_loop_cycle(video_path: Path, cycle_path: Path, crossfade: float, media: dict) -> float:
+    """
+    Renders one loop cycle of the video, the only part of the output that is decoded and encoded.
+
+    The cycle is the clip from `crossfade` to the end, with its last `crossfade` seconds faded
+    into the clip's first `crossfade` seconds. Its last frame therefore leads straight into its
+    own first frame, so identical cycles can simply be played back to back.
+
+    Args:
+        video_path: The source clip.
+        cycle_path: Where the encoded cycle (video only) is written.
+        crossfade: Crossfade length in seconds.
+        media: The clip's `probe_media` summary.
+
+    Returns:
+        The duration of the cycle in seconds.
+    """
+    duration = media["duration"]
+    if crossfade <= 0 or duration <= 2 * crossfade:
+        if crossfade > 0:
+            print(f"Clip is too short for a {crossfade}s crossfade; looping it without one.")
+        run_ffmpeg(["-i", str(video_path), "-map", "0:v:0", *VIDEO_ENCODER_ARGS, str(cycle_path)], duration)
+        return duration
+
+    # The clip is opened twice: one input supplies the body, the other the head it fades into.
+    cycle_duration = duration - crossfade
+    video_filter = (
+        f"[0:v]trim=start={crossfade},setpts=PTS-STARTPTS,fps={media['fps']}[main];"
+        f"[1:v]trim=end={crossfade},setpts=PTS-STARTPTS,fps={media['fps']}[head];"
+        f"[main][head]xfade=transition=fade:duration={crossfade}:offset={duration - 2 * crossfade},"
+        f"format=yuv420p[v]"
+    )
+    run_ffmpeg(["-i", str(video_path), "-i", str(video_path), "-filter_complex", video_filter, "-map", "[v]",
+                *VIDEO_ENCODER_ARGS, "-t", f"{cycle_duration:.3f}", str(cycle_path)], cycle_duration)
+    return cycle_duration
+
+
+def loop_video(video_path: Path, output_path: Path, target_seconds: float = LOOP_DURATION_SECONDS,
+               crossfade: float = CROSSFADE_TIME, audio_path: Optional[Path] = None,
+               progress_callback: Optional[Callable[[float, float], None]] = None) -> Path:
+    """
+    Loops a video to `target_seconds` with a crossfade between repetitions.
+
+    Only one loop cycle and the final partial cycle are encoded. Every full cycle is
+    stream-copied through ffmpeg's concat demuxer, so memory stays constant and the run time
+    is dominated by writing the output rather than by decoding and encoding it. The audio
+    track (the clip's own, or `audio_path`) is looped separately by `loop_audio`.
+
+    Args:
+        video_path: The source clip.
+        output_path: Where the looped .mp4 is written.
+        target_seconds: Duration of the output.
+        crossfade: Crossfade between repetitions, in seconds.
+        audio_path: Optional audio file to loop and use instead of the clip's own audio.
+        progress_callback: Called with (seconds_done, target_seconds) while the output is written.
+
+    Returns:
+        The output path.
+    """
+    from app.audio_loop import loop_audio
+
+    media = probe_media(video_path)
+    if not media["has_video"]:
+        raise LoopError(f"'{video_path.name}' has no video stream.")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=output_path.parent, prefix=".loop-") as work_dir:
+        work_dir = Path(work_dir)
+
+        # --- Step 1: Encode a single crossfaded cycle ---
+        cycle_path = work_dir / "cycle.mp4"
+        cycle_duration = render_loop_cycle(video_path, cycle_path, crossfade, media)
+
+        full_cycles = int(target_seconds // cycle_duration)
+        remainder = target_seconds - full_cycles * cycle_duration
+        print(f"Looping video: {full_cycles} full cycle(s) of {cycle_duration:.2f}s"
+              f" + {remainder:.2f}s with a {crossfade}-second crossfade.")
+
+        # --- Step 2: Re-encode only the final partial cycle ---
+        segments = [cycle_path] * full_cycles
+        if remainder > 0.001:
+            partial_path = work_dir / "partial.mp4"
+            run_ffmpeg(["-i", str(cycle_path), "-t", f"{remainder:.3f}", *VIDEO_ENCODER_ARGS, str(partial_path)],
+                       remainder)
+            segments.append(partial_path)
+
+        concat_list = work_dir / "segments.txt"
+        concat_list.write_text("".join(f"file '{segment.name}'\n" for segment in segments), encoding="utf-8")
+        output_args = ["-f", "concat", "-safe", "0", "-i", str(concat_list)]
+
+        # --- Step 3: Loop the audio track, if there is one ---
+        audio_source = audio_path or (video_path if media["has_audio"] else None)
+        if audio_source is not None:
+            looped_audio_path = work_dir / "audio.m4a"
+            # Encoding the audio is the slow part of this job, so it is the one that reports progress.
+            loop_audio(audio_source, looped_audio_path, target_seconds, crossfade, progress_callback)
+            output_args += ["-i", str(looped_audio_path), "-map", "0:v:0", "-map", "1:a:0"]
+
+        # --- Step 4: Stream-copy every segment (and the audio) into the output ---
+        run_ffmpeg([*output_args, "-c", "copy", "-t", f"{target_seconds:.3f}", "-movflags", "+faststart",
+                    str(output_path)], target_seconds, None if audio_source else progress_callback)
+
+    print(f"Looped video exported to: {output_path}")
+    return output_path
+
+
+def main():
+    video_path = MEDIA_FOLDER / INPUT_VIDEO_NAME
+    audio_path = MEDIA_FOLDER / INPUT_AUDIO_NAME
+    output_video_path = MEDIA_FOLDER / OUTPUT_VIDEO_NAME
+    output_audio_path = MEDIA_FOLDER / OUTPUT_AUDIO_NAME
+
+    video_exists = video_path.exists()
+    audio_exists = audio_path.exists()
+
+    # Case 1: No media files found
+    if not video_exists and not audio_exists:
+        print("No video or audio files found in the media folder.")
+        return
+
+    # Case 2: Only audio found -> process just the audio with a crossfade loop
+    if not video_exists:
+        print(f"Only audio found: {audio_path}")
+        try:
+            from app.audio_loop import loop_audio
+            loop_audio(audio_path, output_audio_path)
+        except Exception as e:
+            print("An error occurred while processing the audio.")
+            print(f"Details: {e}")
+        return
+
+    # Case 3: Video file exists -> process it (with or without a separate audio file)
+    try:
+        print(f"Loading video from: {video_path}")
+        loop_video(video_path, output_video_path, audio_path=audio_path if audio_exists else None)
     except Exception as e:
-        print("An error occurred while adding the audio to the video.")
+        print("An error occurred while processing the video.")
         print(f"Details: {e}")
+        return
+
+    print("Process completed successfully!")
 
-# Export the final video file
-print(f"Exporting final video to: {output_video_path}")
-final_video.write_videofile(str(output_video_path), codec="libx264", audio_codec="aac")
 
-print("Process completed successfully!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
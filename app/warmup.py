@@ -0,0 +1,30 @@
+import time
+
+from app.api_manager import get_api_keys
+
+
+def prewarm():
+    """
+    Loads the heavy dependencies and API clients ahead of the first job.
+
+    Meant to run in a background thread once the server is already accepting requests:
+    none of this is needed to answer `/` or `/status`, but it would otherwise be paid by
+    the first conversion or story job.
+    """
+    started = time.perf_counter()
+    try:
+        import PyPDF2  # noqa: F401
+        import numpy  # noqa: F401
+        from google.genai import types  # noqa: F401
+        from app.pdf_renderer import load_font_template
+        from app.gemini_client import get_genai_client
+
+        load_font_template()
+        api_keys = [key for key in get_api_keys() if key]
+        for api_key in api_keys:
+            get_genai_client(api_key)
+    except Exception as e:
+        print(f"Warning: pre-warm failed, dependencies will be loaded on first use instead: {e}")
+        return
+
+    print(f"Pre-warm finished in {time.perf_counter() - started:.2f}s ({len(api_keys)} API client(s) ready).")
@@ -1,10 +1,149 @@
 import re
+import time
+import wave
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import List, Optional, Tuple
 
-from pydub import AudioSegment
+import numpy as np
 
-def concatenate_audio_blocks(base_audio_folder: Path, final_audio_dir: Path):
+PAUSE_MS = 350
+SAMPLE_WIDTH_BYTES = 2  # the TTS blocks are 16-bit PCM
+DEFAULT_SAMPLE_RATE = 24000
+FULL_SCALE = 32768.0
+PROCESSING_CHUNK_SAMPLES = 1 << 15
 
+# --- Post-processing defaults ---
+TARGET_LOUDNESS_DBFS = -20.0  # RMS loudness every block is brought to
+MAX_GAIN_DB = 12.0  # never boost (or cut) a block by more than this
+PEAK_CEILING_DBFS = -1.0  # the gain is lowered if it would push a peak above this
+SILENCE_THRESHOLD_DBFS = -50.0  # samples below this count as silence when trimming
+EDGE_PADDING_MS = 60  # silence kept before the first and after the last sound, so onsets are not clipped
+
+
+@dataclass
+class PostProcessingOptions:
+    target_loudness_dbfs: float = TARGET_LOUDNESS_DBFS
+    max_gain_db: float = MAX_GAIN_DB
+    peak_ceiling_dbfs: float = PEAK_CEILING_DBFS
+    silence_threshold_dbfs: float = SILENCE_THRESHOLD_DBFS
+    edge_padding_ms: int = EDGE_PADDING_MS
+
+
+def _db_to_amplitude(db: float) -> float:
+    return FULL_SCALE * 10 ** (db / 20)
+
+
+def _first_loud_frame(samples: np.ndarray, threshold: int, from_end: bool = False) -> int:
+    """
+    Returns the index of the first (or last) frame above `threshold`, or -1 if there is none.
+
+    Silence only sits at the edges of a block, so the block is scanned in short windows from
+    the edge inwards and the scan stops at the first loud window instead of touching every sample.
+    """
+    window = 4096
+    total = len(samples)
+    for offset in range(0, total, window):
+        start, end = (max(total - offset - window, 0), total - offset) if from_end else (offset, offset + window)
+        chunk = samples[start:end]
+        loud = ((chunk > threshold) | (chunk < -threshold)).any(axis=1)
+        if loud.any():
+            hits = np.flatnonzero(loud)
+            return start + int(hits[-1] if from_end else hits[0])
+    return -1
+
+
+def trim_edge_silence(samples: np.ndarray, sample_rate: int, options: PostProcessingOptions) -> np.ndarray:
+    """
+    Drops the leading and trailing silence of a block, keeping `edge_padding_ms` around the sound.
+
+    Args:
+        samples: An int16 array shaped (frames, channels).
+        sample_rate: The sample rate of the block.
+        options: The post-processing settings.
+
+    Returns:
+        A view of `samples` without its edge silence (empty if the block is silent).
+    """
+    threshold = int(_db_to_amplitude(options.silence_threshold_dbfs))
+    first = _first_loud_frame(samples, threshold)
+    if first < 0:
+        return samples[:0]
+    last = _first_loud_frame(samples, threshold, from_end=True)
+    padding = int(sample_rate * options.edge_padding_ms / 1000)
+    return samples[max(first - padding, 0):min(last + 1 + padding, len(samples))]
+
+
+def normalize_loudness(samples: np.ndarray, options: PostProcessingOptions) -> np.ndarray:
+    """
+    Applies a single gain so the block's RMS loudness matches `target_loudness_dbfs`.
+
+    The gain is bounded by `max_gain_db` and by the peak ceiling, so quiet blocks are not
+    blown up and loud blocks are never clipped.
+    """
+    if len(samples) == 0:
+        return samples
+    flat = samples.reshape(-1)
+    peak = max(int(flat.max()), -int(flat.min()))
+    if peak == 0:
+        return samples
+
+    # Both passes work through a small float buffer that stays in the CPU cache.
+    buffer = np.empty(min(len(flat), PROCESSING_CHUNK_SAMPLES), dtype=np.float32)
+    energy = 0.0
+    for start in range(0, len(flat), PROCESSING_CHUNK_SAMPLES):
+        chunk = buffer[:len(flat[start:start + PROCESSING_CHUNK_SAMPLES])]
+        np.copyto(chunk, flat[start:start + len(chunk)], casting="unsafe")
+        energy += float(np.dot(chunk, chunk))
+    rms = (energy / len(flat)) ** 0.5
+
+    gain_db = options.target_loudness_dbfs - 20 * np.log10(rms / FULL_SCALE)
+    gain_db = min(max(gain_db, -options.max_gain_db), options.max_gain_db)
+    gain = min(10 ** (gain_db / 20), _db_to_amplitude(options.peak_ceiling_dbfs) / peak)
+    if abs(gain - 1) < 1e-3:
+        return samples
+
+    # The peak ceiling keeps every scaled sample inside the int16 range, so no clipping is needed.
+    output = np.empty_like(flat)
+    for start in range(0, len(flat), PROCESSING_CHUNK_SAMPLES):
+        chunk = buffer[:len(flat[start:start + PROCESSING_CHUNK_SAMPLES])]
+        np.multiply(flat[start:start + len(chunk)], np.float32(gain), out=chunk, casting="unsafe")
+        np.rint(chunk, out=chunk)
+        np.copyto(output[start:start + len(chunk)], chunk, casting="unsafe")
+    return output.reshape(samples.shape)
+
+
+def post_process_block(samples: np.ndarray, sample_rate: int, options: PostProcessingOptions) -> np.ndarray:
+    """Trims a block's edge silence and evens out its loudness."""
+    return normalize_loudness(trim_edge_silence(samples, sample_rate, options), options)
+
+
+@dataclass
+class ConcatenatedAudio:
+    path: Path
+    sample_rate: int
+    channels: int
+    total_frames: int = 0
+    block_spans: List[Tuple[str, int, int]] = field(default_factory=list)  # (block name, first frame, frames)
+
+
+def concatenate_audio_blocks(base_audio_folder: Path, final_audio_dir: Path,
+                             post_processing: Optional[PostProcessingOptions] = None) -> ConcatenatedAudio:
+    """
+    Joins the 'blockN.wav' files into 'final_audio.wav', with a short pause between blocks.
+
+    The blocks are read one at a time and written straight into the output file, so memory
+    stays at the size of a single block however long the audiobook is. When `post_processing`
+    is given, each block is trimmed and loudness-normalized in the same pass.
+
+    Args:
+        base_audio_folder: The folder holding the block WAVs.
+        final_audio_dir: Where 'final_audio.wav' is written.
+        post_processing: Optional settings for the per-block post-processing.
+
+    Returns:
+        The final audio file, with where each block starts in it.
+    """
     # Regex to identify and extract the number from the filename
     file_pattern = re.compile(r"block(\d+)\.wav")
 
@@ -20,22 +159,60 @@ def concatenate_audio_blocks(base_audio_folder: Path, final_audio_dir: Path):
         key=lambda filename: int(file_pattern.match(filename).group(1))
     )
 
-    pause = AudioSegment.silent(duration=350)
+    final_output_path = final_audio_dir / "final_audio.wav"
+    output_params = None
+    pause = b""
+    written_blocks = 0
+    processing_seconds = 0.0
+    started = time.perf_counter()
 
-    # Concatenate the audio files
-    audiobook = AudioSegment.empty()
+    with wave.open(str(final_output_path), "wb") as output:
+        for filename in sorted_files:
+            with wave.open(str(base_audio_folder / filename), "rb") as block:
+                params = (block.getnchannels(), block.getsampwidth(), block.getframerate())
+                frames = block.readframes(block.getnframes())
 
-    for filename in sorted_files:
-        file_path = base_audio_folder / filename
-        audio_segment = AudioSegment.from_wav(file_path)
+            if output_params is None:
+                output_params = params
+                channels, sample_width, sample_rate = params
+                if sample_width != SAMPLE_WIDTH_BYTES:
+                    raise ValueError(f"'{filename}' must be 16-bit PCM.")
+                output.setnchannels(channels)
+                output.setsampwidth(sample_width)
+                output.setframerate(sample_rate)
+                result = ConcatenatedAudio(final_output_path, sample_rate, channels)
+                pause = bytes(int(sample_rate * PAUSE_MS / 1000) * channels * sample_width)
+            elif params != output_params:
+                raise ValueError(f"'{filename}' has format {params}, expected {output_params}.")
 
-        if not audiobook: # If the audiobook is empty, this is the first segment
-            audiobook += audio_segment
-        else:
-            audiobook += pause + audio_segment
+            if post_processing is not None:
+                processing_started = time.perf_counter()
+                samples = np.frombuffer(frames, dtype="<i2").reshape(-1, channels)
+                processed = post_process_block(samples, sample_rate, post_processing)
+                processing_seconds += time.perf_counter() - processing_started
+                if processed.size == 0:
+                    print(f"Warning: '{filename}' is silent. Skipping it.")
+                    continue
+                frames = memoryview(processed).cast("B")  # written without another copy
 
-    # Save the final file
-    final_output_path = final_audio_dir / "final_audio.wav"
-    audiobook.export(final_output_path, format="wav")
+            if written_blocks:  # No pause before the first block
+                output.writeframes(pause)
+                result.total_frames += len(pause) // (channels * sample_width)
+            output.writeframes(frames)
+            block_frames = len(frames) // (channels * sample_width)
+            result.block_spans.append((Path(filename).stem, result.total_frames, block_frames))
+            result.total_frames += block_frames
+            written_blocks += 1
+
+        if output_params is None:
+            # No blocks: still write a valid (empty) file with the TTS format.
+            output.setnchannels(1)
+            output.setsampwidth(SAMPLE_WIDTH_BYTES)
+            output.setframerate(DEFAULT_SAMPLE_RATE)
+            result = ConcatenatedAudio(final_output_path, DEFAULT_SAMPLE_RATE, 1)
 
-    print(f"Concatenated audiobook saved to: {final_output_path}")
\ No newline at end of file
+    print(f"Concatenated audiobook saved to: {final_output_path}")
+    if post_processing is not None:
+        print(f"Post-processed {len(sorted_files)} block(s) in {processing_seconds:.2f}s "
+              f"of {time.perf_counter() - started:.2f}s total.")
+    return result
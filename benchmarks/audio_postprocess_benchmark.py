@@ -0,0 +1,65 @@
+"""
+Measures what the per-block post-processing (edge-silence trim + loudness normalization)
+adds to `concatenate_audio_blocks`, compared with a plain concatenation of the same blocks.
+
+Synthetic TTS-like blocks (24 kHz mono, with leading/trailing silence and uneven levels)
+are written to a temporary folder first.
+
+Usage:
+    python -m benchmarks.audio_postprocess_benchmark [blocks] [block_seconds]
+"""
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from app.wav_handler import concatenate_audio_blocks, PostProcessingOptions
+
+SAMPLE_RATE = 24000
+
+
+def write_blocks(folder: Path, blocks: int, block_seconds: float):
+    rng = np.random.default_rng(0)
+    frames = int(block_seconds * SAMPLE_RATE)
+    silence = np.zeros(int(0.8 * SAMPLE_RATE))
+    for index in range(1, blocks + 1):
+        level = rng.uniform(0.05, 0.6)
+        speech = level * 32767 * np.sin(np.arange(frames) * 2 * np.pi * 180 / SAMPLE_RATE) * rng.uniform(0.3, 1, frames)
+        samples = np.concatenate([silence, speech, silence]).astype("<i2")
+        with wave.open(str(folder / f"block{index}.wav"), "wb") as block:
+            block.setnchannels(1)
+            block.setsampwidth(2)
+            block.setframerate(SAMPLE_RATE)
+            block.writeframes(samples.tobytes())
+
+
+def timed(blocks_dir: Path, output_dir: Path, options) -> float:
+    started = time.perf_counter()
+    concatenate_audio_blocks(blocks_dir, output_dir, post_processing=options)
+    return time.perf_counter() - started
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    block_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        blocks_dir, output_dir = Path(work_dir) / "blocks", Path(work_dir) / "final"
+        blocks_dir.mkdir()
+        output_dir.mkdir()
+        write_blocks(blocks_dir, blocks, block_seconds)
+
+        plain = timed(blocks_dir, output_dir, None)
+        processed = timed(blocks_dir, output_dir, PostProcessingOptions())
+        output_size = (output_dir / "final_audio.wav").stat().st_size
+
+    print(f"{blocks} blocks of {block_seconds:.0f}s ({output_size / 1e6:.0f} MB output)")
+    print(f"plain concatenation        {plain:6.2f} s")
+    print(f"with post-processing       {processed:6.2f} s  (+{(processed - plain) / plain * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares the TTS requests needed per book by the old fixed 1000-character splitter and by the
+planned block size with the paragraph/sentence splitter.
+
+Pass a .txt or .pdf file to measure a real book; otherwise a synthetic ~400k-character book
+with paragraphs and sentences of varied length is used.
+
+Usage:
+    python -m benchmarks.block_planner_benchmark [book.txt|book.pdf]
+"""
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+from app.block_planner import BlockSizePlanner
+from app.pdf_handler import extract_text_from_pdf, split_text_into_blocks
+
+LEGACY_CHARACTER_LIMIT = 1000
+
+
+def legacy_split_text_into_blocks(text: str, limit: int) -> list[str]:
+    """The splitter as it was before the block planner (kept here for comparison)."""
+    blocks = []
+    sentences = re.split(r'(?<=[.!?])\s+', text.replace('\n', ' '))
+    current_block = ""
+
+    for sentence in sentences:
+        if len(current_block) + len(sentence) + 1 <= limit:
+            current_block += sentence + " "
+        else:
+            if current_block:
+                blocks.append(current_block.strip())
+            current_block = sentence + " "
+
+    if current_block:
+        blocks.append(current_block.strip())
+
+    return blocks
+
+
+def synthetic_book(characters: int = 400_000) -> str:
+    rng = random.Random(0)
+    words = ("the old house stood at the end of a long road where nobody had walked for years and "
+             "every window looked out over fields of tall grass bending in the evening wind").split()
+    paragraphs, total = [], 0
+    while total < characters:
+        sentences = []
+        for _ in range(rng.randint(1, 8)):
+            length = max(3, int(rng.lognormvariate(2.7, 0.6)))  # mostly 10-30 words, a few very long
+            sentences.append(" ".join(rng.choice(words) for _ in range(length)).capitalize() + ".")
+        paragraphs.append(" ".join(sentences))
+        total += len(paragraphs[-1])
+    return "\n\n".join(paragraphs)
+
+
+def describe(name: str, blocks: list[str], elapsed: float):
+    lengths = [len(block) for block in blocks]
+    print(f"{name:<28} {len(blocks):6d} requests   avg {sum(lengths) / len(lengths):6.0f}   "
+          f"max {max(lengths):6d} chars   {elapsed * 1000:6.1f} ms")
+
+
+def main():
+    if len(sys.argv) > 1:
+        source = Path(sys.argv[1])
+        text = extract_text_from_pdf(source) if source.suffix.lower() == ".pdf" else source.read_text(encoding="utf-8")
+    else:
+        text = synthetic_book()
+    block_size = BlockSizePlanner.model_block_limit()
+    print(f"book: {len(text)} characters, planned block size: {block_size}")
+
+    started = time.perf_counter()
+    legacy_blocks = legacy_split_text_into_blocks(text, LEGACY_CHARACTER_LIMIT)
+    describe("fixed 1000 (old splitter)", legacy_blocks, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    planned_blocks = split_text_into_blocks(text, block_size)
+    describe(f"planned {block_size} (new splitter)", planned_blocks, time.perf_counter() - started)
+
+    print(f"requests saved: {1 - len(planned_blocks) / len(legacy_blocks):.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Load test of the HTTP API: concurrent `/create-job` uploads, `/status` polls and `/download`
+streams against one uvicorn process, with the TTS and LLM backends stubbed locally (see
+`benchmarks.load_test_server`). The pipelines of the uploaded jobs run inside the same
+process, as in production.
+
+Reports p50/p95/p99 latency per endpoint, the event-loop lag, and every handler or task
+that held the loop for longer than the slow-callback threshold.
+
+Usage:
+    python -m benchmarks.load_test [--duration 60] [--uploaders 2] [--pollers 50]
+        [--poll-interval 3] [--downloaders 4] [--story-every 30] [--slow-callback-ms 50]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.block_planner_benchmark import synthetic_book
+
+# Upload sizes in characters and how often each occurs: mostly articles and short books, a few long ones.
+UPLOAD_MIX = [(20_000, 0.5), (150_000, 0.35), (900_000, 0.15)]
+SERVER_START_TIMEOUT_SECONDS = 30
+
+
+class LatencyLog:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool = True):
+        self.samples.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.log = LatencyLog()
+        self.jobs: List[str] = []
+        self.completed_jobs: List[str] = []
+        self.deadline = time.monotonic() + args.duration
+        self.books = {size: synthetic_book(size).encode("utf-8") for size, _ in UPLOAD_MIX}
+
+    def running(self) -> bool:
+        return time.monotonic() < self.deadline
+
+    async def timed(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.log.record(endpoint, time.perf_counter() - started, ok=False)
+            raise
+        self.log.record(endpoint, time.perf_counter() - started, ok=response.status_code < 500)
+        return response
+
+    async def uploader(self, rng: random.Random):
+        while self.running():
+            size = rng.choices([size for size, _ in UPLOAD_MIX], weights=[weight for _, weight in UPLOAD_MIX])[0]
+            try:
+                response = await self.timed("POST /create-job", "POST", "/create-job",
+                                            files={"file": (f"book-{size}.txt", self.books[size], "text/plain")})
+                if response.status_code == 200:
+                    self.jobs.append(response.json()["job_id"])
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(rng.expovariate(1 / self.args.upload_interval))
+
+    async def story_creator(self, rng: random.Random):
+        while self.args.story_every and self.running():
+            await asyncio.sleep(rng.expovariate(1 / self.args.story_every))
+            endpoint = rng.choice(["/create-story-job", "/create-story-audiobook-job"])
+            try:
+                response = await self.timed(f"POST {endpoint}", "POST", endpoint, json={
+                    "name": "Load test", "summary": "A story written by the load test stub.",
+                    "chapters": 3, "chars_per_chapter": 3000})
+                if response.status_code == 200:
+                    self.jobs.append(response.json()["job_id"])
+            except httpx.HTTPError:
+                pass
+
+    async def poller(self, rng: random.Random):
+        await asyncio.sleep(rng.uniform(0, self.args.poll_interval))
+        while self.running():
+            if self.jobs:
+                job_id = rng.choice(self.jobs)
+                try:
+                    response = await self.timed("GET /status/{job_id}", "GET", f"/status/{job_id}")
+                    if response.json().get("status") == "complete" and job_id not in self.completed_jobs:
+                        self.completed_jobs.append(job_id)
+                except (httpx.HTTPError, ValueError):
+                    pass
+            await asyncio.sleep(self.args.poll_interval * rng.uniform(0.8, 1.2))
+
+    async def downloader(self, rng: random.Random):
+        while self.running():
+            if not self.completed_jobs:
+                await asyncio.sleep(0.5)
+                continue
+            job_id = rng.choice(self.completed_jobs)
+            # Players mostly fetch ranges; some clients download the whole file.
+            headers = {"Range": f"bytes={rng.randrange(0, 1 << 20)}-"} if rng.random() < 0.7 else {}
+            endpoint = "GET /download/{job_id} (range)" if headers else "GET /download/{job_id}"
+            started = time.perf_counter()
+            try:
+                async with self.client.stream("GET", f"/download/{job_id}", headers=headers) as response:
+                    async for _ in response.aiter_bytes():
+                        pass
+                    self.log.record(endpoint, time.perf_counter() - started, ok=response.status_code < 500)
+            except httpx.HTTPError:
+                self.log.record(endpoint, time.perf_counter() - started, ok=False)
+
+    async def run(self):
+        rng = random.Random(0)
+        tasks = [self.uploader(random.Random(rng.random())) for _ in range(self.args.uploaders)]
+        tasks += [self.poller(random.Random(rng.random())) for _ in range(self.args.pollers)]
+        tasks += [self.downloader(random.Random(rng.random())) for _ in range(self.args.downloaders)]
+        tasks.append(self.story_creator(random.Random(rng.random())))
+        await asyncio.gather(*tasks)
+
+
+def start_server(port: int, data_dir: Path, slow_callback_ms: float, log_path: Path) -> subprocess.Popen:
+    env = dict(os.environ, LOAD_TEST_DATA_DIR=str(data_dir), LOAD_TEST_SLOW_CALLBACK_MS=str(slow_callback_ms))
+    env.setdefault("GEMINI_API_KEY", "load-test-key")
+    env.setdefault("GEMINI_TEXT_MODEL", "load-test-model")
+    env.setdefault("GEMINI_TTS_MODEL", "load-test-model")
+    env.setdefault("MAX_CONCURRENT_REQUESTS", "5")
+    env.setdefault("API_REQUEST_LIMIT", "1000")
+    env.setdefault("API_REQUEST_WINDOW_SECONDS", "60")
+    with open(log_path, "w") as log_file:
+        return subprocess.Popen([sys.executable, "-m", "benchmarks.load_test_server", "--port", str(port)],
+                                env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+async def wait_for_server(client: httpx.AsyncClient, server: subprocess.Popen):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The load test server exited during startup.")
+        try:
+            await client.get("/status/startup-probe")
+            return
+        except httpx.HTTPError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("The load test server did not start in time.")
+
+
+def report(log: LatencyLog, stats: dict, slow_callback_ms: float):
+    print(f"\n{'endpoint':<36} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for endpoint, samples in sorted(log.samples.items()):
+        print(f"{endpoint:<36} {len(samples):8d} {log.errors.get(endpoint, 0):6d} "
+              f"{percentile(samples, .5) * 1000:8.1f} {percentile(samples, .95) * 1000:8.1f} "
+              f"{percentile(samples, .99) * 1000:8.1f} {max(samples) * 1000:8.1f}")
+
+    lags = stats["lags"]
+    print(f"\nevent-loop lag over {len(lags)} samples: p50 {percentile(lags, .5) * 1000:.1f} ms, "
+          f"p95 {percentile(lags, .95) * 1000:.1f} ms, p99 {percentile(lags, .99) * 1000:.1f} ms, "
+          f"max {max(lags, default=0) * 1000:.1f} ms")
+
+    if not stats["slow_callbacks"]:
+        print(f"No handler or task held the event loop for more than {slow_callback_ms:.0f} ms.")
+        return
+    print(f"\nBLOCKING: callbacks that held the event loop for more than {slow_callback_ms:.0f} ms")
+    for name, culprit in sorted(stats["slow_callbacks"].items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"  {name:<48} {culprit['count']:5d}x  max {culprit['max_ms']:8.1f} ms  "
+              f"total {culprit['total_ms']:9.1f} ms")
+    in_flight = {}
+    for spike in stats["spikes"]:
+        for endpoint in spike["in_flight"]:
+            in_flight[endpoint] = in_flight.get(endpoint, 0) + 1
+    if in_flight:
+        print("  endpoints in flight during lag spikes: " + ", ".join(
+            f"{endpoint} ({count})" for endpoint, count in sorted(in_flight.items(), key=lambda item: -item[1])))
+
+
+async def main_async(args: argparse.Namespace):
+    with tempfile.TemporaryDirectory() as work_dir:
+        server = start_server(args.port, Path(work_dir) / "jobs", args.slow_callback_ms, Path(work_dir) / "server.log")
+        try:
+            limits = httpx.Limits(max_connections=args.pollers + args.uploaders + args.downloaders + 4)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=120,
+                                         limits=limits) as client:
+                await wait_for_server(client, server)
+                print(f"Running for {args.duration}s: {args.uploaders} uploader(s), {args.pollers} poller(s) "
+                      f"every {args.poll_interval}s, {args.downloaders} downloader(s)...")
+                load_test = LoadTest(client, args)
+                await load_test.run()
+                stats = (await client.get("/__load-test/stats")).json()
+                print(f"{len(load_test.jobs)} job(s) created, {len(load_test.completed_jobs)} completed during the run.")
+                report(load_test.log, stats, args.slow_callback_ms)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:  # still waiting for the background jobs to finish
+                server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP API with stubbed TTS/LLM backends.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of load (default: 60).")
+    parser.add_argument("--uploaders", type=int, default=2, help="Clients uploading documents.")
+    parser.add_argument("--upload-interval", type=float, default=5, help="Mean seconds between uploads per uploader.")
+    parser.add_argument("--pollers", type=int, default=50, help="Clients polling /status (the web UI polls every 3s).")
+    parser.add_argument("--poll-interval", type=float, default=3, help="Seconds between polls per client.")
+    parser.add_argument("--downloaders", type=int, default=4, help="Clients streaming finished audiobooks.")
+    parser.add_argument("--story-every", type=float, default=30,
+                        help="Mean seconds between story jobs (0 disables them).")
+    parser.add_argument("--slow-callback-ms", type=float, default=50,
+                        help="Loop blocking threshold for flagging a handler (default: 50 ms).")
+    parser.add_argument("--port", type=int, default=8765)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
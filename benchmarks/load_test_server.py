@@ -0,0 +1,206 @@
+"""
+Runs `app.main` under uvicorn for the load test, with the TTS and LLM backends stubbed locally
+and an event-loop lag probe.
+
+The stubs keep the real pipeline code paths: the TTS stub is called from a worker thread like
+the real one and writes a WAV as long as the narration of its text would be (scaled by
+LOAD_TEST_AUDIO_SCALE), and the LLM stub writes chapters after a modeled delay. The probe
+measures how late a 10 ms timer fires, and asyncio's debug mode names every callback that
+held the loop longer than LOAD_TEST_SLOW_CALLBACK_MS. Both are served at /__load-test/stats.
+
+Started by `benchmarks.load_test`; it can also be run on its own:
+    LOAD_TEST_DATA_DIR=/tmp/load-test python -m benchmarks.load_test_server --port 8765
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+import wave
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+os.environ.setdefault("PREWARM_ON_STARTUP", "false")
+os.environ.setdefault("RESUME_JOBS_ON_STARTUP", "false")
+os.environ.setdefault("AUDIO_VALIDATION", "false")  # the stub writes scaled-down noise, not narration
+
+import uvicorn
+
+import app.gemini_audiobook_creator
+import app.main
+import app.processor
+import app.story_creator
+from app.gemini_audiobook_creator import TtsTiming
+from benchmarks.block_planner_benchmark import synthetic_book
+
+SAMPLE_RATE = 24000
+SPOKEN_CHARACTERS_PER_SECOND = 15
+PROBE_INTERVAL_SECONDS = 0.01
+JOB_ID_PATTERN = re.compile(r"/[0-9a-f]{8}-[0-9a-f-]{27}")
+
+AUDIO_SCALE = float(os.environ.get("LOAD_TEST_AUDIO_SCALE", "0.1"))  # share of the real narration length written
+TTS_LATENCY_SECONDS = float(os.environ.get("LOAD_TEST_TTS_LATENCY", "0.5"))
+LLM_LATENCY_SECONDS = float(os.environ.get("LOAD_TEST_LLM_LATENCY", "1.0"))
+SLOW_CALLBACK_SECONDS = float(os.environ.get("LOAD_TEST_SLOW_CALLBACK_MS", "50")) / 1000
+
+
+# --- Backend stubs ---
+def stub_generate_and_save_tts(api_key: str, text_content: str, output_audio_path, stop_event=None,
+                               timeout_seconds=None) -> TtsTiming:
+    """Stands in for `sync_generate_and_save_tts` (runs in a worker thread, like the real one)."""
+    started = time.perf_counter()
+    time.sleep(random.uniform(0.5, 1.5) * TTS_LATENCY_SECONDS)
+    frames = int(len(text_content) / SPOKEN_CHARACTERS_PER_SECOND * AUDIO_SCALE * SAMPLE_RATE)
+    with wave.open(str(output_audio_path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(os.urandom(2 * frames))
+    elapsed = time.perf_counter() - started
+    return TtsTiming(first_audio_seconds=elapsed / 2, total_seconds=elapsed, audio_bytes=2 * frames)
+
+
+async def stub_generate_story_with_memory(api_key, initial_prompt, chapter_prompts, progress_callback=None,
+                                          chapter_callback=None, key_manager=None, checkpoint=None) -> str:
+    """Stands in for `generate_story_with_memory`: one synthetic chapter per prompt."""
+    chapters = []
+    for batch_index, _ in enumerate(chapter_prompts, start=1):
+        await asyncio.sleep(random.uniform(0.5, 1.5) * LLM_LATENCY_SECONDS)
+        chapters.append(f"Chapter {batch_index}\n\n" + synthetic_book(3000))
+        if chapter_callback is not None:
+            await chapter_callback(batch_index, chapters[-1])
+        if progress_callback is not None:
+            progress_callback()
+    return "\n\n".join(chapters)
+
+
+app.gemini_audiobook_creator.sync_generate_and_save_tts = stub_generate_and_save_tts
+app.processor.generate_story_with_memory = stub_generate_story_with_memory
+app.story_creator.generate_story_with_memory = stub_generate_story_with_memory
+
+
+# --- Event-loop probes ---
+class LoopLagProbe:
+    """Samples how late the loop runs a 10 ms timer, and which endpoints were in flight during a spike."""
+
+    def __init__(self):
+        self.lags = []
+        self.spikes = []
+        self.in_flight = {}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + PROBE_INTERVAL_SECONDS
+            await asyncio.sleep(PROBE_INTERVAL_SECONDS)
+            lag = max(loop.time() - expected, 0.0)
+            self.lags.append(lag)
+            if lag >= SLOW_CALLBACK_SECONDS:
+                self.spikes.append({"lag_ms": round(lag * 1000, 1),
+                                    "in_flight": sorted(name for name, count in self.in_flight.items() if count)})
+
+
+class SlowCallbackRecorder(logging.Handler):
+    """
+    Collects asyncio's debug-mode 'Executing <...> took N seconds' warnings. A request's
+    handler and its background tasks run in the request's task, so slow steps of that task
+    are reported under the endpoint and the phase (handler or background task) it was in.
+    """
+
+    PATTERN = re.compile(r"Executing (.*) took (\d+\.\d+) seconds")
+    TASK_PATTERN = re.compile(r"name='([^']+)'")
+    CORO_PATTERN = re.compile(r"coro=<([\w.<>]+)\(")
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.culprits = {}
+        self.request_tasks = {}  # task name -> [endpoint, phase]
+
+    def culprit_name(self, handle: str) -> str:
+        task = self.TASK_PATTERN.search(handle)
+        if task and task.group(1) in self.request_tasks:
+            endpoint, phase = self.request_tasks[task.group(1)]
+            return f"{endpoint} ({phase})"
+        coroutine = self.CORO_PATTERN.search(handle)
+        return coroutine.group(1) if coroutine else handle.split(" created at ")[0][:60]
+
+    def emit(self, record: logging.LogRecord):
+        match = self.PATTERN.search(record.getMessage())
+        if not match:
+            return
+        name = self.culprit_name(match.group(1))
+        seconds = float(match.group(2))
+        culprit = self.culprits.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        culprit["count"] += 1
+        culprit["total_ms"] = round(culprit["total_ms"] + seconds * 1000, 1)
+        culprit["max_ms"] = max(culprit["max_ms"], round(seconds * 1000, 1))
+
+
+probe = LoopLagProbe()
+slow_callbacks = SlowCallbackRecorder()
+logging.getLogger("asyncio").addHandler(slow_callbacks)
+application = app.main.app
+app.main.DATA_DIR = Path(os.environ.get("LOAD_TEST_DATA_DIR", "data/load-test"))
+app.main.DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+original_lifespan = application.router.lifespan_context
+
+
+@asynccontextmanager
+async def lifespan_with_probe(fastapi_app):
+    loop = asyncio.get_running_loop()
+    loop.set_debug(True)
+    loop.slow_callback_duration = SLOW_CALLBACK_SECONDS
+    async with original_lifespan(fastapi_app):
+        probe_task = asyncio.create_task(probe.run())
+        yield
+        probe_task.cancel()
+
+
+application.router.lifespan_context = lifespan_with_probe
+
+
+class InFlightMiddleware:
+    """Counts the requests in flight per endpoint, until their response body is fully sent."""
+
+    def __init__(self, asgi_app):
+        self.app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        name = f"{scope['method']} {JOB_ID_PATTERN.sub('/{job_id}', scope['path'])}"
+        request_task = [name, "handler"]
+        slow_callbacks.request_tasks[asyncio.current_task().get_name()] = request_task
+
+        async def send_and_track(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                request_task[1] = "background task"  # Starlette runs BackgroundTasks after the response
+
+        probe.in_flight[name] = probe.in_flight.get(name, 0) + 1
+        try:
+            await self.app(scope, receive, send_and_track)
+        finally:
+            probe.in_flight[name] -= 1
+
+
+application.add_middleware(InFlightMiddleware)
+
+
+@application.get("/__load-test/stats")
+async def load_test_stats():
+    return {"lags": probe.lags, "spikes": probe.spikes[-200:], "slow_callbacks": slow_callbacks.culprits}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    uvicorn.run(application, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmarks story PDF rendering: the previous single-multi_cell `create_pdf` against the
+chapter-by-chapter renderer, whose documents copy a font parsed once per process.
+
+Usage:
+    python -m benchmarks.pdf_render_benchmark
+"""
+import tempfile
+import time
+from pathlib import Path
+
+from fpdf import FPDF
+
+from app.pdf_renderer import FONT_PATH, render_story_pdf
+
+STORY_SIZES = [10_000, 50_000, 100_000, 200_000]
+CHAPTER_SIZE = 10_000
+PARAGRAPH = ("Era uma vez, numa cidade cercada de montanhas, uma menina que colecionava mapas antigos. "
+             "Todas as noites ela estudava as linhas apagadas, imaginando os caminhos esquecidos. ") * 4
+
+
+def build_story(total_chars: int) -> list[str]:
+    """Builds chapter texts with headings and paragraphs adding up to about `total_chars`."""
+    chapters = []
+    chapter_number = 1
+    remaining = total_chars
+    while remaining > 0:
+        paragraphs = []
+        chapter_chars = 0
+        while chapter_chars < min(CHAPTER_SIZE, remaining):
+            paragraphs.append(PARAGRAPH)
+            chapter_chars += len(PARAGRAPH) + 2
+        chapters.append(f"Capítulo {chapter_number}: Os Mapas\n\n" + "\n\n".join(paragraphs))
+        remaining -= chapter_chars
+        chapter_number += 1
+    return chapters
+
+
+def legacy_create_pdf(title: str, content: str, output_path: Path):
+    """The previous implementation: parse the font every time and write one giant multi_cell."""
+    pdf = FPDF()
+    pdf.set_title(title)
+    pdf.add_font("DejaVu", "", str(FONT_PATH))
+    pdf.add_page()
+    pdf.set_font("DejaVu", size=12)
+    pdf.multi_cell(0, 10, content)
+    pdf.output(str(output_path))
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    # Parse the font once, like a long-running server process would (see load_font_template).
+    with tempfile.TemporaryDirectory() as tmp:
+        render_story_pdf("warmup", ["Capítulo 1\n\nwarmup"], Path(tmp) / "warmup.pdf")
+
+    print(f"{'chars':>8} | {'legacy s':>9} | {'legacy KB':>9} | {'new s':>7} | {'new KB':>7} | speedup")
+    print("-" * 62)
+    for size in STORY_SIZES:
+        chapters = build_story(size)
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy_path = Path(tmp) / "legacy.pdf"
+            new_path = Path(tmp) / "new.pdf"
+            legacy_seconds = timed(legacy_create_pdf, "bench", "\n\n".join(chapters), legacy_path)
+            new_seconds = timed(render_story_pdf, "bench", chapters, new_path)
+            print(f"{size:>8} | {legacy_seconds:>9.2f} | {legacy_path.stat().st_size / 1024:>9.1f} | "
+                  f"{new_seconds:>7.2f} | {new_path.stat().st_size / 1024:>7.1f} | "
+                  f"{legacy_seconds / new_seconds:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Measures the cold start of the API process: how long `import app.main` takes, which heavy
+dependencies it pulls in, and how long until `/status` answers through the app's lifespan.
+
+Every measurement runs in a fresh interpreter, like a worker restart or a new replica.
+
+Usage:
+    python -m benchmarks.startup_benchmark [runs]
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ["google.genai", "google.api_core", "numpy", "fpdf", "PyPDF2", "fontTools"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    client.get("/status/warmup-probe")
+    first_response = time.perf_counter()
+
+print(json.dumps({
+    "import": imported - started,
+    "first_status": first_response - started,
+    "heavy_at_import": HEAVY_AT_IMPORT,
+}))
+"""
+
+
+def run_probe() -> dict:
+    # The heavy-module check must happen right after the import, before the lifespan pre-warm kicks in.
+    probe = PROBE.replace(
+        "imported = time.perf_counter()\n",
+        "imported = time.perf_counter()\n"
+        f"HEAVY_AT_IMPORT = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n",
+    )
+    output = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_probe() for _ in range(runs)]
+
+    import_times = [r["import"] for r in results]
+    status_times = [r["first_status"] for r in results]
+    print(f"runs: {runs}")
+    print(f"import app.main      median {statistics.median(import_times) * 1000:7.1f} ms  "
+          f"max {max(import_times) * 1000:7.1f} ms")
+    print(f"first /status answer median {statistics.median(status_times) * 1000:7.1f} ms  "
+          f"max {max(status_times) * 1000:7.1f} ms")
+    print(f"heavy modules loaded by the import: {results[0]['heavy_at_import'] or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import re
+import threading
+
+from app.pdf_renderer import StoryPdfRenderer, load_font_template, new_document, split_chapters
+
+BFCHAR_PATTERN = re.compile(rb"beginbfchar\n(.*?)endbfchar", re.S)
+MAPPING_PATTERN = re.compile(rb"<[0-9A-F]{4}> <([0-9A-F]{4,})>")
+
+
+def embedded_characters(pdf_path) -> set:
+    """The characters the embedded font subset maps back to Unicode (its ToUnicode CMap)."""
+    data = pdf_path.read_bytes()
+    return {chr(int(code, 16)) for block in BFCHAR_PATTERN.findall(data)
+            for code in MAPPING_PATTERN.findall(block)} - {"\0", " "}
+
+
+def render(title: str, text: str, output_path):
+    renderer = StoryPdfRenderer(title)
+    renderer.add_text(text)
+    renderer.save(output_path)
+
+
+def test_rendered_pdf_embeds_the_text(tmp_path):
+    render("Story", "Capítulo 1: Ação\n\nOlá, mundo!", tmp_path / "story.pdf")
+
+    assert embedded_characters(tmp_path / "story.pdf") == set("Capítulo1:AçãoOlá,mundo!")
+
+
+def test_documents_rendered_at_the_same_time_keep_their_own_font_subsets(tmp_path):
+    texts = {"first": "Zebra " * 2000, "second": "Ωmega ção " * 2000, "third": "quick fox " * 2000}
+    threads = [threading.Thread(target=render, args=(name, text, tmp_path / f"{name}.pdf"))
+               for name, text in texts.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for name, text in texts.items():
+        assert embedded_characters(tmp_path / f"{name}.pdf") == set(text) - {" "}
+
+
+def test_documents_share_the_parsed_font_but_not_what_writing_changes():
+    first, second = new_document(), new_document()
+
+    assert load_font_template() is load_font_template()
+    assert first.fonts.keys() == second.fonts.keys() == load_font_template().fonts.keys()
+    for key in first.fonts:
+        assert first.fonts[key].ttfont is not second.fonts[key].ttfont
+        assert first.fonts[key].ttfont is not load_font_template().fonts[key].ttfont
+        assert first.fonts[key].desc is not second.fonts[key].desc
+
+
+def test_split_chapters_keeps_the_preamble():
+    assert split_chapters("Prologue\n\nChapter 1\nOne\nChapter 2 - End\nTwo") == [
+        (None, "Prologue"), ("Chapter 1", "One"), ("Chapter 2 - End", "Two")]
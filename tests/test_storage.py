@@ -0,0 +1,192 @@
+import io
+import os
+
+import pytest
+
+from app.storage import MULTIPART_PART_BYTES, MULTIPART_THRESHOLD_BYTES, CachedStorage, LocalStorage, \
+    S3Storage, Storage, validate_key
+
+
+class MissingObjectError(Exception):
+    """Shaped like botocore's ClientError for a missing object."""
+
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class StubS3Client:
+    """An in-memory stand-in for the boto3 S3 client, with the calls S3Storage makes."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append("put_object")
+        self.objects[Key] = bytes(Body)
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.calls.append("create_multipart_upload")
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append("upload_part")
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append("complete_multipart_upload")
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append("abort_multipart_upload")
+        self.uploads.pop(UploadId, None)
+
+    def get_object(self, Bucket, Key):
+        self.calls.append("get_object")
+        if Key not in self.objects:
+            raise MissingObjectError("NoSuchKey")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise MissingObjectError("404")
+        return {"ContentLength": len(self.objects[Key])}
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + 2]  # small pages, so the pagination is exercised
+        response = {"Contents": [{"Key": key} for key in page], "IsTruncated": start + 2 < len(keys)}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + 2)
+        return response
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete["Objects"]:
+            self.objects.pop(item["Key"], None)
+
+
+@pytest.fixture
+def s3_client():
+    return StubS3Client()
+
+
+@pytest.fixture
+def s3_storage(s3_client):
+    return S3Storage("bucket", prefix="jobs", client=s3_client)
+
+
+def test_storage_backends_must_implement_every_method():
+    class PartialStorage(Storage):
+        def open_read(self, key):
+            return io.BytesIO()
+
+    with pytest.raises(TypeError):
+        PartialStorage()
+
+
+@pytest.mark.parametrize("key", ["", "/job/a.wav", "job/../../etc/passwd", "job\\a.wav"])
+def test_validate_key_rejects_keys_outside_the_storage(key):
+    with pytest.raises(ValueError):
+        validate_key(key)
+
+
+def test_local_storage_round_trip(tmp_path):
+    storage = LocalStorage(tmp_path)
+    storage.write_stream("job/final/a.txt", iter([b"hello ", b"world"]))
+
+    assert storage.local_path("job/final/a.txt").read_bytes() == b"hello world"
+    assert storage.size("job/final/a.txt") == 11
+    assert storage.list_keys("job") == ["job/final/a.txt"]
+    storage.delete_prefix("job")
+    assert not storage.exists("job/final/a.txt")
+    assert storage.local_path("job/final/a.txt") is None
+
+
+def test_s3_put_get_exists_and_delete_prefix(s3_storage, s3_client, tmp_path):
+    s3_storage.write_stream("job/final/a.txt", iter([b"hello"]))
+    s3_storage.write_stream("job/final/b.txt", iter([b"b"]))
+    s3_storage.write_stream("job/input/c.pdf", iter([b"c"]))
+    s3_storage.write_stream("other/d.txt", iter([b"d"]))
+
+    assert s3_client.objects["jobs/job/final/a.txt"] == b"hello"
+    assert b"".join(s3_storage.iter_chunks("job/final/a.txt")) == b"hello"
+    assert s3_storage.exists("job/final/a.txt")
+    assert not s3_storage.exists("job/final/missing.txt")
+    with pytest.raises(FileNotFoundError):
+        s3_storage.open_read("job/final/missing.txt")
+    assert s3_storage.list_keys("job") == ["job/final/a.txt", "job/final/b.txt", "job/input/c.pdf"]
+
+    s3_storage.download_file("job/input/c.pdf", tmp_path / "c.pdf")
+    assert (tmp_path / "c.pdf").read_bytes() == b"c"
+
+    s3_storage.delete_prefix("job")
+    assert list(s3_client.objects) == ["jobs/other/d.txt"]
+
+
+def test_s3_large_files_use_multipart_uploads(s3_storage, s3_client, tmp_path):
+    data = os.urandom(MULTIPART_THRESHOLD_BYTES + MULTIPART_PART_BYTES // 2)
+    (tmp_path / "final_audio.wav").write_bytes(data)
+
+    s3_storage.upload_file("job/final_audio.wav", tmp_path / "final_audio.wav")
+
+    assert "put_object" not in s3_client.calls
+    assert s3_client.calls.count("upload_part") == 3
+    assert s3_client.objects["jobs/job/final_audio.wav"] == data
+
+
+def test_s3_failed_multipart_upload_is_aborted(s3_storage, s3_client):
+    def failing_chunks():
+        yield b"x" * MULTIPART_THRESHOLD_BYTES
+        raise OSError("disk read failed")
+
+    with pytest.raises(OSError):
+        s3_storage.write_stream("job/final_audio.wav", failing_chunks())
+    assert "abort_multipart_upload" in s3_client.calls
+    assert not s3_client.uploads and not s3_client.objects
+
+
+def test_cache_reads_through_once(s3_storage, s3_client, tmp_path):
+    cache = CachedStorage(s3_storage, tmp_path / "cache", max_bytes=1024)
+    cache.write_stream("job/a.txt", iter([b"hello"]))
+
+    path = cache.local_path("job/a.txt")
+    assert path.read_bytes() == b"hello"
+    cache.release("job/a.txt")
+    assert cache.local_path("job/a.txt") == path
+    cache.release("job/a.txt")
+    assert s3_client.calls.count("get_object") == 1
+    assert cache.local_path("job/missing.txt") is None
+
+    cache.write_stream("job/a.txt", iter([b"changed"]))  # drops the cached copy
+    assert cache.local_path("job/a.txt").read_bytes() == b"changed"
+
+
+def test_cache_evicts_least_recently_used_files_not_in_use(s3_storage, tmp_path):
+    cache = CachedStorage(s3_storage, tmp_path / "cache", max_bytes=250)
+    for name in ("a", "b", "c"):
+        cache.write_stream(f"job/{name}", iter([b"x" * 100]))
+
+    in_use = cache.local_path("job/a")
+    old = cache.local_path("job/b")
+    cache.release("job/b")
+    os.utime(in_use, (0, 0))  # the least recently used file, but still being served
+    newest = cache.local_path("job/c")
+
+    assert in_use.exists() and newest.exists()
+    assert not old.exists()
+
+
+def test_cache_streams_objects_larger_than_the_cache(s3_storage, tmp_path):
+    cache = CachedStorage(s3_storage, tmp_path / "cache", max_bytes=10)
+    cache.write_stream("job/final_audio.wav", iter([b"x" * 100]))
+
+    assert cache.local_path("job/final_audio.wav") is None
+    assert b"".join(cache.iter_chunks("job/final_audio.wav")) == b"x" * 100
+    assert not (tmp_path / "cache" / "job" / "final_audio.wav").exists()